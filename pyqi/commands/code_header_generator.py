@@ -20,6 +20,8 @@ class CodeHeaderGenerator(Command):
                        "information, such as author, email address, "
                        "maintainer, version, etc.. This code can be placed at "
                        "the top of a Python file.")
+    # Only formats strings, so identical calls can share their result.
+    Deduplicate = True
 
     CommandIns = ParameterCollection([
         CommandIn(Name='author', DataType=str,
@@ -26,7 +26,77 @@ class ServeHTMLInterface(Command):
 
         CommandIn(Name='interface_module', DataType=str,
                   Description='The module to serve the interface for',
-                  Required=True)
+                  Required=True),
+
+        CommandIn(Name='server_mode', DataType=str,
+                  Description="How to handle concurrent requests: 'single' "
+                              "(one at a time), 'threaded' (on a pool of "
+                              "threads), 'prefork' (in forked processes), "
+                              "or 'asyncio' (connections on an event loop, "
+                              "requests on a pool of threads)",
+                  Required=False, Default='single'),
+
+        CommandIn(Name='workers', DataType=int,
+                  Description='The number of threads or processes to handle '
+                              'requests with in threaded, prefork or '
+                              'asyncio mode',
+                  Required=False, Default=8),
+
+        CommandIn(Name='backlog', DataType=int,
+                  Description='The number of connections that can wait to be '
+                              'accepted',
+                  Required=False, Default=128),
+
+        CommandIn(Name='max_request_size', DataType=int,
+                  Description='The largest POST, in bytes, to accept '
+                              '(default: no limit)',
+                  Required=False, Default=None),
+
+        CommandIn(Name='job_workers', DataType=int,
+                  Description='The number of commands submitted as jobs to '
+                              'run at once',
+                  Required=False, Default=2),
+
+        CommandIn(Name='max_queued_jobs', DataType=int,
+                  Description='The number of jobs that can wait to run; '
+                              'further jobs are refused',
+                  Required=False, Default=100),
+
+        CommandIn(Name='job_retention', DataType=int,
+                  Description='The number of seconds to keep the results of '
+                              'finished jobs',
+                  Required=False, Default=3600),
+
+        CommandIn(Name='max_concurrent_commands', DataType=int,
+                  Description='The number of commands that can run at once '
+                              '(in each process); by default, there is no '
+                              'limit',
+                  Required=False, Default=None),
+
+        CommandIn(Name='max_waiting_commands', DataType=int,
+                  Description='The number of commands that can wait for '
+                              'others to finish when '
+                              'max_concurrent_commands are running; '
+                              'further commands are refused',
+                  Required=False, Default=0),
+
+        CommandIn(Name='warmup', DataType=bool,
+                  Description='Load the resources of every command before '
+                              'serving, so the first requests are not slow',
+                  Required=False, Default=False),
+
+        CommandIn(Name='max_worker_requests', DataType=int,
+                  Description='In prefork mode, replace a worker process '
+                              'after it handles about this many requests; '
+                              'by default, workers are not replaced',
+                  Required=False, Default=None),
+
+        CommandIn(Name='max_worker_memory', DataType=int,
+                  Description='In prefork mode, replace a worker process '
+                              'once its own memory has grown by more than '
+                              'this many megabytes; by default, workers are '
+                              'not replaced',
+                  Required=False, Default=None)
     ])
 
     CommandOuts = ParameterCollection([
@@ -37,7 +107,21 @@ class ServeHTMLInterface(Command):
 
     def run(self, **kwargs):
         """Start the HTMLInterface server with the port and interface_module"""
-        fin = start_server(kwargs['port'], kwargs['interface_module'])
+        fin = start_server(kwargs['port'], kwargs['interface_module'],
+                           server_mode=kwargs['server_mode'],
+                           workers=kwargs['workers'],
+                           backlog=kwargs['backlog'],
+                           max_request_size=kwargs['max_request_size'],
+                           job_workers=kwargs['job_workers'],
+                           max_queued_jobs=kwargs['max_queued_jobs'],
+                           job_retention=kwargs['job_retention'],
+                           max_concurrent_commands=kwargs[
+                               'max_concurrent_commands'],
+                           max_waiting_commands=kwargs[
+                               'max_waiting_commands'],
+                           warmup=kwargs['warmup'],
+                           max_worker_requests=kwargs['max_worker_requests'],
+                           max_worker_memory=kwargs['max_worker_memory'])
 
         return {'result': fin}
 
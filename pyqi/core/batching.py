@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Coalesce concurrent calls of a ``Command`` into batches
+
+A ``Command`` that is much cheaper per call when given many at once (e.g.,
+one wrapping vectorized NumPy code) can define ``run_batch``, which takes a
+list of kwargs dicts and returns a list with a result for each::
+
+    def run_batch(self, calls):
+        scores = score_all([kwargs['sequence'] for kwargs in calls])
+        return [{'score': score} for score in scores]
+
+A ``MicroBatcher`` then collects concurrent calls and runs them in one
+``run_batch``. Batches adapt to the load: a call that arrives while the
+``Command`` is idle runs at once (after ``BatchWindow`` seconds, if the
+``Command`` sets one), and calls that arrive while a batch runs make up the
+next one, up to ``MaxBatchSize`` calls.
+"""
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from threading import Condition, Event
+from timeit import default_timer
+
+class _Batch(object):
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.calls = []
+        self.outcomes = None
+        self.error = None
+        self.done = Event()
+
+    def outcome(self, index):
+        if self.error is not None:
+            raise self.error
+
+        outcome = self.outcomes[index]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class MicroBatcher(object):
+    """Run concurrent calls in batches with ``func``
+
+    ``func`` takes a list of kwargs dicts and returns a list with, for each
+    call, its result or the exception it raised (as
+    ``Command.call_batch`` does). A batch waits up to ``Window`` seconds
+    for more calls, unless it has ``MaxSize`` calls, and at most
+    ``MaxConcurrent`` batches run at once; calls arriving meanwhile wait
+    for the next batch.
+
+    The first call of each batch runs it, on its own thread, so no thread
+    is kept to run batches. Safe to share between threads.
+    """
+    def __init__(self, func, Window=0.0, MaxSize=64, MaxConcurrent=1):
+        self.func = func
+        self.Window = Window
+        self.MaxSize = MaxSize
+        self.MaxConcurrent = MaxConcurrent
+        self._pending = None
+        self._running = 0
+        self._condition = Condition()
+
+    def call(self, kwargs):
+        """Return the result of the call with ``kwargs``, or raise its error"""
+        with self._condition:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch(default_timer() + self.Window)
+
+            index = len(batch.calls)
+            batch.calls.append(kwargs)
+            if len(batch.calls) >= self.MaxSize:
+                # Later calls start the next batch.
+                self._pending = None
+                self._condition.notify_all()
+
+            if leader:
+                self._wait_to_run(batch)
+
+        if not leader:
+            batch.done.wait()
+            return batch.outcome(index)
+
+        try:
+            batch.outcomes = self.func(batch.calls)
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+            batch.done.set()
+
+        return batch.outcome(index)
+
+    def _wait_to_run(self, batch):
+        """Wait until ``batch`` can run, and close it to later calls"""
+        while True:
+            full = len(batch.calls) >= self.MaxSize
+            idle = self._running < self.MaxConcurrent
+            remaining = batch.deadline - default_timer()
+            if idle and (full or remaining <= 0):
+                break
+            # Wait to be notified of a full batch or a finished one.
+            self._condition.wait(remaining if idle else None)
+
+        if self._pending is batch:
+            self._pending = None
+        self._running += 1
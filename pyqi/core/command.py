@@ -14,12 +14,27 @@ __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
 
 import sys, traceback
 import re
+import inspect
 from pyqi.core.log import NullLogger
 from pyqi.core.exception import (IncompetentDeveloperError,
                                  InvalidReturnTypeError,
                                  UnknownParameterError,
                                  MissingParameterError)
 
+# Python 2 has no coroutine functions.
+_iscoroutinefunction = getattr(inspect, 'iscoroutinefunction',
+                               lambda f: False)
+
+def _run_coroutine(coroutine):
+    """Run ``coroutine`` to completion on a new event loop"""
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
 class Parameter(object):
     """The ``Command`` variable type baseclass
 
@@ -66,12 +81,20 @@ class Parameter(object):
         return name
 
 class CommandIn(Parameter):
-    """A ``Command`` input variable type"""
+    """A ``Command`` input variable type
+
+    ``AcceptsIterable`` declares that ``Command.run`` only iterates over the
+    value of this input once, so interfaces may supply it as a lazily
+    evaluated iterator (e.g., the lines of a file, read on demand) instead of
+    a fully materialized object.
+    """
     def __init__(self, Name, DataType, Description, Required=False,
-                 Default=None, DefaultDescription=None, **kwargs):
+                 Default=None, DefaultDescription=None, AcceptsIterable=False,
+                 **kwargs):
         self.Required = Required
         self.Default = Default
         self.DefaultDescription = DefaultDescription
+        self.AcceptsIterable = AcceptsIterable
 
         if Required and Default is not None:
             raise IncompetentDeveloperError("Found required CommandIn '%s' "
@@ -120,26 +143,134 @@ class Command(object):
     LongDescription = """""" # longer, more detailed description
     CommandIns = ParameterCollection([])
     CommandOuts = ParameterCollection([])
+    # Whether identical calls running together may share one execution (see
+    # pyqi.core.singleflight). Only for Commands without side effects, whose
+    # results can be handed to several callers.
+    Deduplicate = False
+    # For Commands with a run_batch (see pyqi.core.batching): how long (in
+    # seconds) a call waits for others to join its batch, and the most calls
+    # a batch holds.
+    BatchWindow = 0.0
+    MaxBatchSize = 64
+    # The Resources (see pyqi.core.resource) run uses. Each is loaded once
+    # and shared by every instance and thread.
+    Resources = []
 
     def __init__(self, **kwargs):
         """ """
         self._logger = NullLogger()
 
     def __call__(self, **kwargs):
-        """Safely execute a ``Command``"""
-        self_str = str(self.__class__)
-        self._logger.info('Starting command: %s' % self_str)
+        """Safely execute a ``Command``
 
-        self._validate_kwargs(kwargs)
-        self._set_defaults(kwargs)
+        The ``run`` of an async ``Command`` (see ``is_async``) is run to
+        completion on a new event loop.
+        """
+        self._start(kwargs)
 
         try:
             result = self.run(**kwargs)
+            if self.is_async():
+                result = _run_coroutine(result)
+        except Exception:
+            self._failed()
+            raise
+
+        return self._finish(result)
+
+    def call_batch(self, calls):
+        """Safely execute several calls with ``run_batch``
+
+        ``calls`` is a list of kwargs dicts. Returns a list with, for each
+        call, its result or the exception it raised: calls with invalid
+        inputs or results fail on their own, while an error raised by
+        ``run_batch`` is raised for the whole batch.
+        """
+        outcomes = [None] * len(calls)
+        valid = []
+        for i, kwargs in enumerate(calls):
+            try:
+                self._start(kwargs)
+            except Exception as e:
+                outcomes[i] = e
+            else:
+                valid.append(i)
+
+        if not valid:
+            return outcomes
+
+        try:
+            results = self.run_batch([calls[i] for i in valid])
+            if len(results) != len(valid):
+                raise InvalidReturnTypeError("run_batch must return a result "
+                                             "for each call.")
         except Exception:
-            self._logger.fatal('Error executing command: %s' % self_str)
+            self._failed()
             raise
-        else:
-            self._logger.info('Completed command: %s' % self_str)
+
+        for i, result in zip(valid, results):
+            if isinstance(result, Exception):
+                outcomes[i] = result
+                continue
+            try:
+                outcomes[i] = self._finish(result)
+            except Exception as e:
+                outcomes[i] = e
+        return outcomes
+
+    def supports_batch(self):
+        """Return whether the ``Command`` defines a (blocking) ``run_batch``
+
+        ``run_batch`` takes a list of kwargs dicts, and returns a list with,
+        for each, a result dict (or an exception, for a call that failed).
+        """
+        return getattr(self, 'run_batch', None) is not None and \
+               not self.is_async()
+
+    def resource(self, name):
+        """Return the value of the ``Resource`` called ``name``
+
+        The value is loaded by the first call that needs it.
+        """
+        for resource in self.Resources:
+            if resource.Name == name:
+                return resource.get()
+        raise IncompetentDeveloperError("%s declares no Resource named '%s'."
+                                        % (self.__class__.__name__, name))
+
+    def warmup(self):
+        """Load the ``Resources``, so that the first call isn't slow"""
+        for resource in self.Resources:
+            resource.get()
+
+    def release_resources(self):
+        """Release the ``Resources``; the next call loads them again"""
+        for resource in self.Resources:
+            resource.release()
+
+    def is_async(self):
+        """Return whether ``run`` is a coroutine function
+
+        An async ``Command`` can be awaited on a running event loop (see
+        ``pyqi.core.interfaces.html.aio.call_command``) instead of being
+        called.
+        """
+        return _iscoroutinefunction(self.run)
+
+    def _start(self, kwargs):
+        """Validate ``kwargs`` and fill in defaults, before ``run``"""
+        self._logger.info('Starting command: %s' % str(self.__class__))
+
+        self._validate_kwargs(kwargs)
+        self._set_defaults(kwargs)
+
+    def _failed(self):
+        self._logger.fatal('Error executing command: %s' % str(self.__class__))
+
+    def _finish(self, result):
+        """Validate and return the result of ``run``"""
+        self_str = str(self.__class__)
+        self._logger.info('Completed command: %s' % self_str)
 
         # verify the result type
         if not isinstance(result, dict):
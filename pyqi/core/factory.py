@@ -11,19 +11,58 @@
 __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
                "Jai Ram Rideout"]
 
+from collections import OrderedDict
+from threading import Lock
+
+# The most interface classes kept by ``general_factory``.
+FACTORY_CACHE_SIZE = 128
+
+# Maps (command, config, attributes) keys to (config objects, interface
+# class) tuples, least recently used first. The config objects are kept alive
+# while their entry is cached so that their ids can't be reused.
+_factory_cache = OrderedDict()
+_factory_cache_lock = Lock()
+
 def general_factory(command_constructor, usage_examples, inputs, outputs,
-                    version, interface=None):
-    """Generalized interface factory"""
-    class IObject(interface):
-        """Dynamic interface object"""
-        CommandConstructor = command_constructor
-        def _get_usage_examples(self):
-            return usage_examples
-        def _get_inputs(self):
-            return inputs
-        def _get_outputs(self):
-            return outputs
-        def _get_version(self):
-            return version
-
-    return IObject
+                    version, interface=None, **attributes):
+    """Generalized interface factory
+
+    ``attributes`` are set on the interface class (e.g.,
+    ``CommandName='make-command'``) and must be hashable.
+
+    Interface classes are memoized: calling the factory again with the same
+    ``command_constructor``, ``usage_examples``, ``inputs``, ``outputs``,
+    ``version``, ``interface`` and ``attributes`` returns the class built by
+    the first call, along with the parser and validation results cached on
+    it. ``usage_examples``, ``inputs`` and ``outputs`` are compared by
+    identity, which is what happens when they are read from a config module.
+    Only the ``FACTORY_CACHE_SIZE`` most recently used classes are kept.
+    """
+    attributes = tuple(sorted(attributes.items()))
+    key = (command_constructor, id(usage_examples), id(inputs), id(outputs),
+           version, interface, attributes)
+
+    with _factory_cache_lock:
+        cached = _factory_cache.pop(key, None)
+        if cached is None:
+            class IObject(interface):
+                """Dynamic interface object"""
+                CommandConstructor = command_constructor
+                def _get_usage_examples(self):
+                    return usage_examples
+                def _get_inputs(self):
+                    return inputs
+                def _get_outputs(self):
+                    return outputs
+                def _get_version(self):
+                    return version
+
+            for name, value in attributes:
+                setattr(IObject, name, value)
+            cached = (usage_examples, inputs, outputs, IObject)
+
+        _factory_cache[key] = cached
+        while len(_factory_cache) > FACTORY_CACHE_SIZE:
+            _factory_cache.popitem(last=False)
+
+    return cached[-1]
@@ -30,15 +30,23 @@ class Interface(object):
 
         self.CmdInstance = self.CommandConstructor(**kwargs)
 
-        self._validate_usage_examples(self._get_usage_examples())
-        self._validate_inputs_outputs(self._get_inputs(), self._get_outputs())
+        # The configuration is defined at the class level, so it only needs to
+        # be validated the first time the class is instantiated. Look in the
+        # class __dict__ so that subclasses are always validated on their own.
+        cls = self.__class__
+        if not cls.__dict__.get('_config_validated', False):
+            self._validate_usage_examples(self._get_usage_examples())
+            self._validate_inputs_outputs(self._get_inputs(),
+                                          self._get_outputs())
+            cls._config_validated = True
     
     def __call__(self, in_, *args, **kwargs):
         self._the_in_validator(in_)
-        cmd_input = self._input_handler(in_, *args, **kwargs)
+        context = RequestContext()
+        cmd_input = self._input_handler(in_, context, *args, **kwargs)
         cmd_result = self.CmdInstance(**cmd_input)
         self._the_out_validator(cmd_result)
-        return self._output_handler(cmd_result)
+        return self._output_handler(cmd_result, context)
 
     def _validate_usage_examples(self, usage_examples):
         """Perform validation on a list of ``InterfaceUsageExample`` objects.
@@ -74,6 +82,15 @@ class Interface(object):
                                             "InterfaceOption mapping to the "
                                             "same Parameter.")
 
+        for input_ in inputs:
+            if (getattr(input_.Handler, 'ReturnsIterable', False) and
+                input_.Parameter is not None and
+                not getattr(input_.Parameter, 'AcceptsIterable', False)):
+                raise IncompetentDeveloperError("InterfaceOption '%s' has a "
+                        "Handler that returns an iterable, but CommandIn "
+                        "'%s' does not accept one (AcceptsIterable is "
+                        "False)." % (input_.Name, input_.getParameterName()))
+
         input_names = set([i.Name for i in inputs])
         for ifout in outputs:
             if ifout.InputName is None:
@@ -93,11 +110,20 @@ class Interface(object):
         raise NotImplementedError("All subclasses must implement "
                                   "_the_out_validator.")
 
-    def _input_handler(self, in_, *args, **kwargs):
+    def _input_handler(self, in_, context=None, *args, **kwargs):
+        """Transform ``in_`` into ``Command`` kwargs
+
+        Any per-invocation state needed later by ``_output_handler`` must be
+        stored on ``context`` (a ``RequestContext``) and never on ``self``, so
+        that a single interface instance can serve concurrent calls.
+        """
         raise NotImplementedError("All subclasses must implement "
                                   "_input_handler.")
 
-    def _output_handler(self, results):
+    def _output_handler(self, results, context=None):
+        """Transform ``Command`` results, using the ``RequestContext`` that
+        was passed to ``_input_handler``
+        """
         raise NotImplementedError("All subclasses must implement "
                                   "_output_handler.")
 
@@ -133,6 +159,19 @@ class Interface(object):
         """
         raise NotImplementedError("Must define _get_version")
 
+class RequestContext(object):
+    """Per-invocation state of an ``Interface``
+
+    A new ``RequestContext`` is created for each call of an ``Interface``
+    instance and is handed to both ``_input_handler`` and ``_output_handler``.
+
+    ``InterfaceInput`` maps interface option names to the values supplied for
+        them (e.g., the parsed command line options), before any ``Handler``
+        has been applied.
+    """
+    def __init__(self):
+        self.InterfaceInput = {}
+
 class InterfaceOption(object):
     """Describes an option and what to do with it
     
@@ -261,6 +300,15 @@ class InterfaceUsageExample(object):
         """Interface specific usage example validation"""
         raise NotImplementedError("Must define in the subclass")
 
+def iterable_handler(handler):
+    """Declare that the input ``handler`` returns a lazily evaluated iterable
+
+    Interface options using ``handler`` can only be mapped to ``CommandIns``
+    that were created with ``AcceptsIterable=True``.
+    """
+    handler.ReturnsIterable = True
+    return handler
+
 def get_command_names(config_base_name):
     """Return a list of available command names.
 
@@ -11,27 +11,55 @@
 __credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
     "Greg Caporaso"]
 
+import gc
 import os
 import types
 import os.path
 import sys
+import json
+from threading import Lock
+from timeit import default_timer
 
 from pyqi.util import is_py2
 if is_py2():
-    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlsplit
 else:
-    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit
 
-from cgi import parse_header, parse_multipart, parse_qs, FieldStorage
 from copy import copy
 from glob import glob
 from os.path import abspath, exists, isdir, isfile, split
 from pyqi.core.interface import (Interface, InterfaceOutputOption, InterfaceInputOption,
-                                 InterfaceUsageExample, get_command_names, get_command_config)
+                                 InterfaceUsageExample, RequestContext,
+                                 get_command_names, get_command_config)
 from pyqi.core.factory import general_factory
 from pyqi.core.exception import IncompetentDeveloperError
 from pyqi.core.command import Parameter
+from pyqi.core.singleflight import SingleFlight, call_key
+from pyqi.core.batching import MicroBatcher
+from pyqi.core.resource import release_all
 from pyqi.util import get_version_string
+from pyqi.core.interfaces.html.multipart import (FormData, FormError,
+                                                 FormParser)
+from pyqi.core.interfaces.html.response import (MIN_GZIP_SIZE,
+        SEND_BUFFER_SIZE, StaticBody,
+        SpooledBody, accepts_gzip, chunk_encode, close_body, file_length,
+        gzip_bytes, gzip_pieces, is_compressible, is_file, is_text,
+        iter_body, to_bytes)
+from pyqi.core.interfaces.html.jobs import JobQueue, JobQueueFullError
+from pyqi.core.interfaces.html.metrics import Metrics, counted
+from pyqi.core.interfaces.html.admission import (AdmissionControl,
+        AdmissionError, ConcurrencyLimit)
+from pyqi.core.interfaces.html.api import (APIError, UnknownCommandError,
+        describe_command, error_dict, get_command_inputs, read_json,
+        to_jsonable)
+from pyqi.core.interfaces.html.wsgi import (ClosingIterator, EnvironHeaders,
+        error_page, status_line)
+from pyqi.core.interfaces.html.server import (PyqiHTTPServer,
+        PooledHTTPServer, PreforkServer, RouteTimings,
+        install_shutdown_handlers, restore_handlers, shutdown_in_thread)
 
 class HTMLResult(InterfaceOutputOption):
     """Base class for results for an HTML config file"""
@@ -65,6 +93,7 @@ class HTMLInputOption(InterfaceInputOption):
         float: lambda x: float(x.value),
         complex: lambda x: complex(x.value),
         "upload_file": lambda x: x.file,
+        "upload_filepath": lambda x: x.filepath,
         "multiple_choice": lambda x: x.value
     }
 
@@ -104,7 +133,8 @@ class HTMLInputOption(InterfaceInputOption):
             float: number_input,
             complex: string_input,
             "multiple_choice": mchoice_input,
-            "upload_file": upload_input
+            "upload_file": upload_input,
+            "upload_filepath": upload_input
         }
 
         return ''.join(['<tr><td class="right">',
@@ -190,24 +220,49 @@ class HTMLInterface(Interface):
         '}'
       ])
 
+    # The ConcurrencyLimit declared as ``limits`` in the command's config
+    # module, if any.
+    Limits = None
+    # The SingleFlight that identical calls of the command share, if any.
+    Flights = None
+
     def __init__(self, input_prefix="pyqi_", **kwargs):
         self._html_input_prefix = input_prefix
-        self._html_interface_input = {}
         super(HTMLInterface, self).__init__(**kwargs)
 
     #Override
     def __call__(self, in_, *args, **kwargs):
+        """Run the command with the form data ``in_``
+
+        The command is run by calling ``run(cmd, kwargs)`` if given (e.g.,
+        to run it within its limits), or else ``cmd(**kwargs)``. A call
+        identical to one in flight shares its execution (see ``Flights``)
+        and doesn't call ``run``, unless ``share`` is False.
+        """
+        run = kwargs.pop('run', _run_command)
+        share = kwargs.pop('share', True)
+
         self._the_in_validator(in_)
-        cmd_input, errors = self._input_handler(in_, *args, **kwargs)
+        context = RequestContext()
+        cmd_input, errors = self._input_handler(in_, context, *args, **kwargs)
         if errors:
             return {
                     'type': 'error',
                     'errors': errors
                 }
         else:
-            cmd_result = self.CmdInstance(**cmd_input)
+            cmd = self.CmdInstance
+            key = None
+            if share and self.Flights is not None:
+                key = call_key(cmd, cmd_input)
+
+            if key is None:
+                cmd_result = run(cmd, cmd_input)
+            else:
+                cmd_result, _ = self.Flights.do((type(cmd), key), run, cmd,
+                                                cmd_input)
             self._the_out_validator(cmd_result)
-            return self._output_handler(cmd_result)
+            return self._output_handler(cmd_result, context)
 
     def _validate_inputs_outputs(self, inputs, outputs):
         super(HTMLInterface, self)._validate_inputs_outputs(inputs, outputs)
@@ -227,9 +282,9 @@ class HTMLInterface(Interface):
 
     def _the_in_validator(self, in_):
         """Validate input coming from the postvars"""
-        if not isinstance(in_, FieldStorage):
+        if not isinstance(in_, FormData):
             raise IncompetentDeveloperError("Unsupported input '%r'. Input "
-                                            "must be FieldStorage." % in_)
+                                            "must be FormData." % in_)
 
     def _the_out_validator(self, out_):
         """Validate output coming from the command call"""
@@ -237,8 +292,10 @@ class HTMLInterface(Interface):
             raise IncompetentDeveloperError("Unsupported result '%r'. Result "
                                             "must be a dict." % out_)
 
-    def _input_handler(self, in_, *args, **kwargs):
+    def _input_handler(self, in_, context=None, *args, **kwargs):
         """reformat from http post data."""
+        if context is None:
+            context = RequestContext()
 
         errors = []
 
@@ -248,7 +305,7 @@ class HTMLInterface(Interface):
         for key in in_:
             mod_key = key[ len(self._html_input_prefix): ]
             formatted_input[mod_key] = in_[key]
-            if not formatted_input[mod_key].value:
+            if not formatted_input[mod_key].size:
                 formatted_input[mod_key] = None
 
         cmd_input_kwargs = {}
@@ -275,14 +332,14 @@ class HTMLInterface(Interface):
 
                 cmd_input_kwargs[param_name] = value
 
-        self._html_interface_input = formatted_input
+        context.InterfaceInput = formatted_input
         return cmd_input_kwargs, errors
 
     def _build_usage_lines(self, required_options):
         """ Build the usage string from components """
         return '<p class="usage_example">%s</p>' % self.CmdInstance.LongDescription
 
-    def _output_download_handler(self, output, handled_results):
+    def _output_download_handler(self, output, handled_results, context):
         """Handle the output for type: 'download' """
         #Set up the filename for download
         filename = "unnamed_pyqi_output"
@@ -294,7 +351,7 @@ class HTMLInterface(Interface):
             if output.DefaultFilename is not None:
                 filename = output.DefaultFilename
         else:
-            lookup_filename = self._html_interface_input[output.FilenameLookup]
+            lookup_filename = context.InterfaceInput[output.FilenameLookup]
             if lookup_filename is not None:
                 filename = lookup_filename
 
@@ -314,8 +371,10 @@ class HTMLInterface(Interface):
             'contents':handled_results
         }
 
-    def _output_handler(self, results):
+    def _output_handler(self, results, context=None):
         """Deal with things in output if we know how"""
+        if context is None:
+            context = RequestContext()
 
         output = self._get_outputs()[0]
 
@@ -325,24 +384,26 @@ class HTMLInterface(Interface):
                 handled_results = output.Handler(rk, results[rk])
             else:
                 handled_results = output.Handler(rk, results[rk],
-                    self._html_interface_input[output.InputName])
+                    context.InterfaceInput[output.InputName])
         else:
             handled_results = results[rk]
 
         if isinstance(output, HTMLDownload):
-            return self._output_download_handler(output, handled_results)
+            return self._output_download_handler(output, handled_results,
+                                                 context)
 
         elif isinstance(output, HTMLPage):
             return self._output_page_handler(output, handled_results)
 
-    def command_page_writer(self, write, errors, postvars):
-        """Write an HTML page which contains a form for user input"""
-        write('<!DOCTYPE html><html><head><title>%s</title>' % self.CommandName)
-        write('<style>')
-
-        write(self.css_style)
+    def command_page_writer(self, write, errors, postvars,
+                            stylesheet_url=None):
+        """Write an HTML page which contains a form for user input
 
-        write('</style>')
+        The page links to ``stylesheet_url`` if it is given, and otherwise
+        includes ``css_style`` inline.
+        """
+        write('<!DOCTYPE html><html><head><title>%s</title>' % self.CommandName)
+        write(stylesheet_html(self.css_style, stylesheet_url))
         write('</head><body><h1>%s</h1><div id="content">' % self.CommandName)
 
         write(self._build_usage_lines([opt for opt in self._get_inputs() if opt.Required]))
@@ -356,7 +417,8 @@ class HTMLInterface(Interface):
         write('<table>')
         for i in self._get_inputs():
             full_name = self._html_input_prefix + i.Name
-            if full_name in postvars and i.Type is not 'upload_file':
+            if full_name in postvars and \
+               i.Type not in ('upload_file', 'upload_filepath'):
                 default = i.cast_value(postvars[full_name])
                 write(i.get_html(self._html_input_prefix, value=default))
             else:
@@ -368,31 +430,169 @@ class HTMLInterface(Interface):
 
         write('</div></body></html>')
 
+def _run_command(cmd, kwargs):
+    return cmd(**kwargs)
+
+def stylesheet_html(css_style, stylesheet_url=None):
+    """Return the html to style a page with css_style"""
+    if stylesheet_url is None:
+        return '<style>%s</style>' % css_style
+    return '<link rel="stylesheet" type="text/css" href="%s"/>' % \
+           stylesheet_url
+
+# HTML interfaces have no usage examples. Shared, so that the factory
+# memoizes their classes.
+_NO_USAGE_EXAMPLES = ()
+
 def html_interface_factory(command_constructor, usage_examples, inputs, outputs,
-                     version, command_name):
-    interface_class = general_factory(command_constructor, usage_examples, inputs,
-                           outputs, version, HTMLInterface)
-    interface_class.CommandName = command_name
-    return interface_class
+                     version, command_name, limits=None):
+    return general_factory(command_constructor, usage_examples, inputs,
+                           outputs, version, HTMLInterface,
+                           CommandName=command_name, Limits=limits)
 
-def get_cmd_obj(cmd_cfg_mod, cmd):
+def get_cmd_obj(cmd_cfg_mod, cmd, version_str=None):
     """Get a ``Command`` object"""
     cmd_cfg,_ = get_command_config(cmd_cfg_mod, cmd)
-    version_str = get_version_string(cmd_cfg_mod)
-    cmd_class = html_interface_factory(cmd_cfg.CommandConstructor, [],
-                            cmd_cfg.inputs, cmd_cfg.outputs, version_str, cmd)
+    if version_str is None:
+        version_str = get_version_string(cmd_cfg_mod)
+    cmd_class = html_interface_factory(cmd_cfg.CommandConstructor,
+                            _NO_USAGE_EXAMPLES, cmd_cfg.inputs,
+                            cmd_cfg.outputs, version_str, cmd,
+                            getattr(cmd_cfg, 'limits', None))
     cmd_obj = cmd_class()
     return cmd_obj
 
-def get_http_handler(module):
-    """Return a subclassed BaseHTTPRequestHandler with module in scope."""
+class HTMLInterfaceCache(object):
+    """Build the ``HTMLInterface`` for each command of a module once
+
+    Interfaces keep no per-request state, so a single instance per command
+    is shared by every request (and every thread) of the server. Each is
+    built the first time it is requested, and shares identical calls of
+    its command through ``flights`` (a ``SingleFlight``), if given.
+    """
+    def __init__(self, module, flights=None):
+        self.module = module
+        self.version_str = get_version_string(module)
+        self.flights = flights
+        self._interfaces = {}
+        self._lock = Lock()
+
+    def get(self, command):
+        """Return the ``HTMLInterface`` for ``command``"""
+        try:
+            return self._interfaces[command]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if command not in self._interfaces:
+                interface = get_cmd_obj(self.module, command,
+                                        self.version_str)
+                interface.Flights = self.flights
+                self._interfaces[command] = interface
+            return self._interfaces[command]
+
+def normalize_route_path(path):
+    """Return the route for a request path
+
+    The query string and fragment are dropped, as is any trailing slash, so
+    '/make-command/?x=1' routes like '/make-command'.
+    """
+    path = urlsplit(path).path.rstrip('/')
+    return path or '/'
+
+def get_http_handler(module, form_parser=None, job_queue=None,
+                     admission=None):
+    """Return a subclassed BaseHTTPRequestHandler with module in scope.
+
+    ``form_parser`` is the ``FormParser`` used to read POSTed forms; it sets
+    the limits on the size of submissions. ``job_queue`` is the ``JobQueue``
+    that runs commands submitted as jobs. ``admission`` is the
+    ``AdmissionControl`` enforcing the server-wide limit on concurrent
+    command calls (the limits of each command are read from its config
+    module).
+    """
     module_commands = get_command_names(module)
+    flights = SingleFlight()
+    interfaces = HTMLInterfaceCache(module, flights)
+    if form_parser is None:
+        form_parser = FormParser()
+    if job_queue is None:
+        job_queue = JobQueue()
+    if admission is None:
+        admission = AdmissionControl()
+    metrics = Metrics()
+    metrics.add_gauge('pyqi_jobs_queued', 'Jobs waiting to run.',
+                      job_queue.depth)
+    metrics.add_gauge('pyqi_commands_waiting',
+                      'Command calls waiting for a concurrency slot.',
+                      admission.waiting)
 
     class HTMLInterfaceHTTPHandler(BaseHTTPRequestHandler):
-        """Handle incoming HTTP requests"""
+        """Handle incoming HTTP requests
+
+        Requests are dispatched through ``GetRoutes`` and ``PostRoutes``,
+        which map a normalized path to a ``(method, args)`` pair. The
+        handler calls ``method(self, *args)``. Paths without a route of
+        their own are looked up by their first segment in
+        ``GetPrefixRoutes``, and the rest of the path is passed as a final
+        argument (e.g., '/jobs/<id>/result').
+
+        A command can be run in the background by POSTing its form to
+        '/jobs/<command>'. The response gives the job's id, and the job's
+        status and result are at '/jobs/<id>' and '/jobs/<id>/result'.
+
+        A command can also be run by POSTing its inputs as JSON to
+        '/api/<command>', or several commands by POSTing a list of
+        invocations to '/api' (see ``pyqi.core.interfaces.html.api``).
+        A GET of '/api/<command>' describes the command's inputs.
+
+        Commands run within the concurrency limits of ``Admission`` (see
+        ``pyqi.core.interfaces.html.admission``). Calls refused because
+        too many are running get a 429 or 503, with a Retry-After header.
+
+        Identical calls of a command that sets ``Deduplicate``, made while
+        one of them runs, share its execution and its response (see
+        ``pyqi.core.singleflight``). Concurrent calls of a command with a
+        ``run_batch``, from the JSON API and from forms, are run together in
+        batches (see ``pyqi.core.batching``); background jobs run alone.
+
+        Request and command metrics are at '/metrics' (in the Prometheus
+        text format) and '/metrics.json' (see
+        ``pyqi.core.interfaces.html.metrics``).
+        """
+        Commands = module_commands
+        Interfaces = interfaces
+        Flights = flights
+        Timings = RouteTimings()
+        Metrics = metrics
+        FormParser = form_parser
+        Jobs = job_queue
+        Admission = admission
+        # The MicroBatcher of each batched command, made on its first call.
+        Batchers = {}
+        GetRoutes = {}
+        PostRoutes = {}
+        GetPrefixRoutes = {}
+        # The most invocations a POST to '/api' can hold.
+        MaxBatchSize = 100
+
+        StylesheetURL = '/static/pyqi.css'
+        StaticPages = {}
+
+        # Every response has a Content-Length or is chunked (or, for HTTP/1.0
+        # clients, closes the connection), so connections can be kept alive.
+        # Whether they are is up to the server (see ``keep_alive``).
+        protocol_version = 'HTTP/1.1'
+        # Seconds a read from the client may take.
+        timeout = 15
+        # Buffer writes, so headers and small bodies go out together, and
+        # don't let Nagle's algorithm hold back the last segment.
+        wbufsize = -1
+        disable_nagle_algorithm = True
 
         def __init__(self, *args, **kwargs):
-            self._unrouted = True
+            self._route_name = None
             #Apparently this is an 'oldstyle' class, which doesn't allow the use of super()
             BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
 
@@ -400,9 +600,8 @@ def get_http_handler(module):
             write("<html><head><title>")
             write("PyQi: " + module)
             write("</title>")
-            write("<style>")
-            write(HTMLInterface.css_style)
-            write("</style>")
+            write(stylesheet_html(HTMLInterface.css_style,
+                                  self.StylesheetURL))
             write("</head><body>")
             write("<h1>Available Commands:</h1>")
             write("<ul>")
@@ -411,112 +610,815 @@ def get_http_handler(module):
             write("</ul>")
             write("</body></html>")
 
-        def route(self, path, output_writer):
-            """Define a route for an output_writer"""
-            if self._unrouted and self.path == path:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
+        def help(self, write):
+            write("This is still a very in development interface, there is no help.")
+
+        def timings(self, write):
+            write(self.Timings.report())
+
+        def metrics_page(self):
+            self.send_body(self.Metrics.prometheus(),
+                           'text/plain; version=0.0.4')
+
+        def metrics_json(self):
+            self.send_json(self.Metrics.to_dict())
+
+        def send_body(self, contents, content_type='text/html', status=200,
+                      headers=()):
+            """Send a response with ``contents`` as its body
+
+            ``contents`` may be a string, a file object or an iterable of
+            strings (see ``pyqi.core.interfaces.html.response``). Text is
+            gzipped if the client accepts it.
+            """
+            headers = [('Content-type', content_type)] + list(headers)
+            body = contents
+            if not is_file(contents) and is_compressible(content_type):
+                headers.append(('Vary', 'Accept-Encoding'))
+
+                if self.accepts_gzip():
+                    if not is_text(contents):
+                        body = gzip_pieces(iter_body(contents))
+                        headers.append(('Content-Encoding', 'gzip'))
+                    elif len(contents) >= MIN_GZIP_SIZE:
+                        body = gzip_bytes(to_bytes(contents))
+                        headers.append(('Content-Encoding', 'gzip'))
+
+            self.respond(status, headers, body, contents)
+
+        def send_static(self, static):
+            """Send a ``StaticBody``, or 304 if the client has it cached"""
+            headers = [('ETag', static.etag),
+                       ('Cache-Control', static.cache_control)]
+
+            if static.matches(self.headers.get('If-None-Match')):
+                self.respond(304, headers)
+                return
+
+            headers.insert(0, ('Content-type', static.content_type))
+            body = static.body
+            if static.gzipped is not None:
+                headers.append(('Vary', 'Accept-Encoding'))
+                if self.accepts_gzip():
+                    body = static.gzipped
+                    headers.append(('Content-Encoding', 'gzip'))
+
+            self.respond(200, headers, body)
+
+        def send_json(self, data, status=200, headers=()):
+            self.send_body(json.dumps(data), 'application/json', status,
+                           headers)
+
+        def accepts_gzip(self):
+            return accepts_gzip(self.headers.get('Accept-Encoding'))
+
+        def keep_alive(self):
+            """Return whether the server can keep the connection open
+
+            A server that handles one connection at a time would serve
+            nobody else while the connection sits idle, so it is only kept
+            open if the server has a ``keep_alive`` method that agrees.
+            """
+            keep_alive = getattr(self.server, 'keep_alive', None)
+            return keep_alive is not None and keep_alive()
+
+        def respond(self, status, headers, body=b'', source=None):
+            """Write the response to the client
+
+            Every response goes through ``respond``, so it is the only
+            method a different transport (e.g., WSGI) has to replace. The
+            framing of ``body`` (Content-Length, sendfile or chunks) is
+            decided here. ``source`` is closed once the body is sent, if
+            ``body`` was made from it.
+            """
+            try:
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+
+                # E.g., the request body is unread, or the server can't
+                # keep the connection.
+                closing = self.close_connection or not self.keep_alive()
+                if closing:
+                    self.send_header('Connection', 'close')
+
+                if status in (204, 304):
+                    # No body allowed.
+                    self.end_headers()
+                elif is_text(body):
+                    body = to_bytes(body)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    self.Metrics.add_bytes_out(len(body))
+                elif is_file(body) and file_length(body) is not None:
+                    length = file_length(body)
+                    self.send_header('Content-Length', str(length))
+                    self.end_headers()
+                    self._send_file(body, length)
+                    self.Metrics.add_bytes_out(length)
+                else:
+                    self._send_stream(body, closing)
+
+                self.wfile.flush()
+            except:
+                # The client can't tell a partial body from a whole one
+                # unless the connection is dropped.
+                self.close_connection = True
+                raise
+            finally:
+                close_body(body)
+                if source is not None:
+                    close_body(source)
+
+        def _send_file(self, f, length):
+            sendfile = getattr(self.connection, 'sendfile', None)
+            if sendfile is None:
+                for piece in iter_body(f):
+                    self.wfile.write(piece)
+            else:
+                # Zero-copy, where the platform supports it.
+                self.wfile.flush()
+                sendfile(f, f.tell(), length)
+
+        def _send_stream(self, contents, closing=False):
+            pieces = counted(iter_body(contents), self.Metrics.add_bytes_out)
+            if self.request_version == 'HTTP/1.1':
+                self.send_header('Transfer-Encoding', 'chunked')
                 self.end_headers()
-                output_writer(self.wfile.write)
-
-                self.wfile.close()
-                self._unrouted = False;
-
-        def command_route(self, command):
-            """Define a route for a command and write the command page"""
-            if self._unrouted and self.path == ("/" + command):
-                cmd_obj = get_cmd_obj(module, command)
-
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
+                pieces = chunk_encode(pieces)
+            else:
+                # HTTP/1.0 clients don't understand chunks, so the end of
+                # the connection marks the end of the body.
+                if not closing:
+                    self.send_header('Connection', 'close')
                 self.end_headers()
-                cmd_obj.command_page_writer(self.wfile.write, [], {})
 
-                self.wfile.close()
-                self._unrouted = False
-
-        def post_route(self, command, postvars):
-            """Define a route for user response and write the output or else provide errors"""
-            if self._unrouted and self.path == ("/" + command):
-                cmd_obj = get_cmd_obj(module, command)
+            for piece in pieces:
+                self.wfile.write(piece)
+
+        def render(self, output_writer):
+            """Return what ``output_writer(write)`` writes, as bytes"""
+            parts = []
+            output_writer(lambda data: parts.append(to_bytes(data)))
+            return b''.join(parts)
+
+        def page(self, output_writer, content_type='text/html'):
+            """Write a page with a handler method, e.g. ``index``"""
+            self.send_body(self.render(lambda write: output_writer(self,
+                                                                   write)),
+                           content_type)
+
+        def static_page(self, output_writer, content_type='text/html'):
+            """Write a page that never changes, rendering it only once"""
+            static = self.StaticPages.get(self._route_name)
+            if static is None:
+                static = StaticBody(self.render(lambda write:
+                        output_writer(self, write)), content_type)
+                self.StaticPages[self._route_name] = static
+
+            self.send_static(static)
+
+        def command_page(self, command):
+            """Write the command page"""
+            self.static_page(lambda self, write:
+                    self.Interfaces.get(command).command_page_writer(write,
+                            [], {}, self.StylesheetURL))
+
+        def parse_form(self):
+            """Return the POSTed form, or None after responding with an error"""
+            try:
+                return self.FormParser.parse(self.rfile,
+                        self.headers.get('Content-Type'),
+                        self.headers.get('Content-Length'))
+            except FormError as e:
+                # The rest of the body is unread, so the connection can't be
+                # reused.
+                self.close_connection = True
+                self.send_error(e.Status, str(e))
+                return None
+
+        def command_post(self, command):
+            """Run the command and write the output or else provide errors"""
+            cmd_obj = self.Interfaces.get(command)
+
+            # A busy command is refused before its body is read, but a slot
+            # is only taken once it runs, so a slow upload holds none. Calls
+            # of a Deduplicate command may share a running execution, and
+            # calls of a batched one may join a pending batch, neither of
+            # which needs a slot, so they are only refused once read.
+            cmd = cmd_obj.CmdInstance
+            if not (cmd.Deduplicate or cmd.supports_batch()) and \
+               not self.check_admission(command):
+                return
+
+            postvars = self.parse_form()
+            if postvars is None:
+                return
+
+            slots = []
+            try:
                 try:
-                    result = cmd_obj(postvars)
+                    result = cmd_obj(postvars,
+                                     run=self.command_runner(command, slots))
+                except AdmissionError as e:
+                    self.send_busy(e)
+                    return
                 except Exception as e:
                     result = {
                         'type':'error',
                         'errors':[e]
                     }
 
-                if result['type'] == 'error':
-                    self.send_response(400)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    cmd_obj.command_page_writer(self.wfile.write, result['errors'], postvars)
+                # Streamed results may still be computing, so the slot is
+                # held until they are sent.
+                self.send_result(cmd_obj, result, postvars)
+            finally:
+                for slot in slots:
+                    slot.release()
+                postvars.close()
+
+        def command_runner(self, command, slots, queue=True):
+            """Return a ``run`` function for a call of the ``HTMLInterface``
+
+            It runs the command within its limits, appending the ``Slot``
+            it takes to ``slots`` for the caller to release, and times the
+            call. A call sharing the execution of an identical one doesn't
+            run it, so takes no slot. ``queue`` is passed to
+            ``AdmissionControl.admit``.
+
+            If ``queue`` is True, calls of a ``Command`` with a
+            ``run_batch`` go through its ``MicroBatcher``, like JSON API
+            calls, and each batch is admitted (and timed) as one call.
+            Calls that mustn't be refused (``queue`` False) run alone.
+            """
+            admission = self.Admission
+            metrics = self.Metrics
+            limits = self.Interfaces.get(command).Limits
+
+            def run(cmd, kwargs):
+                if queue and cmd.supports_batch():
+                    return self.batcher(command, cmd).call(kwargs)
+
+                slots.append(admission.admit(command, limits, queue))
+                with metrics.time_command(command):
+                    return cmd(**kwargs)
+            return run
+
+        def check_admission(self, command):
+            """Return whether a call of the command would be admitted now
+
+            Returns False after responding with a 429 or 503 if it would be
+            refused. No slot is taken.
+            """
+            try:
+                self.Admission.check(command,
+                                     self.Interfaces.get(command).Limits)
+            except AdmissionError as e:
+                # The body of the request is unread.
+                self.close_connection = True
+                self.send_busy(e)
+                return False
+            return True
+
+        def send_busy(self, error):
+            """Respond to a call refused with ``error``, an ``AdmissionError``"""
+            self.send_body(str(error), 'text/plain', error.Status,
+                           [('Retry-After', str(error.RetryAfter))])
+
+        def send_result(self, cmd_obj, result, postvars):
+            """Write the result of an HTMLInterface call"""
+            if result['type'] == 'error':
+                self.send_body(self.render(lambda write:
+                        cmd_obj.command_page_writer(write, result['errors'],
+                                postvars, self.StylesheetURL)),
+                    status=400)
+
+            elif result['type'] == 'page':
+                self.send_body(result['contents'], result['mime_type'])
+
+            elif result['type'] == 'download':
+                self.send_body(result['contents'], 'application/octet-stream',
+                    headers=[('Content-disposition',
+                              'attachment; filename='+result['filename'])])
+
+        def submit_job(self, command):
+            """Queue the command to run in the background"""
+            postvars = self.parse_form()
+            if postvars is None:
+                return
+
+            cmd_obj = self.Interfaces.get(command)
+            slots = []
+            # Jobs are queued already, so they wait for a slot however many
+            # calls are waiting.
+            run_command = self.command_runner(command, slots, queue=False)
+            def run():
+                # Each job keeps its own result, so jobs don't share
+                # executions.
+                try:
+                    result = cmd_obj(postvars, run=run_command, share=False)
+                finally:
+                    for slot in slots:
+                        slot.release()
+                if result['type'] in ('page', 'download') and \
+                   not is_text(result['contents']):
+                    # Keep streams and files so they can be fetched later.
+                    result['contents'] = SpooledBody(result['contents'])
+                return result
 
-                elif result['type'] == 'page':
-                    self.send_response(200)
-                    self.send_header('Content-type', result['mime_type'])
-                    self.end_headers()
-                    self.wfile.write(result['contents'])
+            try:
+                job = self.Jobs.submit(command, run, postvars.close,
+                                       _discard_job_result)
+            except JobQueueFullError as e:
+                postvars.close()
+                self.send_json({'error': str(e)}, 503,
+                               [('Retry-After', '5')])
+                return
+
+            status_url = '/jobs/' + job.id
+            self.send_json(self._job_status(job), 202,
+                           [('Location', status_url)])
+
+        def job_route(self, rest):
+            """Write the status ('<id>') or result ('<id>/result') of a job"""
+            job_id, _, part = rest.partition('/')
+            job = self.Jobs.get(job_id)
+            if job is None or part not in ('', 'result'):
+                self.not_found()
+            elif part == '':
+                self.send_json(self._job_status(job))
+            elif job.status == job.FAILED:
+                self.send_json(self._job_status(job), 500)
+            elif not job.done:
+                self.send_json(self._job_status(job), 202,
+                               [('Retry-After', '1')])
+            else:
+                result = dict(job.result)
+                if isinstance(result.get('contents'), SpooledBody):
+                    result['contents'] = result['contents'].open()
+                self.send_result(self.Interfaces.get(job.command), result,
+                                 FormData())
+
+        def _job_status(self, job):
+            status = job.to_dict()
+            status['status_url'] = '/jobs/' + job.id
+            status['result_url'] = '/jobs/%s/result' % job.id
+            return status
+
+        def api_describe(self, command):
+            """Write a description of the command's inputs and outputs"""
+            cmd = self.Interfaces.get(command).CmdInstance
+            description = describe_command(cmd)
+            description['command'] = command
+            self.send_json(description)
+
+        def api_call(self, command):
+            """Run the command with the JSON inputs in the request"""
+            try:
+                inputs = self._read_json()
+            except APIError as e:
+                self.send_json({'command': command, 'error': error_dict(e)},
+                               e.Status)
+                return
 
-                elif result['type'] == 'download':
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/octet-stream')
-                    self.send_header('Content-disposition', 'attachment; filename='+result['filename'])
-                    self.end_headers()
-                    self.wfile.write(result['contents'])
+            try:
+                status, response = self._api_invoke(command, inputs)
+            except AdmissionError as e:
+                self.send_json({'command': command, 'error': error_dict(e)},
+                               e.Status, [('Retry-After', str(e.RetryAfter))])
+                return
 
-                self.wfile.close()
-                self._unrouted = False
+            self.send_json(response, status)
 
-        def end_routes(self):
-            """If a route hasn't matched the path up to now, return a 404 and close stream"""
-            if self._unrouted:
-                self.send_response(404)
-                self.end_headers()
+        def api_batch(self):
+            """Run each of a list of JSON invocations"""
+            try:
+                invocations = self._read_json()
+                if not isinstance(invocations, list):
+                    raise APIError("The request must be a list of "
+                                   "invocations.")
+                if len(invocations) > self.MaxBatchSize:
+                    raise APIError("The request has more than %d "
+                                   "invocations." % self.MaxBatchSize)
+            except APIError as e:
+                self.send_json({'error': error_dict(e)}, e.Status)
+                return
+
+            responses = []
+            for invocation in invocations:
+                if not isinstance(invocation, dict) or \
+                   'command' not in invocation:
+                    status = 400
+                    response = {'error': error_dict(APIError(
+                            "Each invocation must be an object with a "
+                            "'command'."))}
+                else:
+                    try:
+                        status, response = self._api_invoke(
+                                invocation['command'],
+                                invocation.get('inputs', {}))
+                    except AdmissionError as e:
+                        status = e.Status
+                        response = {'command': invocation['command'],
+                                    'error': error_dict(e)}
+                response['status'] = status
+                responses.append(response)
+
+            self.send_json(responses)
+
+        def _read_json(self, max_size=None):
+            """Read the JSON body, of at most ``max_size`` bytes
+
+            ``max_size`` defaults to the ``MaxRequestSize`` of the
+            FormParser.
+            """
+            if max_size is None:
+                max_size = self.FormParser.MaxRequestSize
+            try:
+                return read_json(self.rfile,
+                                 self.headers.get('Content-Length'),
+                                 max_size)
+            except APIError:
+                # The body may be unread.
+                self.close_connection = True
+                raise
+
+        def _api_invoke(self, command, inputs):
+            """Run a command, returning the HTTP status and the response
+
+            Raises an ``AdmissionError`` if too many commands are running.
+            """
+            try:
+                cmd, kwargs = self._api_inputs(command, inputs)
+            except APIError as e:
+                return e.Status, {'command': command, 'error': error_dict(e)}
+
+            key = call_key(cmd, kwargs)
+            if key is None:
+                return self._api_run(command, cmd, kwargs)
+
+            # The calls sharing a response may each add to it (e.g., its
+            # status in a batch).
+            (status, response), _ = self.Flights.do((command, key),
+                    self._api_run, command, cmd, kwargs)
+            return status, dict(response)
+
+        def _api_run(self, command, cmd, kwargs):
+            """Call ``cmd``, returning the HTTP status and the response"""
+            try:
+                result = self.run_command(command, cmd, kwargs)
+            except AdmissionError:
+                raise
+            except Exception as e:
+                return 500, {'command': command, 'error': error_dict(e)}
+
+            return 200, {'command': command, 'result': to_jsonable(result)}
+
+        def run_command(self, command, cmd, kwargs):
+            """Return ``cmd(**kwargs)``, run within the command's limits
+
+            Calls of a ``Command`` with a ``run_batch`` are batched with
+            concurrent calls, and each batch is admitted as one call.
+            Raises an ``AdmissionError`` if too many commands are running.
+            """
+            if cmd.supports_batch():
+                return self.batcher(command, cmd).call(kwargs)
+
+            with self.Admission.admit(command,
+                                      self.Interfaces.get(command).Limits):
+                with self.Metrics.time_command(command):
+                    return cmd(**kwargs)
+
+        def batcher(self, command, cmd):
+            """Return the ``MicroBatcher`` for calls of ``command``"""
+            batcher = self.Batchers.get(command)
+            if batcher is None:
+                handler = type(self)
+                def run_batch(calls):
+                    return handler._run_batch(command, cmd, calls)
+                # Two requests may race to make it; only one is kept.
+                batcher = self.Batchers.setdefault(command, MicroBatcher(
+                        run_batch, cmd.BatchWindow, cmd.MaxBatchSize))
+            return batcher
+
+        @classmethod
+        def _run_batch(cls, command, cmd, calls):
+            with cls.Admission.admit(command,
+                                     cls.Interfaces.get(command).Limits):
+                with cls.Metrics.time_command(command) as timer:
+                    cls.Metrics.record_batch(command, len(calls))
+                    outcomes = cmd.call_batch(calls)
+                    timer.failed = all(isinstance(outcome, Exception)
+                                       for outcome in outcomes)
+            return outcomes
+
+        def _api_inputs(self, command, inputs):
+            """Return the ``Command`` to call and the kwargs to call it with"""
+            if command not in self.Commands:
+                raise UnknownCommandError("Unknown command '%s'." % command)
+
+            cmd = self.Interfaces.get(command).CmdInstance
+            return cmd, get_command_inputs(cmd, inputs)
+
+        @classmethod
+        def warmup(cls):
+            """Build the interface of every command and load its Resources
+
+            Returns the number of seconds it took.
+            """
+            start = default_timer()
+            for command in cls.Commands:
+                cls.Interfaces.get(command).CmdInstance.warmup()
+            return default_timer() - start
+
+        def not_found(self):
+            """Return a 404 for a path without a route"""
+            self.send_error(404)
+
+        def send_response(self, code, message=None):
+            self._status = code
+            BaseHTTPRequestHandler.send_response(self, code, message)
+
+        def dispatch(self, method, routes, prefix_routes={}):
+            """Call the route for the request path, timing it"""
+            start = self._request_started()
+            try:
+                path = normalize_route_path(self.path)
+                try:
+                    route, args = routes[path]
+                    self._route_name = path
+                except KeyError:
+                    prefix, _, rest = path[1:].partition('/')
+                    route, args = prefix_routes.get('/' + prefix,
+                                                    (None, ()))
+                    if route is not None and rest:
+                        args += (rest,)
+                        self._route_name = '/%s/*' % prefix
+                    else:
+                        route = None
+
+                if route is None:
+                    self.not_found()
+                else:
+                    route(self, *args)
+            finally:
+                self._request_finished(method, start)
 
-                self.wfile.close()
-                self._unrouted = False
+        def _request_started(self):
+            """Count a request in, returning its start time"""
+            self._status = None
+            try:
+                bytes_in = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                bytes_in = 0
+            self.Metrics.request_started(bytes_in)
+            return default_timer()
+
+        def _request_finished(self, method, start):
+            seconds = default_timer() - start
+            route = '%s %s' % (method, self._route_name or '(unrouted)')
+            self.Timings.record(route, seconds)
+            self.Metrics.request_finished(route, self._status, seconds)
 
         def do_GET(self):
             """Handle GET requests"""
+            self.dispatch('GET', self.GetRoutes, self.GetPrefixRoutes)
 
-            self.route("/", self.index)
-            self.route("/index", self.index)
-            self.route("/home", self.index)
+        def do_POST(self):
+            """Handle POST requests"""
+            self.dispatch('POST', self.PostRoutes)
+
+    handler = HTMLInterfaceHTTPHandler
+    for path in ('/', '/index', '/home'):
+        handler.GetRoutes[path] = (handler.static_page, (handler.index,))
+    handler.GetRoutes['/help'] = (handler.static_page, (handler.help,))
+    handler.GetRoutes[handler.StylesheetURL] = (handler.send_static,
+            (StaticBody(HTMLInterface.css_style, 'text/css',
+                        'public, max-age=86400'),))
+    handler.GetRoutes['/_timings'] = (handler.page,
+                                      (handler.timings, 'text/plain'))
+    handler.GetRoutes['/metrics'] = (handler.metrics_page, ())
+    handler.GetRoutes['/metrics.json'] = (handler.metrics_json, ())
+
+    handler.GetPrefixRoutes['/jobs'] = (handler.job_route, ())
+    handler.PostRoutes['/api'] = (handler.api_batch, ())
+
+    for command in module_commands:
+        handler.GetRoutes['/' + command] = (handler.command_page, (command,))
+        handler.PostRoutes['/' + command] = (handler.command_post, (command,))
+        handler.PostRoutes['/jobs/' + command] = (handler.submit_job,
+                                                  (command,))
+        handler.GetRoutes['/api/' + command] = (handler.api_describe,
+                                                (command,))
+        handler.PostRoutes['/api/' + command] = (handler.api_call, (command,))
+
+    return handler
+
+def make_wsgi_app(module, form_parser=None, job_queue=None):
+    """Return a WSGI application serving the HTMLInterface for ``module``
+
+    The application has the same routes as the server started by
+    ``start_server`` (pages, forms, downloads, jobs and the JSON API), and
+    can be run by any WSGI server, e.g.::
+
+        from wsgiref.simple_server import make_server
+        app = make_wsgi_app('pyqi.interfaces.html.config')
+        make_server('', 8080, app).serve_forever()
+
+    ``form_parser`` and ``job_queue`` are as for ``get_http_handler``. Jobs
+    are kept per process, so a server that runs the application in
+    several processes can't poll jobs reliably.
+    """
+    handler = get_http_handler(module, form_parser, job_queue)
+
+    class WSGIRequestHandler(handler):
+        """Handle a request from a WSGI environ instead of a socket"""
+        def __init__(self, environ):
+            # BaseHTTPRequestHandler.__init__ would read from a socket.
+            self._route_name = None
+            self.environ = environ
+            self.command = environ['REQUEST_METHOD']
+            self.path = environ.get('PATH_INFO') or '/'
+            if environ.get('QUERY_STRING'):
+                self.path += '?' + environ['QUERY_STRING']
+            self.request_version = environ.get('SERVER_PROTOCOL',
+                                               'HTTP/1.0')
+            self.headers = EnvironHeaders(environ)
+            self.rfile = environ['wsgi.input']
+            self.close_connection = False
+            self.response = None
+
+        def respond(self, status, headers, body=b'', source=None):
+            """Keep the response for the application to return
+
+            The WSGI server frames the body, so streams are left to it.
+            """
+            self._status = status
+            headers = list(headers)
+            original = body
+
+            if status in (204, 304):
+                body = []
+            elif is_text(body):
+                body = [to_bytes(body)]
+                headers.append(('Content-Length', str(len(body[0]))))
+                self.Metrics.add_bytes_out(len(body[0]))
+            elif is_file(body) and file_length(body) is not None:
+                length = file_length(body)
+                headers.append(('Content-Length', str(length)))
+                self.Metrics.add_bytes_out(length)
+                file_wrapper = self.environ.get('wsgi.file_wrapper')
+                if file_wrapper is not None:
+                    body = file_wrapper(body, SEND_BUFFER_SIZE)
+                else:
+                    body = iter_body(body)
+            else:
+                body = counted(iter_body(body), self.Metrics.add_bytes_out)
 
-            def r(write):#host.domain.tld/help
-                write("This is still a very in development interface, there is no help.")
-            self.route("/help", r)
+            self.response = (status, headers,
+                             ClosingIterator(body, [original, source]))
 
-            for command in module_commands:
-                self.command_route(command)
+        def send_error(self, code, message=None, explain=None):
+            self.respond(code, [('Content-type', 'text/html')],
+                         error_page(code, message))
 
-            self.end_routes()
-
-        def do_POST(self):
-            """Handle POST requests"""
-            postvars = FieldStorage(fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD':'POST',
-                        'CONTENT_TYPE':self.headers['Content-Type']})
+    def application(environ, start_response):
+        request = WSGIRequestHandler(environ)
+        method = getattr(request, 'do_' + request.command, None)
+        if method is None:
+            request.send_error(501, "Unsupported method (%r)" %
+                               request.command)
+        else:
+            method()
 
-            for command in module_commands:
-                self.post_route(command, postvars)
+        status, headers, body = request.response
+        start_response(status_line(status),
+                       [(str(name), str(value)) for name, value in headers])
+        return body
 
-            self.end_routes()
+    application.Handler = WSGIRequestHandler
+    return application
 
+def _discard_job_result(result):
+    if isinstance(result.get('contents'), SpooledBody):
+        result['contents'].remove()
 
-    return HTMLInterfaceHTTPHandler
+# Server modes accepted by start_server.
+SERVER_MODES = ('single', 'threaded', 'prefork', 'asyncio')
 
 #This will generally be called from a generated command.
-def start_server(port, module):
-    """Start a server for the HTMLInterface on the specified port"""
-    interface_server = HTTPServer(("", port), get_http_handler(module))
+def start_server(port, module, server_mode='single', workers=8, backlog=128,
+                 max_request_size=None, job_workers=2, max_queued_jobs=100,
+                 job_retention=3600, max_concurrent_commands=None,
+                 max_waiting_commands=0, warmup=False,
+                 max_worker_requests=None, max_worker_memory=None):
+    """Start a server for the HTMLInterface on the specified port
+
+    ``server_mode`` is one of:
+        'single' - handle one request at a time
+        'threaded' - handle requests on a pool of ``workers`` threads
+        'prefork' - handle requests in ``workers`` forked processes
+        'asyncio' - serve connections from an event loop, and handle
+                    requests on ``workers`` threads (Python 3.7 or later;
+                    see ``pyqi.core.interfaces.html.aio``)
+    ``backlog`` is the size of the queue of connections waiting to be
+    accepted. POSTs larger than ``max_request_size`` bytes are refused.
+
+    At most ``max_concurrent_commands`` commands (if not None) run at once,
+    with at most ``max_waiting_commands`` more waiting for them, in each
+    process; further calls get a 503. Each command may also declare its
+    own ``limits`` in its config module (see
+    ``pyqi.core.interfaces.html.admission``).
+
+    Commands submitted as jobs run on ``job_workers`` threads, with at most
+    ``max_queued_jobs`` waiting, and their results are kept for
+    ``job_retention`` seconds. Each process keeps its own jobs, so jobs
+    can't be polled reliably in 'prefork' mode.
+
+    If ``warmup`` is True, the Resources of every command (see
+    ``pyqi.core.resource``) are loaded before the server starts, so the
+    first requests aren't slow. Resources are released when the server
+    shuts down.
+
+    In 'prefork' mode, the parent always imports every command and loads
+    its Resources before forking, so that the workers share them rather
+    than each loading its own copy. A worker is replaced after about
+    ``max_worker_requests`` requests, or once its own memory has grown by
+    more than ``max_worker_memory`` megabytes (see ``PreforkServer``).
+
+    SIGTERM (like ctrl-c) shuts the server down gracefully: it stops
+    accepting and finishes the requests it has already accepted.
+    """
+    if server_mode not in SERVER_MODES:
+        raise IncompetentDeveloperError("Unknown server mode '%s', must be "
+                                        "one of: %s" % (server_mode,
+                                        ', '.join(SERVER_MODES)))
+
+    if max_concurrent_commands is None:
+        admission = AdmissionControl()
+    else:
+        admission = AdmissionControl(ConcurrencyLimit(
+                MaxConcurrent=max_concurrent_commands,
+                MaxWaiting=max_waiting_commands))
+
+    handler = get_http_handler(module,
+                               FormParser(MaxRequestSize=max_request_size),
+                               JobQueue(job_workers, max_queued_jobs,
+                                        job_retention),
+                               admission)
+
+    if server_mode == 'prefork':
+        # Before loading what the workers share (see PreforkServer).
+        gc.disable()
+
+    if warmup or server_mode == 'prefork':
+        print("-- Loaded command resources in %.1fs --" % handler.warmup())
+
+    if server_mode == 'single':
+        interface_server = PyqiHTTPServer(("", port), handler, backlog)
+    elif server_mode == 'threaded':
+        interface_server = PooledHTTPServer(("", port), handler, workers,
+                                            backlog)
+    elif server_mode == 'prefork':
+        if max_worker_memory is not None:
+            max_worker_memory *= 1024 * 1024
+        interface_server = PreforkServer(
+                PyqiHTTPServer(("", port), handler, backlog), workers,
+                max_worker_requests, max_worker_memory)
+    elif server_mode == 'asyncio':
+        if sys.version_info < (3, 7):
+            raise IncompetentDeveloperError("The 'asyncio' server mode "
+                                            "needs Python 3.7 or later.")
+        from pyqi.core.interfaces.html.aio import AsyncHTTPServer
+        interface_server = AsyncHTTPServer(("", port), handler, workers,
+                                           backlog)
+
+    if hasattr(interface_server, 'queue_depth'):
+        handler.Metrics.add_gauge('pyqi_http_queued_requests',
+                                  'Requests waiting for a worker.',
+                                  interface_server.queue_depth)
+
     print("-- Starting server at http://localhost:%d --" % port)
     print("To close the server, type 'ctrl-c' into this window.")
-    try:
-        interface_server.serve_forever()
 
-    except KeyboardInterrupt:
-        return "-- Finished serving HTMLInterface --"
+    if server_mode == 'prefork':
+        # The PreforkServer handles the signals itself.
+        try:
+            interface_server.serve_forever()
+        finally:
+            release_all()
+    else:
+        previous_handlers = install_shutdown_handlers(
+                lambda: shutdown_in_thread(interface_server))
+        try:
+            interface_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            restore_handlers(previous_handlers)
+            interface_server.server_close()
+            handler.Jobs.shutdown()
+            release_all()
+
+    return "-- Finished serving HTMLInterface --"
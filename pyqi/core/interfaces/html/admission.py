@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Limit how many commands the HTMLInterface server runs at once
+
+An HTML config module can limit the concurrent calls of its command, next
+to its ``inputs`` and ``outputs``::
+
+    limits = ConcurrencyLimit(MaxConcurrent=2, MaxWaiting=4,
+                              WaitTimeout=30)
+
+and the server can limit the calls of all commands together (see
+``start_server``). A call waits for a free slot in a bounded queue. When
+the queue is full, or the wait times out, the call is refused at once:
+with a 429 (Too Many Requests) if the command's own limit was reached, or
+a 503 (Service Unavailable) if the server's was. Both carry a Retry-After
+header.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+from collections import deque
+from threading import Event, Lock
+
+from pyqi.core.exception import IncompetentDeveloperError
+
+class AdmissionError(Exception):
+    """A command call refused because too many are running
+
+    ``Status`` is the HTTP status code to respond with, and
+    ``RetryAfter`` the seconds after which the client may try again.
+    """
+    Status = 503
+
+    def __init__(self, message, RetryAfter=1):
+        super(AdmissionError, self).__init__(message)
+        self.RetryAfter = RetryAfter
+
+class CommandBusyError(AdmissionError):
+    Status = 429
+
+class ServerBusyError(AdmissionError):
+    Status = 503
+
+class ConcurrencyLimit(object):
+    """A limit on concurrent command calls
+
+    At most ``MaxConcurrent`` calls run at once, and at most ``MaxWaiting``
+    more wait (for at most ``WaitTimeout`` seconds, or for as long as it
+    takes if None) for one of them to finish. Refused clients are told to
+    retry after ``RetryAfter`` seconds.
+    """
+    def __init__(self, MaxConcurrent, MaxWaiting=0, WaitTimeout=None,
+                 RetryAfter=1):
+        if MaxConcurrent < 1:
+            raise IncompetentDeveloperError("MaxConcurrent must be at least "
+                                            "1.")
+        if MaxWaiting < 0:
+            raise IncompetentDeveloperError("MaxWaiting can't be negative.")
+
+        self.MaxConcurrent = MaxConcurrent
+        self.MaxWaiting = MaxWaiting
+        self.WaitTimeout = WaitTimeout
+        self.RetryAfter = RetryAfter
+
+class Limiter(object):
+    """Enforce a ``ConcurrencyLimit``, raising ``error_class`` on refusal
+
+    A finished call hands its slot straight to the first waiting call, so
+    calls run in the order they arrived. Waiters are objects with a
+    ``set()`` method (such as a ``threading.Event``), called when they are
+    handed a slot, so calls can wait on a thread or on an event loop.
+    """
+    def __init__(self, limit, error_class, name):
+        self.limit = limit
+        self.error_class = error_class
+        self.name = name
+        self.running = 0
+        self._waiters = deque()
+        self._lock = Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, queue=True):
+        """Take a slot, waiting if need be
+
+        If ``queue`` is False, wait for as long as it takes, however many
+        calls are already waiting (e.g., for a job that is queued anyway).
+        """
+        waiter = Event()
+        if self.admit(waiter, queue):
+            return
+
+        timeout = self.limit.WaitTimeout if queue else None
+        if not waiter.wait(timeout):
+            self.withdraw(waiter)
+
+    def admit(self, waiter, queue=True):
+        """Take a free slot, returning True, or queue ``waiter``
+
+        Raises ``error_class`` if the queue is full.
+        """
+        with self._lock:
+            if self.running < self.limit.MaxConcurrent:
+                self.running += 1
+                return True
+
+            if queue and len(self._waiters) >= self.limit.MaxWaiting:
+                raise self.error_class("Too many %s are running; try again "
+                                       "later." % self.name,
+                                       self.limit.RetryAfter)
+            self._waiters.append(waiter)
+            return False
+
+    def check(self):
+        """Raise ``error_class`` if a call would be refused right now
+
+        Takes nothing, so a call can be refused cheaply before the work
+        that has to precede ``acquire`` (e.g., reading its request).
+        """
+        with self._lock:
+            if self.running >= self.limit.MaxConcurrent and \
+               len(self._waiters) >= self.limit.MaxWaiting:
+                raise self.error_class("Too many %s are running; try again "
+                                       "later." % self.name,
+                                       self.limit.RetryAfter)
+
+    def withdraw(self, waiter):
+        """Give up waiting, raising ``error_class``
+
+        Returns without raising if ``waiter`` was handed a slot meanwhile.
+        """
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return
+
+        raise self.error_class("Timed out waiting for other %s to finish."
+                               % self.name, self.limit.RetryAfter)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # The slot passes to the waiter, so running is unchanged.
+                self._waiters.popleft().set()
+            else:
+                self.running -= 1
+
+class Slot(object):
+    """Slots held on some ``Limiter``s, released on ``release`` (or on
+    leaving a ``with`` block)
+    """
+    def __init__(self, limiters=()):
+        self.limiters = list(limiters)
+
+    def release(self):
+        while self.limiters:
+            self.limiters.pop().release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+class AdmissionControl(object):
+    """The per-command and server-wide limits of a server
+
+    ``limit`` is the server-wide ``ConcurrencyLimit``, or None for no
+    limit.
+    """
+    def __init__(self, limit=None):
+        if limit is None:
+            self.server_limiter = None
+        else:
+            self.server_limiter = Limiter(limit, ServerBusyError, 'commands')
+        self._limiters = {}
+        self._lock = Lock()
+
+    def limiters(self, command, limit):
+        """Return the ``Limiter``s a call of ``command`` must pass, in order
+
+        ``limit`` is the command's own ``ConcurrencyLimit``, or None.
+        """
+        limiters = []
+        if limit is not None:
+            with self._lock:
+                limiter = self._limiters.get(command)
+                if limiter is None:
+                    limiter = self._limiters[command] = Limiter(limit,
+                            CommandBusyError, "'%s' commands" % command)
+            limiters.append(limiter)
+
+        if self.server_limiter is not None:
+            limiters.append(self.server_limiter)
+        return limiters
+
+    def admit(self, command, limit, queue=True):
+        """Return a ``Slot`` to run ``command`` in, waiting if need be
+
+        Raises an ``AdmissionError`` if the call is refused. The command's
+        own limit is passed first, so calls waiting on it don't hold up
+        other commands.
+        """
+        slot = Slot()
+        try:
+            for limiter in self.limiters(command, limit):
+                limiter.acquire(queue)
+                slot.limiters.append(limiter)
+        except:
+            slot.release()
+            raise
+        return slot
+
+    def check(self, command, limit):
+        """Raise an ``AdmissionError`` if a call of ``command`` would be
+        refused right now, without taking a slot
+        """
+        for limiter in self.limiters(command, limit):
+            limiter.check()
+
+    def waiting(self):
+        """Return the number of calls waiting for a slot"""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        if self.server_limiter is not None:
+            limiters.append(self.server_limiter)
+        return sum(limiter.waiting for limiter in limiters)
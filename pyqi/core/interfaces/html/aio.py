@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""An asyncio server for the HTMLInterface (Python 3.7 or later)
+
+``AsyncHTTPServer`` serves every connection from one event loop, so idle
+keep-alive connections and slow clients cost a coroutine rather than a
+thread. Requests are handled by the (blocking) handler from
+``get_http_handler`` on a bounded pool of worker threads, except for JSON
+API calls of async Commands (those whose ``run`` is a coroutine function),
+which are awaited on the loop itself and hold no thread at all.
+
+Request bodies and responses go through the loop with backpressure. The
+loop stops reading from a client while a body it has sent waits unread,
+and a worker writing a response waits while the client is slow to take
+it, instead of buffering the whole response in memory.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import asyncio
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Event, Lock
+
+from pyqi.core.interfaces.html import normalize_route_path
+from pyqi.core.singleflight import call_key
+from pyqi.core.interfaces.html.admission import AdmissionError, Slot
+from pyqi.core.interfaces.html.api import APIError, error_dict, to_jsonable
+from pyqi.core.interfaces.html.response import SEND_BUFFER_SIZE
+
+async def call_command(cmd, kwargs):
+    """Await an async ``Command`` on the running loop, like ``cmd(**kwargs)``"""
+    cmd._start(kwargs)
+
+    try:
+        result = await cmd.run(**kwargs)
+    except Exception:
+        cmd._failed()
+        raise
+
+    return cmd._finish(result)
+
+async def admit(admission, command, limit):
+    """Like ``AdmissionControl.admit``, but wait on the running loop"""
+    loop = asyncio.get_running_loop()
+    slot = Slot()
+    try:
+        for limiter in admission.limiters(command, limit):
+            waiter = _LoopWaiter(loop)
+            if not limiter.admit(waiter):
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future),
+                                           limiter.limit.WaitTimeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    # Raises, unless the slot was handed over meanwhile.
+                    limiter.withdraw(waiter)
+            slot.limiters.append(limiter)
+    except BaseException:
+        slot.release()
+        raise
+    return slot
+
+async def share(flights, key, func, *args):
+    """Like ``SingleFlight.do``, but await ``func(*args)`` on the running loop
+
+    Calls sharing the execution wait on the loop, whether the execution
+    runs on the loop or on another thread.
+    """
+    flight, leader = flights.join(key)
+    if not leader:
+        waiter = _LoopWaiter(asyncio.get_running_loop())
+        flight.add_waiter(waiter)
+        await waiter.future
+        return flight.outcome(), True
+
+    try:
+        result = await func(*args)
+    except BaseException as e:
+        flights.finish(key, flight, error=e)
+        raise
+
+    flights.finish(key, flight, result)
+    return result, False
+
+class _LoopWaiter(object):
+    """A ``Limiter`` (or ``Flight``) waiter that wakes a future on the loop"""
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class AsyncHTTPServer(object):
+    """Serve ``RequestHandlerClass`` from an event loop
+
+    ``RequestHandlerClass`` is a handler from ``get_http_handler``. Its
+    requests run on ``workers`` threads, and ``backlog`` is the size of
+    the queue of connections waiting to be accepted. Like the other
+    servers, the socket is bound when the server is created, and
+    ``shutdown`` (from another thread) makes ``serve_forever`` stop
+    accepting, finish the requests in progress and return.
+    """
+    # Bytes of a request buffered before the loop stops reading from the
+    # client. It is also the longest request line and headers accepted.
+    ReadBufferSize = 64 * 1024
+    # Largest JSON body accepted for a call of an async Command, which is
+    # read into memory before the call, if the handler's FormParser sets no
+    # MaxRequestSize.
+    MaxAsyncRequestSize = 1024 * 1024
+
+    def __init__(self, server_address, RequestHandlerClass, workers=8,
+                 backlog=128):
+        self.RequestHandlerClass = RequestHandlerClass
+        self.workers = workers
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(server_address)
+            self.socket.listen(backlog)
+        except:
+            self.socket.close()
+            raise
+        self.server_address = self.socket.getsockname()
+
+        self._request_class = _make_request_class(RequestHandlerClass)
+        self._loop = None
+        self._stopping = None
+        self._shutdown_request = False
+        self._is_shut_down = Event()
+        self._is_shut_down.set()
+        self._connections = set()
+        self._idle = set()
+        self._waiting = 0
+        self._waiting_lock = Lock()
+
+    def serve_forever(self):
+        """Serve until ``shutdown`` is called"""
+        self._is_shut_down.clear()
+        loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(self.workers,
+                                            'pyqi-http-worker')
+        try:
+            loop.run_until_complete(self._serve(loop))
+        finally:
+            self._executor.shutdown(wait=False)
+            loop.close()
+            self._loop = None
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stop ``serve_forever``, and wait for it to return"""
+        self._shutdown_request = True
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._stopping.set)
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+    def queue_depth(self):
+        """Return the number of requests waiting for a worker thread"""
+        return self._waiting
+
+    def keep_alive(self):
+        """Idle connections only cost a coroutine, so they are kept open"""
+        return True
+
+    async def _serve(self, loop):
+        self._stopping = asyncio.Event()
+        self._loop = loop
+        if self._shutdown_request:
+            return
+
+        server = await asyncio.start_server(self._handle_connection,
+                                            sock=self.socket,
+                                            limit=self.ReadBufferSize)
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            # Connections waiting for a request won't get one; the others
+            # close once their current request is done.
+            for writer in list(self._idle):
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        connection = _Connection(self, reader, writer)
+        try:
+            while not self._stopping.is_set():
+                head = await self._read_head(connection)
+                if head is None or \
+                   not await self._handle_request(connection, head):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            # As socketserver's handle_error does.
+            traceback.print_exc()
+        finally:
+            writer.close()
+            self._connections.discard(task)
+
+    async def _read_head(self, connection):
+        """Return the request line and headers, or None if there are none"""
+        self._idle.add(connection.writer)
+        try:
+            return await asyncio.wait_for(
+                    connection.reader.readuntil(b'\r\n\r\n'),
+                    self.RequestHandlerClass.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            return None
+        finally:
+            self._idle.discard(connection.writer)
+
+    async def _handle_request(self, connection, head):
+        """Handle a request, returning whether to keep the connection"""
+        request = self._request_class(connection, head)
+        if request.parse_head():
+            command = request.async_api_command()
+            if command is None:
+                with self._waiting_lock:
+                    self._waiting += 1
+                await connection.loop.run_in_executor(self._executor,
+                                                      self._handle, request)
+            else:
+                await request.api_call_async(command)
+
+        await connection.writer.drain()
+        return not request.close_connection
+
+    def _handle(self, request):
+        with self._waiting_lock:
+            self._waiting -= 1
+        request.handle()
+
+class _Connection(object):
+    """A client connection, shared by the loop and a worker thread"""
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.peername = writer.get_extra_info('peername')
+
+    def on_loop(self):
+        """Return whether this is the event loop's thread"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def call(self, coroutine):
+        """Run ``coroutine`` on the loop from a worker thread, and wait"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def sendfile(self, f, length):
+        await self.writer.drain()
+        await self.loop.sendfile(self.writer.transport, f, f.tell(), length)
+
+class _RequestFile(object):
+    """The ``rfile`` of a request
+
+    Holds the request line and headers, then reads at most Content-Length
+    bytes of body from the client. A worker thread's reads go through the
+    loop; on the loop, the body must be read with ``preload`` first.
+    """
+    def __init__(self, connection, head):
+        self._connection = connection
+        self._head = BytesIO(head)
+        self._body = None
+        self.remaining = 0
+
+    def set_length(self, content_length):
+        try:
+            self.remaining = max(int(content_length), 0)
+        except (TypeError, ValueError):
+            self.remaining = 0
+
+    def readline(self, limit=-1):
+        return self._head.readline(limit)
+
+    def read(self, size=-1):
+        if self._body is not None:
+            return self._body.read(size)
+
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return b''
+
+        try:
+            data = self._connection.call(
+                    self._connection.reader.readexactly(size))
+        except asyncio.IncompleteReadError as e:
+            data = e.partial
+            self.remaining = len(data)
+        self.remaining -= len(data)
+        return data
+
+    async def preload(self):
+        """Read the whole body into memory"""
+        try:
+            body = await self._connection.reader.readexactly(self.remaining)
+        except asyncio.IncompleteReadError as e:
+            body = e.partial
+        self.remaining = 0
+        self._body = BytesIO(body)
+
+class _ResponseFile(object):
+    """The ``wfile`` of a request
+
+    Writes are buffered up to ``SEND_BUFFER_SIZE`` bytes. A worker thread
+    sending a buffer waits until the client has taken most of what was
+    sent before. On the loop, writes are only buffered by the transport.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= SEND_BUFFER_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._buffer:
+            return
+
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+
+        if self._connection.on_loop():
+            self._connection.writer.write(data)
+        else:
+            self._connection.call(self._connection.write(data))
+
+def _make_request_class(handler):
+    class AsyncRequestHandler(handler):
+        """Handle a request read by an ``AsyncHTTPServer``"""
+        def __init__(self, connection, head):
+            # BaseHTTPRequestHandler.__init__ would read from a socket.
+            self._route_name = None
+            self._connection = connection
+            self.server = connection.server
+            self.client_address = connection.peername
+            self.connection = None
+            self.rfile = _RequestFile(connection, head)
+            self.wfile = _ResponseFile(connection)
+            self.close_connection = True
+
+        def parse_head(self):
+            """Parse the request line and headers (on the loop)
+
+            Returns False after responding with an error if they are bad.
+            """
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.parse_request():
+                self.wfile.flush()
+                return False
+
+            self.rfile.set_length(self.headers.get('Content-Length'))
+            if self.headers.get('Transfer-Encoding'):
+                # A body without a length can't be skipped.
+                self.close_connection = True
+            return True
+
+        def handle(self):
+            """Call the method for the request (on a worker thread)"""
+            method = getattr(self, 'do_' + self.command, None)
+            if method is None:
+                self.send_error(501, "Unsupported method (%r)" %
+                                self.command)
+            else:
+                method()
+            self.wfile.flush()
+
+            if self.rfile.remaining:
+                # The rest of the body would be read as the next request.
+                self.close_connection = True
+
+        def _send_file(self, f, length):
+            self.wfile.flush()
+            self._connection.call(self._connection.sendfile(f, length))
+
+        def async_api_command(self):
+            """Return the command of a JSON API call of an async Command
+
+            Returns None for any other request.
+            """
+            if self.command != 'POST':
+                return None
+
+            route, args = self.PostRoutes.get(self._route_path(),
+                                              (None, ()))
+            if route is not handler.api_call:
+                return None
+
+            command = args[0]
+            if not self.Interfaces.get(command).CmdInstance.is_async():
+                return None
+            return command
+
+        async def api_call_async(self, command):
+            """Like ``api_call``, but await the command on the loop"""
+            start = self._request_started()
+            self._route_name = self._route_path()
+            try:
+                max_size = self.FormParser.MaxRequestSize
+                if max_size is None:
+                    max_size = self.server.MaxAsyncRequestSize
+                if self.rfile.remaining <= max_size:
+                    await self.rfile.preload()
+
+                try:
+                    inputs = self._read_json(max_size)
+                    cmd, kwargs = self._api_inputs(command, inputs)
+                except APIError as e:
+                    self.send_json({'command': command,
+                                    'error': error_dict(e)}, e.Status)
+                    return
+
+                try:
+                    key = call_key(cmd, kwargs)
+                    if key is None:
+                        status, response = await self._api_run_async(
+                                command, cmd, kwargs)
+                    else:
+                        (status, response), _ = await share(self.Flights,
+                                (command, key), self._api_run_async,
+                                command, cmd, kwargs)
+                except AdmissionError as e:
+                    self.send_json({'command': command,
+                                    'error': error_dict(e)}, e.Status,
+                                   [('Retry-After', str(e.RetryAfter))])
+                    return
+
+                self.send_json(response, status)
+            finally:
+                self.wfile.flush()
+                self._request_finished('POST', start)
+
+        async def _api_run_async(self, command, cmd, kwargs):
+            """Like ``_api_run``, but await the command on the loop"""
+            slot = await admit(self.Admission, command,
+                               self.Interfaces.get(command).Limits)
+            try:
+                with slot, self.Metrics.time_command(command):
+                    result = await call_command(cmd, kwargs)
+            except Exception as e:
+                return 500, {'command': command, 'error': error_dict(e)}
+
+            return 200, {'command': command, 'result': to_jsonable(result)}
+
+        def _route_path(self):
+            return normalize_route_path(self.path)
+
+    return AsyncRequestHandler
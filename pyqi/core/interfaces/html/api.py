@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Run commands from JSON requests
+
+The JSON API skips the HTML forms: the inputs of a request are the names
+and values of the command's ``CommandIns``, and the response holds the
+values of its ``CommandOuts``. For example, the body of a POST to
+'/api/make-command' could be::
+
+    {"name": "foo", "command_class_name": "Foo", "author": "me",
+     "email": "me@example.com"}
+
+and a POST to '/api' takes a list of such invocations::
+
+    [{"command": "make-command", "inputs": {...}}, ...]
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import json
+
+from pyqi.util import is_py2
+
+if is_py2():
+    _string_types = (str, unicode)
+    _int_types = (int, long)
+else:
+    _string_types = (str,)
+    _int_types = (int,)
+
+class APIError(ValueError):
+    """A JSON request that can't be run
+
+    ``Status`` is the HTTP status code to respond with.
+    """
+    Status = 400
+
+class RequestTooLargeError(APIError):
+    Status = 413
+
+class UnknownCommandError(APIError):
+    Status = 404
+
+def read_json(fp, content_length, max_size=None):
+    """Read and decode the JSON body of a request"""
+    try:
+        content_length = int(content_length)
+    except (TypeError, ValueError):
+        raise APIError("The request must have a valid Content-Length.")
+    if max_size is not None and content_length > max_size:
+        raise RequestTooLargeError("The request is larger than %d bytes." %
+                                   max_size)
+
+    body = fp.read(content_length)
+    if len(body) < content_length:
+        raise APIError("The request is truncated.")
+
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError as e:
+        raise APIError("The request is not valid JSON: %s" % e)
+
+def get_command_inputs(cmd, inputs):
+    """Return the kwargs to call ``cmd`` with, checked against its CommandIns
+
+    Raises an ``APIError`` for unknown, missing or mistyped inputs, or for
+    values a ``CommandIn`` doesn't accept. Optional inputs that are missing
+    (or null) are left to their defaults.
+    """
+    if not isinstance(inputs, dict):
+        raise APIError("The inputs must be a JSON object.")
+
+    for name in inputs:
+        if name not in cmd.CommandIns:
+            raise APIError("Unknown input '%s'." % name)
+
+    kwargs = {}
+    for param in cmd.CommandIns.values():
+        value = inputs.get(param.Name)
+        if value is None:
+            if param.Required:
+                raise APIError("Missing required input '%s'." % param.Name)
+            continue
+
+        value = coerce_value(param, value)
+        if param.ValidateValue is not None and not param.ValidateValue(value):
+            raise APIError("Input '%s' cannot take value %r." % (param.Name,
+                                                                  value))
+        kwargs[param.Name] = value
+
+    return kwargs
+
+def coerce_value(param, value):
+    """Convert a JSON value to the ``DataType`` of ``param``
+
+    JSON has no types for most other ``DataType``s, so their values are
+    passed through unchanged.
+    """
+    data_type = param.DataType
+    is_bool = isinstance(value, bool)
+
+    if data_type is str:
+        ok = isinstance(value, _string_types)
+    elif data_type is bool:
+        ok = is_bool
+    elif data_type in _int_types:
+        ok = isinstance(value, _int_types) and not is_bool
+    elif data_type is float:
+        ok = isinstance(value, _int_types + (float,)) and not is_bool
+        if ok:
+            value = float(value)
+    elif data_type in (list, tuple, set, frozenset):
+        ok = isinstance(value, list)
+        if ok:
+            value = data_type(value)
+    elif data_type is dict:
+        ok = isinstance(value, dict)
+    else:
+        ok = True
+
+    if not ok:
+        raise APIError("Input '%s' must be of type %s." % (param.Name,
+                                                            data_type.__name__))
+    return value
+
+def describe_command(cmd):
+    """Return a JSON-able description of a command's inputs and outputs"""
+    def describe(param):
+        description = {'name': param.Name,
+                       'type': getattr(param.DataType, '__name__',
+                                       str(param.DataType)),
+                       'description': param.Description}
+        if hasattr(param, 'Required'):
+            description['required'] = param.Required
+            description['default'] = to_jsonable(param.Default)
+        return description
+
+    return {'description': cmd.BriefDescription,
+            'inputs': [describe(p) for p in cmd.CommandIns.Parameters],
+            'outputs': [describe(p) for p in cmd.CommandOuts.Parameters]}
+
+def error_dict(error):
+    return {'type': error.__class__.__name__, 'message': str(error)}
+
+def to_jsonable(value):
+    """Return ``value``, or a JSON-able stand-in for it"""
+    if value is None or isinstance(value, (bool, float) + _int_types +
+                                   _string_types):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return dict((str(k), to_jsonable(v)) for k, v in value.items())
+    if hasattr(value, '__iter__') and not hasattr(value, 'read'):
+        return [to_jsonable(v) for v in value]
+    return str(value)
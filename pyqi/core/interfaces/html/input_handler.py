@@ -12,6 +12,10 @@
 __credits__ = ["Evan Bolyen"]
 
 from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.interface import iterable_handler
+
+# Size of the chunks returned by iter_file_chunks.
+READ_BUFFER_SIZE = 1024 * 1024
 
 def load_file_lines(option_value):
     """Return a list of strings, one per line in the file.
@@ -29,3 +33,28 @@ def load_file_contents(option_value):
         raise IncompetentDeveloperError("Input type must be a file object.")
     
     return option_value.read()
+
+@iterable_handler
+def iter_file_lines(option_value):
+    """Return an iterator over the lines in a file object.
+
+    Each line will have leading and trailing whitespace stripped from it.
+    Lines are read on demand, so uploads are never held in memory in full.
+    """
+    if not hasattr(option_value, 'read'):
+        raise IncompetentDeveloperError("Input type must be a file object.")
+
+    return (line.strip() for line in option_value)
+
+@iterable_handler
+def iter_file_chunks(option_value):
+    """Return an iterator over the contents of a file object.
+
+    The contents are read on demand in chunks of up to ``READ_BUFFER_SIZE``
+    bytes (or characters, for files opened in text mode).
+    """
+    if not hasattr(option_value, 'read'):
+        raise IncompetentDeveloperError("Input type must be a file object.")
+
+    return iter(lambda: option_value.read(READ_BUFFER_SIZE),
+                option_value.read(0))
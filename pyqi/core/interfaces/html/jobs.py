@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Run commands in the background for the HTMLInterface
+
+A ``JobQueue`` runs submitted jobs on a fixed number of worker threads.
+Jobs wait in a bounded queue, and submitting to a full queue fails
+immediately rather than piling up work. Finished jobs are kept for
+``retention`` seconds (and at most ``max_finished`` of them) so that their
+results can be fetched, then discarded.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import sys
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import time
+from uuid import uuid4
+
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.util import is_py2
+if is_py2():
+    from Queue import Queue, Full
+else:
+    from queue import Queue, Full
+
+class JobQueueFullError(Exception):
+    pass
+
+class Job(object):
+    """A command invocation queued on a ``JobQueue``"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, command, func, cleanup=None, discard=None):
+        self.id = uuid4().hex
+        self.command = command
+        self.status = self.QUEUED
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+        self._func = func
+        self._cleanup = cleanup
+        self._discard = discard
+
+    @property
+    def done(self):
+        return self.status in (self.FINISHED, self.FAILED)
+
+    def run(self):
+        self.status = self.RUNNING
+        self.started = time()
+        try:
+            self.result = self._func()
+            self.status = self.FINISHED
+        except Exception as e:
+            self.error = e
+            self.status = self.FAILED
+        finally:
+            self.finished = time()
+            self._func = None
+            if self._cleanup is not None:
+                self._cleanup()
+                self._cleanup = None
+
+    def discard(self):
+        """Release the result of a job that is no longer kept"""
+        if self._discard is not None and self.result is not None:
+            self._discard(self.result)
+        self.result = None
+
+    def to_dict(self):
+        return {'id': self.id,
+                'command': self.command,
+                'status': self.status,
+                'submitted': self.submitted,
+                'started': self.started,
+                'finished': self.finished,
+                'error': None if self.error is None else str(self.error)}
+
+class JobQueue(object):
+    """Run jobs on ``workers`` threads, queueing at most ``max_queued``
+
+    The worker threads are started by the first ``submit``.
+    """
+    def __init__(self, workers=2, max_queued=100, retention=3600,
+                 max_finished=1000):
+        if workers < 1:
+            raise IncompetentDeveloperError("A JobQueue needs at least one "
+                                            "worker.")
+
+        self.workers = workers
+        self.retention = retention
+        self.max_finished = max_finished
+
+        self._queue = Queue(maxsize=max_queued)
+        self._threads = []
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._lock = Lock()
+
+    def submit(self, command, func, cleanup=None, discard=None):
+        """Queue ``func`` to run, returning its ``Job``
+
+        ``cleanup`` is called once ``func`` has run, and ``discard(result)``
+        once the job's result is no longer kept. Raises
+        ``JobQueueFullError`` if the queue is full.
+        """
+        self._start_workers()
+
+        job = Job(command, func, cleanup, discard)
+        with self._lock:
+            self._evict()
+            try:
+                self._queue.put_nowait(job)
+            except Full:
+                raise JobQueueFullError("Too many jobs are waiting to run.")
+            self._jobs[job.id] = job
+
+        return job
+
+    def get(self, job_id):
+        """Return the ``Job`` with ``job_id``, or None if it isn't kept"""
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def depth(self):
+        """Return the number of jobs waiting to run"""
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """Finish the queued jobs, then stop the workers"""
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._process_jobs,
+                                name='pyqi-job-worker-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _process_jobs(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            job.run()
+            with self._lock:
+                self._finished[job.id] = job
+
+    def _evict(self):
+        """Discard finished jobs past their retention (holding the lock)"""
+        expired = []
+        cutoff = time() - self.retention
+
+        for job_id, job in self._finished.items():
+            if job.finished < cutoff or \
+               len(self._finished) - len(expired) > self.max_finished:
+                expired.append(job_id)
+            else:
+                # Jobs are in order of finishing, so the rest are newer.
+                break
+
+        for job_id in expired:
+            job = self._finished.pop(job_id)
+            del self._jobs[job_id]
+            try:
+                job.discard()
+            except Exception:
+                sys.excepthook(*sys.exc_info())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Request and command metrics for the HTMLInterface server
+
+A ``Metrics`` counts requests (per route and status) and command calls
+(per command and outcome), keeps histograms of their latencies (and of
+the sizes of the batches of batched commands), and tracks
+how many of each are in flight and how many body bytes went in and out.
+Gauges sampled when the metrics are read, such as the depth of a queue,
+can be added with ``add_gauge``.
+
+The server exposes them at '/metrics', in the Prometheus text format, and
+at '/metrics.json'. Each process of a ``PreforkServer`` keeps its own
+metrics.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+from bisect import bisect_left
+from threading import Lock
+from timeit import default_timer
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Upper bounds of the batch size histogram buckets.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+# The quantiles given in the JSON metrics.
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram(object):
+    """Count observations in buckets, as a Prometheus histogram does
+
+    ``buckets`` are the (sorted) upper bounds of the buckets. Values
+    larger than the last fall in an overflow bucket.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile (0 <= q <= 1) of the observations
+
+        The estimate interpolates linearly within the bucket holding the
+        quantile, so it is only as precise as the buckets, but it is never
+        more than the largest observation.
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.max
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(estimate, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        """Return the count, mean, max and ``QUANTILES`` as a dict"""
+        summary = {'count': self.count,
+                   'mean': self.sum / self.count if self.count else None,
+                   'max': self.max if self.count else None}
+        for q in QUANTILES:
+            summary['p%d' % round(100 * q)] = self.quantile(q)
+        return summary
+
+class Metrics(object):
+    """Counters, gauges and latency histograms for a server
+
+    Safe to share between threads.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = Lock()
+
+        self._requests = {}
+        self._request_latency = {}
+        self._requests_in_flight = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+        self._commands = {}
+        self._command_latency = {}
+        self._commands_in_flight = {}
+        self._batch_sizes = {}
+
+        self._gauges = []
+
+    def request_started(self, bytes_in=0):
+        with self._lock:
+            self._requests_in_flight += 1
+            self._bytes_in += bytes_in
+
+    def request_finished(self, route, status, seconds):
+        """Record a request to ``route``
+
+        ``status`` is None for a request that got no response (e.g., as
+        the client went away).
+        """
+        with self._lock:
+            self._requests_in_flight -= 1
+            key = (route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._request_latency, route).observe(seconds)
+
+    def add_bytes_out(self, count):
+        with self._lock:
+            self._bytes_out += count
+
+    def time_command(self, command):
+        """Return a context manager recording a call of ``command``
+
+        The call counts as an error if it raises, or if ``failed`` is set
+        on the object returned by ``__enter__``.
+        """
+        return _CommandTimer(self, command)
+
+    def command_started(self, command):
+        with self._lock:
+            self._commands_in_flight[command] = \
+                    self._commands_in_flight.get(command, 0) + 1
+
+    def command_finished(self, command, seconds, failed=False):
+        with self._lock:
+            self._commands_in_flight[command] -= 1
+            key = (command, 'error' if failed else 'ok')
+            self._commands[key] = self._commands.get(key, 0) + 1
+            self._histogram(self._command_latency, command).observe(seconds)
+
+    def record_batch(self, command, size):
+        """Record a batch of ``size`` calls of ``command`` run together"""
+        with self._lock:
+            histogram = self._batch_sizes.get(command)
+            if histogram is None:
+                histogram = self._batch_sizes[command] = \
+                        Histogram(BATCH_SIZE_BUCKETS)
+            histogram.observe(size)
+
+    def add_gauge(self, name, description, func):
+        """Report ``func()`` as the gauge ``name`` whenever metrics are read
+
+        ``name`` should be a valid Prometheus metric name.
+        """
+        self._gauges.append((name, description, func))
+
+    def to_dict(self):
+        """Return the metrics as a JSON-able dict"""
+        with self._lock:
+            requests = {}
+            for (route, status), count in self._requests.items():
+                stats = requests.setdefault(route, {'count': 0, 'errors': 0,
+                                                    'statuses': {}})
+                stats['count'] += count
+                stats['statuses'][str(status)] = count
+                if _is_error(status):
+                    stats['errors'] += count
+            for route, histogram in self._request_latency.items():
+                requests[route]['latency'] = histogram.summary()
+
+            commands = {}
+            for command, histogram in self._command_latency.items():
+                commands[command] = {
+                    'count': histogram.count,
+                    'errors': self._commands.get((command, 'error'), 0),
+                    'in_flight': self._commands_in_flight.get(command, 0),
+                    'latency': histogram.summary()}
+            for command, histogram in self._batch_sizes.items():
+                if command in commands:
+                    commands[command]['batch_size'] = histogram.summary()
+
+            metrics = {'requests': requests,
+                       'commands': commands,
+                       'requests_in_flight': self._requests_in_flight,
+                       'bytes_in': self._bytes_in,
+                       'bytes_out': self._bytes_out}
+
+        metrics['gauges'] = dict((name, func())
+                                 for name, _, func in self._gauges)
+        return metrics
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        def metric(name, kind, description, samples):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (name, suffix,
+                                            _format_labels(labels),
+                                            _format_value(value)))
+
+        with self._lock:
+            metric('pyqi_http_requests_total', 'counter',
+                   'HTTP requests handled, by route and status.',
+                   [('', [('route', route), ('status', status or 'none')],
+                     count) for (route, status), count in
+                    sorted(self._requests.items(), key=_sort_key)])
+            metric('pyqi_http_request_errors_total', 'counter',
+                   'HTTP requests that failed (a 5xx status, or no '
+                   'response), by route.',
+                   self._error_samples())
+            metric('pyqi_http_request_duration_seconds', 'histogram',
+                   'HTTP request latency, by route.',
+                   self._histogram_samples('route', self._request_latency))
+            metric('pyqi_http_requests_in_flight', 'gauge',
+                   'HTTP requests being handled.',
+                   [('', [], self._requests_in_flight)])
+            metric('pyqi_http_received_bytes_total', 'counter',
+                   'Bytes of request bodies received.',
+                   [('', [], self._bytes_in)])
+            metric('pyqi_http_sent_bytes_total', 'counter',
+                   'Bytes of response bodies sent.',
+                   [('', [], self._bytes_out)])
+
+            metric('pyqi_command_calls_total', 'counter',
+                   'Command calls, by command and outcome.',
+                   [('', [('command', command), ('outcome', outcome)],
+                     count) for (command, outcome), count in
+                    sorted(self._commands.items())])
+            metric('pyqi_command_duration_seconds', 'histogram',
+                   'Command latency, by command.',
+                   self._histogram_samples('command', self._command_latency))
+            metric('pyqi_commands_in_flight', 'gauge',
+                   'Command calls running, by command.',
+                   [('', [('command', command)], count) for command, count in
+                    sorted(self._commands_in_flight.items())])
+            metric('pyqi_command_batch_size', 'histogram',
+                   'Calls run together in a batch, by command.',
+                   self._histogram_samples('command', self._batch_sizes))
+
+        for name, description, func in self._gauges:
+            metric(name, 'gauge', description, [('', [], func())])
+
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def _error_samples(self):
+        errors = {}
+        for (route, status), count in self._requests.items():
+            errors.setdefault(route, 0)
+            if _is_error(status):
+                errors[route] += count
+        return [('', [('route', route)], count)
+                for route, count in sorted(errors.items())]
+
+    def _histogram_samples(self, label, histograms):
+        samples = []
+        for key, histogram in sorted(histograms.items()):
+            cumulative = 0
+            bounds = [_format_value(b) for b in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                samples.append(('_bucket', [(label, key), ('le', bound)],
+                                cumulative))
+            samples.append(('_sum', [(label, key)], histogram.sum))
+            samples.append(('_count', [(label, key)], histogram.count))
+        return samples
+
+class _CommandTimer(object):
+    def __init__(self, metrics, command):
+        self.metrics = metrics
+        self.command = command
+        self.failed = False
+
+    def __enter__(self):
+        self.metrics.command_started(self.command)
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.command_finished(self.command,
+                                      default_timer() - self.start,
+                                      self.failed or exc_type is not None)
+        return False
+
+def counted(pieces, callback):
+    """Yield ``pieces``, then call ``callback`` with their total length
+
+    ``callback`` is called even if the pieces aren't all consumed.
+    """
+    total = 0
+    try:
+        for piece in pieces:
+            total += len(piece)
+            yield piece
+    finally:
+        callback(total)
+
+def _is_error(status):
+    return status is None or status >= 500
+
+def _sort_key(item):
+    (route, status), count = item
+    return route, status or 0
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label(value))
+                             for name, value in labels)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Parse HTML form submissions
+
+``FormParser`` reads ``multipart/form-data`` (and
+``application/x-www-form-urlencoded``) request bodies incrementally. Uploaded
+files are kept in memory up to ``SpoolSize`` bytes and written to temporary
+files beyond that, so memory use doesn't grow with the size of an upload.
+Size limits are enforced while the body is read.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import os
+import re
+from io import BytesIO
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+
+from pyqi.util import is_py2
+if is_py2():
+    from urlparse import parse_qsl
+else:
+    from urllib.parse import parse_qsl
+
+# Size of the reads from the request body.
+READ_CHUNK_SIZE = 64 * 1024
+
+# Limit on the size of the headers of each part.
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+class FormError(ValueError):
+    """A request body that can't be parsed
+
+    ``Status`` is the HTTP status code to respond with.
+    """
+    Status = 400
+
+class LengthRequiredError(FormError):
+    Status = 411
+
+class RequestTooLargeError(FormError):
+    Status = 413
+
+class FormField(object):
+    """A single field of a submitted form
+
+    ``value`` is the field's contents: a ``str`` for ordinary fields, and
+    ``bytes`` for uploaded files. For uploads, ``file`` is a binary file
+    object positioned at the start of the contents, and ``filepath`` is the
+    path of a file holding the contents. Reading ``value`` loads an upload
+    into memory, so handlers for large uploads should use ``file`` or
+    ``filepath`` instead.
+    """
+    def __init__(self, name, value=None, filename=None, content_type=None,
+                 spool_size=None):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+
+        self._value = value
+        self._file = None
+        self._path = None
+        self._spool_size = spool_size
+
+        if value is not None:
+            self.size = len(value)
+        else:
+            self._file = BytesIO()
+
+    @property
+    def is_file(self):
+        return self.filename is not None
+
+    def write(self, data):
+        """Append data to the field, spooling to disk past ``spool_size``"""
+        self.size += len(data)
+        if self._path is None and self._spool_size is not None and \
+           self.size > self._spool_size:
+            self._spool()
+        self._file.write(data)
+
+    def finish(self):
+        """Called once all of the field's data has been written"""
+        if not self.is_file:
+            self._value = _to_str(self._file.getvalue())
+            self._file = None
+        else:
+            self._file.flush()
+            self._file.seek(0)
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._file.seek(0)
+            self._value = self._file.read()
+            self._file.seek(0)
+        return self._value
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = BytesIO(_to_bytes(self._value))
+        return self._file
+
+    @property
+    def filepath(self):
+        if self._path is None:
+            position = self.file.tell()
+            self._spool()
+            self._file.flush()
+            self._file.seek(position)
+        return self._path
+
+    def _spool(self):
+        """Move the contents to a temporary file"""
+        spooled = NamedTemporaryFile(prefix='pyqi-upload-', delete=False)
+        memory = self.file
+        memory.seek(0)
+        copyfileobj(memory, spooled)
+        self._file = spooled
+        self._path = spooled.name
+
+    def close(self):
+        """Release the field's file, deleting any temporary file"""
+        if self._file is not None:
+            self._file.close()
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+    def __repr__(self):
+        return 'FormField(%r, filename=%r, size=%d)' % (self.name,
+                                                        self.filename,
+                                                        self.size)
+
+class FormData(object):
+    """The fields of a submitted form, by name
+
+    ``form[name]`` is the first field with that name, and
+    ``form.getlist(name)`` is every field with that name. ``close`` deletes
+    the temporary files of any uploads; a ``FormData`` can also be used as a
+    context manager.
+    """
+    def __init__(self, fields=()):
+        self._fields = {}
+        self._names = []
+        for field in fields:
+            self.add(field)
+
+    def add(self, field):
+        if field.name not in self._fields:
+            self._fields[field.name] = []
+            self._names.append(field.name)
+        self._fields[field.name].append(field)
+
+    def getlist(self, name):
+        return list(self._fields.get(name, []))
+
+    def __getitem__(self, name):
+        return self._fields[name][0]
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def keys(self):
+        return list(self._names)
+
+    def close(self):
+        for fields in self._fields.values():
+            for field in fields:
+                field.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class FormParser(object):
+    """Parse a form submission from a request body
+
+    ``MaxRequestSize`` limits the whole body, ``MaxFieldSize`` each ordinary
+    (non-file) field and an urlencoded body, ``MaxFileSize`` each uploaded
+    file and ``MaxFields`` the number of fields. A limit of ``None`` means no
+    limit. Uploads larger than ``SpoolSize`` bytes are written to temporary
+    files.
+    """
+    SpoolSize = 1024 * 1024
+    MaxRequestSize = None
+    MaxFieldSize = 1024 * 1024
+    MaxFileSize = None
+    MaxFields = 1000
+
+    def __init__(self, **limits):
+        for name, value in limits.items():
+            if not hasattr(self, name):
+                raise TypeError("Unknown form limit: %s" % name)
+            setattr(self, name, value)
+
+    def parse(self, fp, content_type, content_length):
+        """Read and parse ``content_length`` bytes of form data from ``fp``
+
+        Raises a ``FormError`` if the body is malformed or too large.
+        """
+        if content_length is None:
+            raise LengthRequiredError("The request must have a "
+                                      "Content-Length.")
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            raise FormError("Invalid Content-Length: %r" % content_length)
+        if content_length < 0:
+            raise FormError("Invalid Content-Length: %r" % content_length)
+
+        if self.MaxRequestSize is not None and \
+           content_length > self.MaxRequestSize:
+            raise RequestTooLargeError("The request is larger than %d "
+                                       "bytes." % self.MaxRequestSize)
+
+        mime_type, params = parse_header(content_type or '')
+        if mime_type == 'multipart/form-data':
+            boundary = params.get('boundary')
+            if not boundary:
+                raise FormError("The multipart request has no boundary.")
+            return self._parse_multipart(_BodyReader(fp, content_length),
+                                         _to_bytes(boundary))
+        elif mime_type in ('application/x-www-form-urlencoded', ''):
+            return self._parse_urlencoded(fp, content_length)
+        else:
+            raise FormError("Unsupported Content-Type: %s" % mime_type)
+
+    def _parse_urlencoded(self, fp, content_length):
+        if self.MaxFieldSize is not None and \
+           content_length > self.MaxFieldSize:
+            raise RequestTooLargeError("The form is larger than %d bytes." %
+                                       self.MaxFieldSize)
+
+        body = _to_str(_read_exactly(fp, content_length))
+        pairs = parse_qsl(body, keep_blank_values=True)
+        if self.MaxFields is not None and len(pairs) > self.MaxFields:
+            raise RequestTooLargeError("The form has more than %d fields." %
+                                       self.MaxFields)
+
+        return FormData([FormField(name, value) for name, value in pairs])
+
+    def _parse_multipart(self, body, boundary):
+        # Prefixing the body with CRLF makes the first boundary look like
+        # every other delimiter.
+        delimiter = b'\r\n--' + boundary
+        buf = b'\r\n'
+        form = FormData()
+        field = None
+
+        try:
+            # Skip the preamble.
+            buf, found = _skip_to(body, buf, delimiter)
+            if not found:
+                raise FormError("The multipart request has no parts.")
+
+            while True:
+                buf = _fill(body, buf, 2)
+                if buf[:2] == b'--':
+                    # The closing delimiter; ignore the epilogue.
+                    break
+                if buf[:2] != b'\r\n':
+                    raise FormError("Malformed multipart boundary.")
+
+                headers, buf = self._read_part_headers(body, buf[2:])
+                field = self._new_field(headers)
+                if self.MaxFields is not None and \
+                   len(form) >= self.MaxFields and field.name not in form:
+                    raise RequestTooLargeError("The form has more than %d "
+                                               "fields." % self.MaxFields)
+                limit = self.MaxFileSize if field.is_file \
+                        else self.MaxFieldSize
+
+                buf = self._read_part_body(body, buf, delimiter, field,
+                                           limit)
+                field.finish()
+                form.add(field)
+                field = None
+        except:
+            if field is not None:
+                field.close()
+            form.close()
+            raise
+
+        return form
+
+    def _read_part_headers(self, body, buf):
+        while True:
+            end = buf.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(buf) > MAX_PART_HEADER_SIZE:
+                raise RequestTooLargeError("The headers of a part are too "
+                                           "large.")
+            data = body.read(READ_CHUNK_SIZE)
+            if not data:
+                raise FormError("The multipart request is truncated.")
+            buf += data
+
+        headers = {}
+        for line in buf[:end].split(b'\r\n'):
+            if not line:
+                continue
+            name, sep, value = _to_str(line).partition(':')
+            if not sep:
+                raise FormError("Malformed part header: %r" % line)
+            headers[name.strip().lower()] = value.strip()
+
+        return headers, buf[end + 4:]
+
+    def _new_field(self, headers):
+        disposition, params = parse_header(headers.get('content-disposition',
+                                                       ''))
+        if disposition != 'form-data' or 'name' not in params:
+            raise FormError("A part has no form-data name.")
+
+        return FormField(params['name'], filename=params.get('filename'),
+                         content_type=headers.get('content-type'),
+                         spool_size=self.SpoolSize)
+
+    def _read_part_body(self, body, buf, delimiter, field, limit):
+        """Write the part to ``field``, returning what follows the delimiter
+
+        Data is written as soon as it can't be the start of the delimiter,
+        so at most one chunk plus the delimiter is held in memory.
+        """
+        keep = len(delimiter) - 1
+        while True:
+            index = buf.find(delimiter)
+            if index >= 0:
+                self._write_part(field, buf[:index], limit)
+                return buf[index + len(delimiter):]
+
+            if len(buf) > keep:
+                self._write_part(field, buf[:-keep], limit)
+                buf = buf[-keep:]
+
+            data = body.read(READ_CHUNK_SIZE)
+            if not data:
+                raise FormError("The multipart request is truncated.")
+            buf += data
+
+    def _write_part(self, field, data, limit):
+        if limit is not None and field.size + len(data) > limit:
+            raise RequestTooLargeError("The field '%s' is larger than %d "
+                                       "bytes." % (field.name, limit))
+        if data:
+            field.write(data)
+
+class _BodyReader(object):
+    """Read no more than ``length`` bytes from ``fp``"""
+    def __init__(self, fp, length):
+        self._fp = fp
+        self._remaining = length
+
+    def read(self, size):
+        size = min(size, self._remaining)
+        if size <= 0:
+            return b''
+        data = self._fp.read(size)
+        self._remaining -= len(data)
+        return data
+
+def _read_exactly(fp, length):
+    reader = _BodyReader(fp, length)
+    chunks = []
+    while True:
+        data = reader.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        chunks.append(data)
+    return b''.join(chunks)
+
+def _fill(body, buf, size):
+    """Read until ``buf`` holds at least ``size`` bytes"""
+    while len(buf) < size:
+        data = body.read(READ_CHUNK_SIZE)
+        if not data:
+            raise FormError("The multipart request is truncated.")
+        buf += data
+    return buf
+
+def _skip_to(body, buf, delimiter):
+    """Discard data up to and including ``delimiter``"""
+    keep = len(delimiter) - 1
+    while True:
+        index = buf.find(delimiter)
+        if index >= 0:
+            return buf[index + len(delimiter):], True
+        buf = buf[-keep:]
+        data = body.read(READ_CHUNK_SIZE)
+        if not data:
+            return b'', False
+        buf += data
+
+_header_param = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+def parse_header(value):
+    """Split a header like Content-Type into its value and parameters
+
+    ``parse_header('form-data; name="a"')`` returns
+    ``('form-data', {'name': 'a'})``.
+    """
+    main, _, rest = value.partition(';')
+    params = {}
+    for match in _header_param.finditer(';' + rest):
+        name, param = match.groups()
+        param = param.strip()
+        if len(param) >= 2 and param[0] == param[-1] == '"':
+            param = re.sub(r'\\(.)', r'\1', param[1:-1])
+        params[name.lower()] = param
+    return main.strip().lower(), params
+
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode('utf-8')
+
+def _to_str(data):
+    """Return a native string, decoding UTF-8 under Python 3"""
+    if is_py2() or isinstance(data, str):
+        return data
+    return data.decode('utf-8', 'replace')
@@ -18,3 +18,35 @@ def newline_list_of_strings(result_key, data, option_value=None):
 def html_list_of_strings(result_key, data, option_value=None):
     """Return a string from a list of strings while appending an html break"""
     return "<br/>".join(data)
+
+def iter_newline_list_of_strings(result_key, data, option_value=None):
+    """Return an iterator over a list of strings joined by newlines
+
+    Like ``newline_list_of_strings``, but the result is streamed to the
+    client as it is produced instead of being joined in memory first.
+    """
+    return _iter_joined("\n", data)
+
+def iter_html_list_of_strings(result_key, data, option_value=None):
+    """Return an iterator over a list of strings joined by html breaks
+
+    Like ``html_list_of_strings``, but the result is streamed to the client
+    as it is produced instead of being joined in memory first.
+    """
+    return _iter_joined("<br/>", data)
+
+def open_binary_file(result_key, data, option_value=None):
+    """Return the file at the path ``data``, opened for sending
+
+    The file is sent without being read into memory, and is closed once it
+    has been sent.
+    """
+    return open(data, 'rb')
+
+def _iter_joined(separator, data):
+    first = True
+    for item in data:
+        if not first:
+            yield separator
+        first = False
+        yield item
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Response bodies for the HTMLInterface
+
+The contents of an ``HTMLPage`` or ``HTMLDownload`` can be:
+    - a string (or bytes), sent with a Content-Length
+    - a file object, sent with a Content-Length if it is a regular file
+      (using ``sendfile`` where the platform has it)
+    - any other iterable of strings, sent as it is produced, with chunked
+      transfer encoding
+
+Text bodies (other than files) are gzipped for clients that accept it.
+``StaticBody`` holds a body that never changes, such as the stylesheet, so
+it is rendered and compressed once.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import os
+import zlib
+from hashlib import md5
+from stat import S_ISREG
+from tempfile import NamedTemporaryFile
+
+from pyqi.util import is_py2
+
+# Streamed bodies are sent in pieces of at least this many bytes (except for
+# the last), so that producing many small strings doesn't mean as many
+# small writes.
+SEND_BUFFER_SIZE = 64 * 1024
+
+# Bodies smaller than this aren't worth compressing.
+MIN_GZIP_SIZE = 512
+
+GZIP_LEVEL = 6
+
+# Content types worth compressing, besides text/*.
+_compressible_types = set(['application/json', 'application/javascript',
+                           'application/xml', 'image/svg+xml'])
+
+if is_py2():
+    _text_types = (str, unicode)
+else:
+    _text_types = (str, bytes)
+
+def to_bytes(data):
+    """Encode text as UTF-8 for writing to a socket"""
+    if isinstance(data, bytes):
+        return data
+    return data.encode('utf-8')
+
+def is_text(contents):
+    return isinstance(contents, _text_types)
+
+def is_file(contents):
+    return hasattr(contents, 'read')
+
+def file_length(f):
+    """Return the number of bytes left to read in ``f``
+
+    Returns ``None`` unless ``f`` is a regular file opened in binary mode,
+    since only then does the length in bytes match what ``read`` returns.
+    """
+    if 'b' not in getattr(f, 'mode', 'b'):
+        return None
+    try:
+        info = os.fstat(f.fileno())
+    except (AttributeError, ValueError, OSError, IOError):
+        # No file descriptor (e.g., an io.BytesIO).
+        return None
+    if not S_ISREG(info.st_mode):
+        return None
+    return max(info.st_size - f.tell(), 0)
+
+def iter_body(contents, buffer_size=SEND_BUFFER_SIZE):
+    """Return an iterator over ``contents`` as bytes
+
+    Small strings are combined, so each piece (except the last) is at least
+    ``buffer_size`` bytes.
+    """
+    if is_text(contents):
+        return iter([to_bytes(contents)])
+    if is_file(contents):
+        return _iter_file(contents, buffer_size)
+    return _coalesce(contents, buffer_size)
+
+def _iter_file(f, buffer_size):
+    while True:
+        data = f.read(buffer_size)
+        if not data:
+            break
+        yield to_bytes(data)
+
+def _coalesce(pieces, buffer_size):
+    buffered = []
+    size = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        piece = to_bytes(piece)
+        buffered.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            yield b''.join(buffered)
+            buffered = []
+            size = 0
+    if buffered:
+        yield b''.join(buffered)
+
+def chunk_encode(pieces):
+    """Return an iterator over ``pieces`` in chunked transfer encoding"""
+    for piece in pieces:
+        if piece:
+            yield b''.join([('%x\r\n' % len(piece)).encode('ascii'), piece,
+                            b'\r\n'])
+    yield b'0\r\n\r\n'
+
+def close_body(contents):
+    """Close a file (or generator) body once it has been sent"""
+    close = getattr(contents, 'close', None)
+    if close is not None and not is_text(contents):
+        close()
+
+def accepts_gzip(accept_encoding):
+    """Return whether an Accept-Encoding header value allows gzip"""
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def is_compressible(content_type):
+    mime_type = content_type.split(';')[0].strip().lower()
+    return mime_type.startswith('text/') or mime_type in _compressible_types
+
+def _gzip_compressor():
+    # A wbits of 16 + MAX_WBITS produces the gzip format.
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def gzip_bytes(data):
+    compressor = _gzip_compressor()
+    return compressor.compress(data) + compressor.flush()
+
+def gzip_pieces(pieces):
+    """Return an iterator over the gzipped concatenation of ``pieces``"""
+    compressor = _gzip_compressor()
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+class StaticBody(object):
+    """A response body that doesn't change
+
+    The body is encoded (and, if worthwhile, gzipped) once, and has an
+    ``etag`` so clients can revalidate cached copies cheaply.
+    """
+    def __init__(self, contents, content_type='text/html',
+                 cache_control='no-cache'):
+        self.body = to_bytes(contents)
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"%s"' % md5(self.body).hexdigest()
+
+        if is_compressible(content_type) and len(self.body) >= MIN_GZIP_SIZE:
+            self.gzipped = gzip_bytes(self.body)
+        else:
+            self.gzipped = None
+
+    def matches(self, if_none_match):
+        """Return whether an If-None-Match header value matches the body"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags or \
+               ('W/' + self.etag) in tags
+
+class SpooledBody(object):
+    """A response body saved to a temporary file
+
+    Unlike a stream, a ``SpooledBody`` can be sent any number of times;
+    ``open`` returns a new file object for each. ``remove`` deletes the
+    file.
+    """
+    def __init__(self, contents):
+        f = NamedTemporaryFile(prefix='pyqi-result-', delete=False)
+        try:
+            for piece in iter_body(contents):
+                f.write(piece)
+        finally:
+            f.close()
+            close_body(contents)
+        self.path = f.name
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""HTTP servers for the HTMLInterface
+
+``HTTPServer`` (from the standard library) handles one request at a time.
+``PooledHTTPServer`` handles requests on a fixed pool of threads, and
+``PreforkServer`` runs a server in each of several forked processes, which
+all accept connections on the same listening socket.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from errno import ECHILD, EINTR
+from select import error as select_error, select
+from threading import Lock, Thread
+from timeit import default_timer
+
+from pyqi.util import is_py2
+if is_py2():
+    from BaseHTTPServer import HTTPServer
+    from Queue import Queue
+else:
+    from http.server import HTTPServer
+    from queue import Queue
+
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.resource import release_all
+
+class WorkerStartupError(Exception):
+    """Raised when the workers of a ``PreforkServer`` keep failing to start"""
+    pass
+
+class PyqiHTTPServer(HTTPServer):
+    """An ``HTTPServer`` with a configurable listen backlog
+
+    It handles one connection at a time, so connections aren't kept alive:
+    an idle one would keep every other client waiting.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, server_address, RequestHandlerClass, backlog=128):
+        # Read by server_activate when it calls listen().
+        self.request_queue_size = backlog
+
+        # Old-style class in Python 2, so super() can't be used.
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+
+class PooledHTTPServer(PyqiHTTPServer):
+    """Handle requests on a fixed pool of ``workers`` threads
+
+    Accepted connections wait in a queue of at most ``workers`` entries
+    while all threads are busy. Once the queue is full, the server stops
+    accepting, and new connections wait in the listen backlog.
+    ``server_close`` lets the threads finish all accepted requests.
+
+    A connection holds its thread while it is kept alive, so responses only
+    keep their connection alive while no other connection waits for a
+    thread. A kept-alive connection is closed once it has been idle for
+    ``KeepAliveTimeout`` seconds, or for ``BusyKeepAliveTimeout`` seconds
+    while another connection waits for its thread. A request the client has
+    already sent is always served.
+
+    The threads are started by ``serve_forever``, so a ``PooledHTTPServer``
+    can be handed to a ``PreforkServer``.
+    """
+    # Seconds a kept-alive connection may wait for its next request.
+    KeepAliveTimeout = 5.0
+    # The same, while another connection waits for a thread.
+    BusyKeepAliveTimeout = 0.5
+    # Seconds between two checks for waiting connections.
+    IdlePollInterval = 0.05
+
+    def __init__(self, server_address, RequestHandlerClass, workers=8,
+                 backlog=128):
+        if workers < 1:
+            raise IncompetentDeveloperError("A PooledHTTPServer needs at "
+                                            "least one worker.")
+
+        PyqiHTTPServer.__init__(self, server_address,
+                                self._make_handler(RequestHandlerClass),
+                                backlog)
+
+        self.workers = workers
+        self._requests = Queue(maxsize=workers)
+        self._workers = []
+        # Connections held by a thread.
+        self._held = 0
+        self._lock = Lock()
+
+    def _make_handler(self, handler):
+        server = self
+
+        class PooledRequestHandler(handler):
+            def handle_one_request(self):
+                # Set by the first request, so any later one is awaited on
+                # a kept-alive connection.
+                if hasattr(self, 'raw_requestline') and \
+                   not server._await_request(self.connection, self.rfile):
+                    self.close_connection = True
+                    return
+
+                handler.handle_one_request(self)
+
+        return PooledRequestHandler
+
+    def keep_alive(self):
+        """Return whether a connection can keep its thread"""
+        return self._requests.qsize() == 0
+
+    def _waiting(self):
+        """Return the number of connections waiting for a thread"""
+        with self._lock:
+            return self._held + self._requests.qsize() - self.workers
+
+    def _await_request(self, connection, rfile):
+        """Wait for the client to send its next request
+
+        Returns False if the connection should be closed instead. It is only
+        closed while the client hasn't sent anything, as it can't know that
+        a request it sent was dropped.
+        """
+        if _has_data(connection, rfile):
+            return True
+
+        started = default_timer()
+        idle = 0.0
+        while True:
+            if self._waiting() > 0:
+                timeout = self.BusyKeepAliveTimeout - idle
+            else:
+                timeout = self.KeepAliveTimeout - idle
+            if timeout <= 0:
+                return False
+
+            try:
+                readable = select([connection], [], [],
+                                  min(timeout, self.IdlePollInterval))[0]
+            except (select_error, OSError) as e:
+                if e.args[0] != EINTR:
+                    # Let the handler read, and fail on, the connection.
+                    return True
+                readable = []
+
+            if readable:
+                return True
+            idle = default_timer() - started
+
+    def serve_forever(self, poll_interval=0.5):
+        if not self._workers:
+            for i in range(self.workers):
+                worker = Thread(target=self._process_requests,
+                                name='pyqi-http-worker-%d' % i)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+        PyqiHTTPServer.serve_forever(self, poll_interval)
+
+    def process_request(self, request, client_address):
+        """Hand the request to the pool, waiting if the queue is full"""
+        self._requests.put((request, client_address))
+
+    def queue_depth(self):
+        """Return the number of accepted connections waiting for a worker"""
+        return self._requests.qsize()
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+
+            request, client_address = item
+            with self._lock:
+                self._held += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._lock:
+                    self._held -= 1
+                self.shutdown_request(request)
+
+    def server_close(self):
+        PyqiHTTPServer.server_close(self)
+
+        for worker in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+class PreforkServer(object):
+    """Serve with ``server`` in ``workers`` forked processes
+
+    ``server`` must be bound and listening. Each worker process runs
+    ``server.serve_forever`` on its own copy of the listening socket, and the
+    kernel hands every new connection to one of the workers. Each worker
+    handles its requests with the same concurrency as ``server`` itself.
+
+    ``serve_forever`` (in the parent) waits for the workers and replaces any
+    worker that exits while the server is running. Sending SIGTERM or SIGINT
+    to the parent shuts all workers down gracefully.
+
+    Workers share the parent's memory until they write to it, so anything
+    loaded before ``serve_forever`` (e.g., command resources) is loaded
+    once for all of them. The parent doesn't collect garbage from the time
+    the ``PreforkServer`` is created (callers can call ``gc.disable``
+    earlier still, before loading what the workers share): a collection
+    would leave freed slots all over the heap, and the workers would copy
+    the pages they reuse them in. The parent's objects are frozen out of
+    the garbage collector before each fork (on Python 3.7 or later), so
+    that collections in the workers don't write to, and so copy, the pages
+    holding them. The workers collect garbage as usual.
+
+    A worker that fails (exits with an error) within ``StartupTime``
+    seconds is replaced after ``RespawnDelay`` seconds, doubled for each
+    further failure in a row. After ``MaxStartupFailures`` failures in a
+    row, the server shuts down and ``serve_forever`` raises a
+    ``WorkerStartupError``.
+
+    A worker is replaced after it handles about ``max_requests`` requests
+    (each worker retires after up to 10% more, so they don't all retire at
+    once), or once its own memory (see ``worker_memory``) has grown by more
+    than ``max_memory`` bytes. A retiring worker finishes the requests it
+    accepted, then exits.
+    """
+    # Seconds between two checks of a worker's memory.
+    MemoryCheckInterval = 1.0
+    # Seconds within which a worker that fails is taken to have failed to
+    # start.
+    StartupTime = 1.0
+    # Seconds to wait before replacing a worker that failed to start.
+    RespawnDelay = 0.5
+    MaxStartupFailures = 5
+
+    def __init__(self, server, workers=4, max_requests=None,
+                 max_memory=None):
+        if not hasattr(os, 'fork'):
+            raise IncompetentDeveloperError("Pre-forking requires os.fork, "
+                                            "which is not available on this "
+                                            "platform.")
+        if workers < 1:
+            raise IncompetentDeveloperError("A PreforkServer needs at least "
+                                            "one worker.")
+        if max_requests is not None and max_requests < 1:
+            raise IncompetentDeveloperError("max_requests must be at least "
+                                            "1.")
+        if max_memory is not None and max_memory <= 0:
+            raise IncompetentDeveloperError("max_memory must be positive.")
+
+        self.server = server
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        # Maps the pid of each worker to the time it was forked.
+        self._children = {}
+        self._stopping = False
+        self._failures = 0
+
+        self._gc_enabled = gc.isenabled()
+        gc.disable()
+
+        # Workers accept without blocking, so that a worker that lost the
+        # race for a connection goes back to polling (and can notice a
+        # shutdown request) instead of blocking in accept().
+        self.server.socket.setblocking(False)
+        self.server.get_request = self._make_get_request(self.server)
+
+    def _make_get_request(self, server):
+        get_request = server.get_request
+
+        def blocking_get_request():
+            request, client_address = get_request()
+            # Accepted sockets may inherit the non-blocking flag.
+            request.setblocking(True)
+            return request, client_address
+
+        return blocking_get_request
+
+    def serve_forever(self):
+        """Fork the workers and supervise them until shutdown"""
+        previous_handlers = install_shutdown_handlers(self.shutdown)
+
+        try:
+            while not self._stopping:
+                while len(self._children) < self.workers and \
+                      not self._stopping:
+                    if self._failures:
+                        time.sleep(self.RespawnDelay *
+                                   2 ** (self._failures - 1))
+                    if not self._stopping:
+                        self._spawn_worker()
+
+                self._reap_worker()
+        finally:
+            restore_handlers(previous_handlers)
+
+            for pid in list(self._children):
+                _kill(pid, signal.SIGTERM)
+            while self._children:
+                self._reap_worker()
+
+            self.server.server_close()
+            if self._gc_enabled:
+                if hasattr(gc, 'unfreeze'):
+                    gc.unfreeze()
+                gc.enable()
+
+        if self._failures >= self.MaxStartupFailures:
+            raise WorkerStartupError("%d workers in a row failed to start."
+                                     % self._failures)
+
+    def shutdown(self):
+        """Stop the workers and return from ``serve_forever``"""
+        self._stopping = True
+        for pid in list(self._children):
+            _kill(pid, signal.SIGTERM)
+
+    def _spawn_worker(self):
+        # Not collected first: the parent doesn't collect garbage at all.
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        pid = os.fork()
+        if pid:
+            self._children[pid] = default_timer()
+            return pid
+
+        # In the worker: serve until SIGTERM, then exit without running any
+        # of the parent's cleanup code.
+        self._children = {}
+        gc.enable()
+        exit_code = 0
+        try:
+            self._run_worker()
+        except:
+            exit_code = 1
+            sys.excepthook(*sys.exc_info())
+        finally:
+            os._exit(exit_code)
+
+    def _run_worker(self):
+        install_shutdown_handlers(lambda: shutdown_in_thread(self.server))
+        if self.max_requests is not None or self.max_memory is not None:
+            self._retire_when_spent()
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            # Only what the worker loaded itself; the parent owns the rest.
+            release_all()
+
+    def _retire_when_spent(self):
+        """Shut the worker down after its last request
+
+        The worker counts the requests its handlers finish; the request
+        that retires it closes its connection, so the client reconnects to
+        another worker.
+        """
+        server = self.server
+        max_memory = self.max_memory
+        check_interval = self.MemoryCheckInterval
+        max_requests = self.max_requests
+        if max_requests is not None:
+            max_requests += random.randint(0, max_requests // 10)
+
+        baseline = worker_memory() if max_memory is not None else None
+        state = {'handled': 0, 'checked': default_timer(), 'retiring': False}
+        lock = Lock()
+
+        def request_done():
+            """Count a request, returning True if the worker retires"""
+            with lock:
+                if state['retiring']:
+                    return True
+                state['handled'] += 1
+
+                spent = max_requests is not None and \
+                        state['handled'] >= max_requests
+                now = default_timer()
+                if not spent and baseline is not None and \
+                   now - state['checked'] >= check_interval:
+                    state['checked'] = now
+                    spent = worker_memory() - baseline > max_memory
+
+                if spent:
+                    state['retiring'] = True
+                    shutdown_in_thread(server)
+                return spent
+
+        handler = server.RequestHandlerClass
+        class RetiringHandler(handler):
+            def handle_one_request(self):
+                handler.handle_one_request(self)
+                # Nothing was read if the client closed the connection.
+                if self.raw_requestline and request_done():
+                    self.close_connection = True
+        server.RequestHandlerClass = RetiringHandler
+
+    def _reap_worker(self):
+        """Wait for a worker to exit, and forget about it
+
+        Counts the failures of workers that exit with an error right after
+        they were forked, shutting down after ``MaxStartupFailures`` of them
+        in a row.
+        """
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except OSError as e:
+            if e.errno == EINTR:
+                return None
+            elif e.errno == ECHILD:
+                self._children.clear()
+                return None
+            raise
+
+        started = self._children.pop(pid, None)
+        if started is not None and not self._stopping:
+            if status and default_timer() - started < self.StartupTime:
+                self._failures += 1
+                if self._failures >= self.MaxStartupFailures:
+                    self.shutdown()
+            else:
+                self._failures = 0
+        return pid
+
+class RouteTimings(object):
+    """Count requests and their durations (in seconds) per route
+
+    Safe to share between threads. Each process of a ``PreforkServer``
+    keeps its own timings.
+    """
+    def __init__(self):
+        self._timings = {}
+        self._lock = Lock()
+
+    def record(self, route, seconds):
+        with self._lock:
+            count, total, longest = self._timings.get(route, (0, 0.0, 0.0))
+            self._timings[route] = (count + 1, total + seconds,
+                                    max(longest, seconds))
+
+    def snapshot(self):
+        """Return {route: (count, total seconds, longest seconds)}"""
+        with self._lock:
+            return dict(self._timings)
+
+    def report(self):
+        """Return the timings as a plain text table"""
+        lines = ['%-40s %8s %12s %12s' % ('route', 'count', 'mean (ms)',
+                                          'max (ms)')]
+        for route, (count, total, longest) in sorted(self.snapshot().items()):
+            lines.append('%-40s %8d %12.3f %12.3f' % (route, count,
+                                                      1000 * total / count,
+                                                      1000 * longest))
+        return '\n'.join(lines) + '\n'
+
+def worker_memory():
+    """Return the memory used by this process alone, in bytes
+
+    On Linux, this is the private memory of the process: the pages it
+    doesn't share with others, such as the pages of a forked parent that
+    it hasn't written to. Elsewhere, it is the peak resident set size.
+    Returns None if it can't be measured.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            return 1024 * sum(int(line.split()[1]) for line in f
+                              if line.startswith(('Private_Clean:',
+                                                  'Private_Dirty:')))
+    except (IOError, OSError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+def _has_data(connection, rfile):
+    """Return whether the client has sent data that hasn't been read yet
+
+    Looks at what ``rfile`` has buffered, and at the socket itself, without
+    blocking.
+    """
+    # socket._fileobject (Python 2) keeps its buffer in a StringIO.
+    buffered = getattr(rfile, '_rbuf', None)
+    if buffered is not None and buffered.tell():
+        return True
+
+    timeout = connection.gettimeout()
+    connection.setblocking(False)
+    try:
+        if hasattr(rfile, 'peek'):
+            # io.BufferedReader (Python 3) returns its buffer, or what the
+            # socket has, or nothing.
+            return bool(rfile.peek(1))
+        return bool(connection.recv(1, socket.MSG_PEEK))
+    except socket.error:
+        # Nothing to read yet; a failed connection is found by select.
+        return False
+    finally:
+        connection.settimeout(timeout)
+
+def _kill(pid, sig):
+    try:
+        os.kill(pid, sig)
+    except OSError:
+        # Already gone.
+        pass
+
+def shutdown_in_thread(server):
+    """Call ``server.shutdown`` from a new thread
+
+    ``shutdown`` blocks until ``serve_forever`` returns, so it can't be
+    called from the thread running ``serve_forever`` (e.g., from a signal
+    handler).
+    """
+    thread = Thread(target=server.shutdown, name='pyqi-http-shutdown')
+    thread.daemon = True
+    thread.start()
+
+def install_shutdown_handlers(shutdown):
+    """Call ``shutdown()`` on SIGTERM and SIGINT
+
+    Returns the previous handlers, to be passed to ``restore_handlers``.
+    Signal handlers can only be installed from the main thread; nothing is
+    installed when called from any other thread.
+    """
+    def handler(signum, frame):
+        shutdown()
+
+    previous_handlers = {}
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            previous_handlers[signum] = signal.signal(signum, handler)
+        except ValueError:
+            # Not in the main thread.
+            break
+
+    return previous_handlers
+
+def restore_handlers(previous_handlers):
+    for signum, handler in previous_handlers.items():
+        signal.signal(signum, handler)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Helpers for serving the HTMLInterface as a WSGI application
+
+See ``pyqi.core.interfaces.html.make_wsgi_app``.
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+from pyqi.core.interfaces.html.response import close_body
+from pyqi.util import is_py2
+if is_py2():
+    from BaseHTTPServer import BaseHTTPRequestHandler
+else:
+    from http.server import BaseHTTPRequestHandler
+
+class EnvironHeaders(object):
+    """The request headers in a WSGI environ
+
+    Looks up headers by name, like the ``headers`` of a
+    ``BaseHTTPRequestHandler``.
+    """
+    def __init__(self, environ):
+        self._environ = environ
+
+    def get(self, name, default=None):
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+
+        value = self._environ.get(key)
+        if value is None or value == '':
+            return default
+        return value
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+class ClosingIterator(object):
+    """Iterate over ``body``, and close it and ``sources`` when closed
+
+    WSGI servers call ``close`` on the iterable once the response is sent
+    (or abandoned).
+    """
+    def __init__(self, body, sources=()):
+        self._body = body
+        self._sources = [source for source in sources if source is not None]
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        close_body(self._body)
+        for source in self._sources:
+            close_body(source)
+
+def status_line(status):
+    """Return the WSGI status string for an HTTP status code"""
+    reason = BaseHTTPRequestHandler.responses.get(status, ('Unknown',))[0]
+    return '%d %s' % (status, reason)
+
+def error_page(status, message=None):
+    """Return a minimal html page describing an error"""
+    short, long_ = BaseHTTPRequestHandler.responses.get(status,
+                                                        ('Error', ''))
+    return ('<html><head><title>Error response</title></head><body>'
+            '<h1>%d %s</h1><p>%s</p></body></html>'
+            % (status, _escape(short), _escape(message or long_)))
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>',
+                                                                   '&gt;')
@@ -14,15 +14,22 @@ __credits__ = ["Greg Caporaso", "Daniel McDonald", "Gavin Huttley",
 
 import os
 from copy import copy
-from glob import glob
 from os.path import abspath, exists, isdir, isfile, split
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from optparse import (Option, OptionParser, OptionGroup, OptionValueError,
-                      OptionError)
+                      OptionError, BadOptionError)
 from pyqi.core.interface import (Interface, InterfaceInputOption, 
-                                 InterfaceOutputOption, InterfaceUsageExample)
+                                 InterfaceOutputOption, InterfaceUsageExample,
+                                 RequestContext)
 from pyqi.core.factory import general_factory
 from pyqi.core.exception import IncompetentDeveloperError
 from pyqi.core.command import Parameter
+from pyqi.util import (STDIO_PATH, PathStatCache, glob_paths,
+                       iter_response_file)
+
+# Guards construction of the per-class cached parsers.
+_parser_cache_lock = Lock()
 
 class OptparseResult(InterfaceOutputOption):
     def __init__(self, **kwargs):
@@ -32,9 +39,13 @@ class OptparseResult(InterfaceOutputOption):
         pass
 
 class OptparseOption(InterfaceInputOption):
-    """An augmented option that expands a ``CommandIn`` into an Option"""
+    """An augmented option that expands a ``CommandIn`` into an Option
 
-    def __init__(self, **kwargs):
+    ``Choices`` lists the accepted values of a ``'choice'`` option.
+    """
+
+    def __init__(self, Choices=None, **kwargs):
+        self.Choices = Choices
         super(OptparseOption, self).__init__(**kwargs)
 
     def _validate_option(self):
@@ -49,6 +60,10 @@ class OptparseOption(InterfaceInputOption):
             return '-%s/--%s' % (self.ShortName, self.Name)
 
     def getOptparseOption(self):
+        choices = {}
+        if self.Choices is not None:
+            choices['choices'] = list(self.Choices)
+
         if self.Required:
             # If the option doesn't already end with [REQUIRED], add it.
             help_text = self.Help
@@ -58,11 +73,13 @@ class OptparseOption(InterfaceInputOption):
 
             if self.ShortName is None:
                 option = PyqiOption('--' + self.Name, type=self.Type,
-                                    action=self.Action, help=help_text)
+                                    action=self.Action, help=help_text,
+                                    **choices)
             else:
                 option = PyqiOption('-' + self.ShortName,
                                     '--' + self.Name, type=self.Type,
-                                    action=self.Action, help=help_text)
+                                    action=self.Action, help=help_text,
+                                    **choices)
         else:
             if self.DefaultDescription is None:
                 help_text = '%s [default: %%default]' % self.Help
@@ -73,12 +90,12 @@ class OptparseOption(InterfaceInputOption):
             if self.ShortName is None:
                 option = PyqiOption('--' + self.Name, type=self.Type,
                                     action=self.Action, help=help_text,
-                                    default=self.Default)
+                                    default=self.Default, **choices)
             else:
                 option = PyqiOption('-' + self.ShortName,
                                     '--' + self.Name, type=self.Type,
                                     action=self.Action, help=help_text,
-                                    default=self.Default)
+                                    default=self.Default, **choices)
         return option
 
 class OptparseUsageExample(InterfaceUsageExample):
@@ -97,6 +114,16 @@ class OptparseInterface(Interface):
     HelpOnNoArguments = True 
     OptionalInputLine = '[] indicates optional input (order unimportant)'
     RequiredInputLine = '{} indicates required input (order unimportant)'
+
+    # Arguments starting with this prefix name a response file, whose lines
+    # (or NUL-delimited records) are used as arguments in their place. Set to
+    # None to disable.
+    ResponseFilePrefix = '@'
+
+    # Number of threads used to run the output handlers. Setting this above 1
+    # lets handlers that do I/O (e.g., each writing to its own file) overlap,
+    # so only do so if the handlers are independent of each other.
+    OutputHandlerThreads = 1
     
     def __init__(self, **kwargs):
         super(OptparseInterface, self).__init__(**kwargs)
@@ -120,44 +147,26 @@ class OptparseInterface(Interface):
             raise IncompetentDeveloperError("Unsupported result '%r'. Result "
                                             "must be a dict." % out_)
 
-    def _input_handler(self, in_, *args, **kwargs):
+    def _input_handler(self, in_, context=None, *args, **kwargs):
         """Parses command-line input."""
-        required_opts = [opt for opt in self._get_inputs() if opt.Required]
-        optional_opts = [opt for opt in self._get_inputs() if not opt.Required]
-
-        # Build the usage and version strings
-        usage = self._build_usage_lines(required_opts)
-        version = 'Version: %prog ' + self._get_version()
+        if context is None:
+            context = RequestContext()
 
-        # Instantiate the command line parser object
-        parser = OptionParser(usage=usage, version=version)
+        cached_parser = self._get_cached_parser()
+        parser = cached_parser.Parser
 
         # If the command has required options and no input arguments were
         # provided, print the help string.
-        if len(required_opts) > 0 and self.HelpOnNoArguments and len(in_) == 0:
+        if (cached_parser.RequiredOptionIds and self.HelpOnNoArguments and
+            len(in_) == 0):
             parser.print_usage()
             return parser.exit(-1)
 
-        if required_opts:
-            # Define an option group so all required options are grouped
-            # together and under a common header.
-            required = OptionGroup(parser, "REQUIRED options",
-                                   "The following options must be provided "
-                                   "under all circumstances.")
-            for ro in required_opts:
-                required.add_option(ro.getOptparseOption())
-            parser.add_option_group(required)
-
-        # Add the optional options.
-        for oo in optional_opts:
-            parser.add_option(oo.getOptparseOption())
-
-        #####
-        # THIS IS THE NATURAL BREAKING POINT FOR THIS FUNCTIONALITY
-        #####
+        if self.ResponseFilePrefix is not None:
+            in_ = self._expand_response_files(in_, parser)
 
         # Parse our input.
-        opts, args = parser.parse_args(in_)
+        opts, args = cached_parser.parse_args(in_)
 
         # If positional arguments are not allowed, and any were provided, raise
         # an error.
@@ -167,36 +176,123 @@ class OptparseInterface(Interface):
              " (e.g.: include the '-i' in '-i INPUT_DIR')")
 
         # Test that all required options were provided.
-        if required_opts:
-            # dest may be different from the original option name because
-            # optparse converts names from dashed to underscored.
-            required_option_ids = [(o.dest, o.get_opt_string())
-                                   for o in required.option_list]
-            for required_dest, required_name in required_option_ids:
-                if getattr(opts, required_dest) is None:
-                    parser.error('Required option %s omitted.' % required_name)
+        for required_dest, required_name in cached_parser.RequiredOptionIds:
+            if getattr(opts, required_dest) is None:
+                parser.error('Required option %s omitted.' % required_name)
 
         # Build up command input dictionary. This will be passed to
         # Command.__call__ as kwargs.
-        self._optparse_input = opts.__dict__
+        optparse_input = opts.__dict__
+        context.InterfaceInput = optparse_input
 
         cmd_input_kwargs = {}
-        for option in self._get_inputs():
-            if option.Parameter is not None:
-                param_name = option.getParameterName()
-                optparse_clean_name = \
-                        self._get_optparse_clean_name(option.Name)
+        for option, optparse_clean_name in cached_parser.InputCleanNames:
+            param_name = option.getParameterName()
 
-                if option.Handler is None:
-                    value = self._optparse_input[optparse_clean_name]
-                else:
-                    value = option.Handler(
-                            self._optparse_input[optparse_clean_name])
+            if option.Handler is None:
+                value = optparse_input[optparse_clean_name]
+            else:
+                value = option.Handler(optparse_input[optparse_clean_name])
 
-                cmd_input_kwargs[param_name] = value
+            cmd_input_kwargs[param_name] = value
 
         return cmd_input_kwargs
 
+    def _expand_response_files(self, in_, parser):
+        """Replace response file arguments by the arguments they contain.
+
+        An argument that is the value of the preceding option (e.g., the
+        ``@paths.txt`` in ``--input-fps @paths.txt``) is left alone, so that
+        the option's type checker can read the response file as a list value.
+        """
+        prefix = self.ResponseFilePrefix
+        expanded = []
+        takes_value = False
+
+        for arg in in_:
+            if (not takes_value and arg.startswith(prefix) and
+                len(arg) > len(prefix)):
+                response_fp = arg[len(prefix):]
+                try:
+                    expanded.extend(iter_response_file(response_fp))
+                except (IOError, OSError) as e:
+                    parser.error("Unable to read response file %r: %s" %
+                                 (response_fp, e))
+            else:
+                expanded.append(arg)
+
+            takes_value = (len(expanded) > 0 and
+                           _option_takes_value(parser, expanded[-1]))
+
+        return expanded
+
+    def _get_cached_parser(self):
+        """Return the ``CachedOptionParser`` shared by this interface class.
+
+        The parser only depends on the class-level configuration (inputs,
+        usage examples and version), so it is built the first time an
+        instance of a given class parses input and is reused afterwards.
+        """
+        cls = self.__class__
+
+        # Look in the class __dict__ so that a subclass never picks up the
+        # parser cached for its base class.
+        cached_parser = cls.__dict__.get('_cached_parser')
+        if cached_parser is None:
+            with _parser_cache_lock:
+                cached_parser = cls.__dict__.get('_cached_parser')
+                if cached_parser is None:
+                    cached_parser = self._build_parser()
+                    cls._cached_parser = cached_parser
+
+        return cached_parser
+
+    def _build_parser(self):
+        """Construct the ``CachedOptionParser`` for this interface."""
+        required_opts = [opt for opt in self._get_inputs() if opt.Required]
+        optional_opts = [opt for opt in self._get_inputs() if not opt.Required]
+
+        # Build the usage and version strings
+        usage = self._build_usage_lines(required_opts)
+        version = 'Version: %prog ' + self._get_version()
+
+        # Instantiate the command line parser object
+        parser = OptionParser(usage=usage, version=version)
+
+        def optparse_option(option):
+            # List-valued types read response files with the same prefix.
+            option = option.getOptparseOption()
+            option.response_file_prefix = self.ResponseFilePrefix
+            return option
+
+        required_option_ids = []
+        if required_opts:
+            # Define an option group so all required options are grouped
+            # together and under a common header.
+            required = OptionGroup(parser, "REQUIRED options",
+                                   "The following options must be provided "
+                                   "under all circumstances.")
+            for ro in required_opts:
+                required.add_option(optparse_option(ro))
+            parser.add_option_group(required)
+
+            # dest may be different from the original option name because
+            # optparse converts names from dashed to underscored.
+            required_option_ids = [(o.dest, o.get_opt_string())
+                                   for o in required.option_list]
+
+        # Add the optional options.
+        for oo in optional_opts:
+            parser.add_option(optparse_option(oo))
+
+        input_clean_names = [(option,
+                              self._get_optparse_clean_name(option.Name))
+                             for option in self._get_inputs()
+                             if option.Parameter is not None]
+
+        return CachedOptionParser(parser, required_option_ids,
+                                  input_clean_names)
+
     def _build_usage_lines(self, required_options):
         """ Build the usage string from components """
         line1 = 'usage: %prog [options] ' + \
@@ -233,21 +329,54 @@ class OptparseInterface(Interface):
 
         return '\n'.join(lines)
 
-    def _output_handler(self, results):
+    def _output_handler(self, results, context=None):
         """Deal with things in output if we know how"""
-        handled_results = {}
+        if context is None:
+            context = RequestContext()
+
+        handler_calls = []
 
         for output in self._get_outputs():
             rk = output.Name
         
             if output.InputName is None:
-                handled_results[rk] = output.Handler(rk, results[rk])
+                handler_args = (rk, results[rk])
             else:
                 optparse_clean_name = \
                         self._get_optparse_clean_name(output.InputName)
-                opt_value = self._optparse_input[optparse_clean_name]
-                handled_results[rk] = output.Handler(rk, results[rk],
-                                                           opt_value)
+                opt_value = context.InterfaceInput[optparse_clean_name]
+                handler_args = (rk, results[rk], opt_value)
+
+            handler_calls.append((rk, output.Handler, handler_args))
+
+        if self.OutputHandlerThreads > 1 and len(handler_calls) > 1:
+            return self._run_output_handlers_concurrently(handler_calls)
+
+        handled_results = {}
+        for rk, handler, handler_args in handler_calls:
+            handled_results[rk] = handler(*handler_args)
+
+        return handled_results
+
+    def _run_output_handlers_concurrently(self, handler_calls):
+        """Run output handlers on a thread pool.
+
+        All handlers run to completion before this returns. If any of them
+        raised an exception, the exception of the first one (in the order
+        of ``_get_outputs``) is re-raised.
+        """
+        pool = ThreadPool(min(self.OutputHandlerThreads, len(handler_calls)))
+
+        try:
+            async_results = [(rk, pool.apply_async(handler, handler_args))
+                             for rk, handler, handler_args in handler_calls]
+        finally:
+            pool.close()
+            pool.join()
+
+        handled_results = {}
+        for rk, async_result in async_results:
+            handled_results[rk] = async_result.get()
 
         return handled_results
 
@@ -255,8 +384,51 @@ class OptparseInterface(Interface):
         # optparse converts dashes to underscores in long option names.
         return name.replace('-', '_')
 
+def _option_takes_value(parser, arg):
+    """Return True if ``arg`` is an option whose value is the next argument"""
+    if arg.startswith('--'):
+        if '=' in arg:
+            return False
+
+        try:
+            # Resolves abbreviated long options the same way parse_args does.
+            opt_str = parser._match_long_opt(arg)
+        except BadOptionError:
+            return False
+        option = parser.get_option(opt_str)
+    elif arg.startswith('-') and len(arg) == 2:
+        option = parser.get_option(arg)
+    else:
+        return False
+
+    return option is not None and option.takes_value()
+
+class CachedOptionParser(object):
+    """An ``OptionParser`` and the metadata derived from it
+
+    ``Parser`` is the fully constructed ``OptionParser``.
+    ``RequiredOptionIds`` is a list of (dest, option string) tuples, one per
+        required option.
+    ``InputCleanNames`` is a list of (``OptparseOption``, optparse clean name)
+        tuples, one per option that maps to a ``Parameter``.
+
+    ``OptionParser.parse_args`` keeps the state of the parse on the parser
+    object, so calls through ``parse_args`` are serialized to allow a single
+    instance to be shared by concurrent callers.
+    """
+    def __init__(self, Parser, RequiredOptionIds, InputCleanNames):
+        self.Parser = Parser
+        self.RequiredOptionIds = RequiredOptionIds
+        self.InputCleanNames = InputCleanNames
+        self._lock = Lock()
+
+    def parse_args(self, in_):
+        """Parse ``in_``, returning the ``(options, args)`` pair"""
+        with self._lock:
+            return self.Parser.parse_args(in_)
+
 def optparse_factory(command_constructor, usage_examples, inputs, outputs,
-                     version):
+                     version, output_handler_threads=None):
     """Optparse command line interface factory
     
     command_constructor - a subclass of ``Command``
@@ -265,9 +437,14 @@ def optparse_factory(command_constructor, usage_examples, inputs, outputs,
     inputs  - config ``inputs`` or a list of ``OptparseOptions``
     outputs - config ``outputs`` or a list of ``OptparseResults`` 
     version - config ``__version__`` (a version string)
+    output_handler_threads - config ``output_handler_threads`` (optional), the
+        number of threads used to run the output handlers concurrently
     """
+    attributes = {}
+    if output_handler_threads is not None:
+        attributes['OutputHandlerThreads'] = output_handler_threads
     return general_factory(command_constructor, usage_examples, inputs,
-                           outputs, version, OptparseInterface)
+                           outputs, version, OptparseInterface, **attributes)
 
 def optparse_main(interface_object, local_argv):
     """Construct and execute an interface object"""
@@ -288,20 +465,52 @@ def optparse_main(interface_object, local_argv):
 # TODO: this code needs to be refactored to better fit the pyqi framework.
 # Should probably get added to the OptparseInterface class.
 
-def check_existing_filepath(option, opt, value):
-    if not exists(value):
+def check_existing_filepath(option, opt, value, stat_cache=None):
+    if value == STDIO_PATH:
+        # stdin
+        return value
+
+    if stat_cache is None:
+        stat_cache = PathStatCache()
+
+    if not stat_cache.exists(value):
         raise OptionValueError(
             "option %s: file does not exist: %r" % (opt, value))
-    elif not isfile(value):
+    elif not stat_cache.isfile(value):
         raise OptionValueError(
             "option %s: not a regular file (can't be a directory!): %r" % (opt, value))
     else:
         return value
 
+def split_list_value(opt, value, prefix='@'):
+    """Split a comma-separated option value into a list.
+
+    A value of the form ``<prefix>path`` (e.g., ``@path``) is instead read
+    from the response file ``path`` (one entry per line or NUL-delimited
+    record), which avoids command line length limits for very long lists.
+    If ``prefix`` is ``None``, the value is always split.
+    """
+    if prefix is not None and value.startswith(prefix) and \
+       len(value) > len(prefix):
+        response_fp = value[len(prefix):]
+        try:
+            return list(iter_response_file(response_fp))
+        except (IOError, OSError) as e:
+            raise OptionValueError(
+                "option %s: unable to read response file %r: %s" %
+                (opt, response_fp, e))
+    else:
+        return value.split(',')
+
 def check_existing_filepaths(option, opt, value):
+    # One stat cache per option value: glob_paths records the type of every
+    # path it sees, so the checks below rarely have to stat anything.
+    stat_cache = PathStatCache()
+    # Plain optparse Options (or None) use the default prefix.
+    patterns = split_list_value(opt, value,
+                                getattr(option, 'response_file_prefix', '@'))
     paths = []
-    for v in value.split(','):
-        fps = glob(v)
+    for v, fps in zip(patterns, glob_paths(patterns, stat_cache)):
         if len(fps) == 0:
             raise OptionValueError(
              "No filepaths match pattern/name '%s'. "
@@ -310,24 +519,30 @@ def check_existing_filepaths(option, opt, value):
             paths.extend(fps)
     values = []
     for v in paths:
-        check_existing_filepath(option,opt,v)
+        check_existing_filepath(option, opt, v, stat_cache)
         values.append(v)
     return values
 
-def check_existing_dirpath(option, opt, value):
-    if not exists(value):
+def check_existing_dirpath(option, opt, value, stat_cache=None):
+    if stat_cache is None:
+        stat_cache = PathStatCache()
+
+    if not stat_cache.exists(value):
         raise OptionValueError(
             "option %s: directory does not exist: %r" % (opt, value))
-    elif not isdir(value):
+    elif not stat_cache.isdir(value):
         raise OptionValueError(
             "option %s: not a directory (can't be a file!): %r" % (opt, value))
     else:
         return value
 
 def check_existing_dirpaths(option, opt, value):
+    stat_cache = PathStatCache()
+    # Plain optparse Options (or None) use the default prefix.
+    patterns = split_list_value(opt, value,
+                                getattr(option, 'response_file_prefix', '@'))
     paths = []
-    for v in value.split(','):
-        dps = glob(v)
+    for v, dps in zip(patterns, glob_paths(patterns, stat_cache)):
         if len(dps) == 0:
             raise OptionValueError(
                 "No dirpaths match pattern/name '%s'."
@@ -336,11 +551,15 @@ def check_existing_dirpaths(option, opt, value):
             paths.extend(dps)
     values = []
     for v in paths:
-        check_existing_dirpath(option, opt, v)
+        check_existing_dirpath(option, opt, v, stat_cache)
         values.append(v)
     return values
 
 def check_new_filepath(option, opt, value):
+    if value == STDIO_PATH:
+        # stdout
+        return value
+
     if exists(value):
         if isdir(value):
             raise OptionValueError(
@@ -388,6 +607,10 @@ def check_blast_db(option, opt, value):
 class PyqiOption(Option):
     ATTRS = Option.ATTRS + ['mchoices','split_char']
 
+    # List values starting with this prefix name a response file (see
+    # split_list_value). OptparseInterface sets it to its ResponseFilePrefix.
+    response_file_prefix = '@'
+
     TYPES = Option.TYPES + ("existing_path",
                             "new_path",
                             "existing_filepath",
@@ -405,19 +628,22 @@ class PyqiOption(Option):
     # for cases where the user specifies a new file or directory
     # as output, but it can be either a dir or a file
     TYPE_CHECKER["new_path"] = check_new_path
-    # for cases where the user passes a single existing file
+    # for cases where the user passes a single existing file, or '-' to
+    # read from stdin
     TYPE_CHECKER["existing_filepath"] = check_existing_filepath
     # for cases where the user passes one or more existing files
-    # as a comma-separated list - paths are returned as a list
+    # as a comma-separated list (or an @response_file) - paths are returned
+    # as a list, with the matches of each glob pattern in sorted order
     TYPE_CHECKER["existing_filepaths"] = check_existing_filepaths
     # for cases where the user is passing a new path to be 
-    # create (e.g., an output file)
+    # create (e.g., an output file), or '-' to write to stdout
     TYPE_CHECKER["new_filepath"] = check_new_filepath
     # for cases where the user is passing an existing directory
     # (e.g., containing a set of input files)
     TYPE_CHECKER["existing_dirpath"] = check_existing_dirpath
     # for cases where the user passes one or more existing directories
-    # as a comma-separated list - paths are returned as a list
+    # as a comma-separated list (or an @response_file) - paths are returned
+    # as a list, with the matches of each glob pattern in sorted order
     TYPE_CHECKER["existing_dirpaths"] = check_existing_dirpaths
     # for cases where the user is passing a new directory to be 
     # create (e.g., an output dir which will contain many result files)
@@ -17,6 +17,12 @@ function(option_value)
 __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout"]
 
+from pyqi.core.interface import iterable_handler
+from pyqi.util import open_path
+
+# Buffer size (in bytes) used when lazily reading files.
+READ_BUFFER_SIZE = 1024 * 1024
+
 def command_handler(option_value):
     """Dynamically load a Python object from a module and return an instance"""
     module, klass = option_value.rsplit('.',1)
@@ -31,21 +37,82 @@ def string_list_handler(option_value=None):
     return result
 
 def file_reading_handler(option_value=None):
-    """Open a filepath for reading."""
+    """Open a filepath for reading.
+
+    A filepath of '-' refers to stdin.
+    """
     result = None
     if option_value is not None:
-        result = open(option_value, 'U')
+        result = open_path(option_value, 'U')
+    return result
+
+def binary_file_reading_handler(option_value=None):
+    """Open a filepath for reading in binary mode.
+
+    A filepath of '-' refers to stdin, which is read without any decoding or
+    newline translation.
+    """
+    result = None
+    if option_value is not None:
+        result = open_path(option_value, 'rb')
     return result
 
 def load_file_lines(option_value):
     """Return a list of strings, one per line in the file.
 
-    Each line will have leading and trailing whitespace stripped from it.
+    Each line will have leading and trailing whitespace stripped from it. A
+    filepath of '-' refers to stdin.
     """
-    with open(option_value, 'U') as f:
+    with open_path(option_value, 'U') as f:
         return [line.strip() for line in f]
 
 def load_file_contents(option_value):
-    """Return the contents of a file as a single string."""
-    with open(option_value, 'U') as f:
+    """Return the contents of a file as a single string.
+
+    A filepath of '-' refers to stdin.
+    """
+    with open_path(option_value, 'U') as f:
         return f.read()
+
+@iterable_handler
+def iter_file_lines(option_value=None):
+    """Return an iterator over the lines in the file.
+
+    Each line will have leading and trailing whitespace stripped from it.
+    Lines are read on demand through a large buffer, so memory use does not
+    depend on the size of the file. The file is closed once the iterator is
+    exhausted. A filepath of '-' refers to stdin.
+    """
+    result = None
+    if option_value is not None:
+        result = _iter_stripped_lines(_open_for_lazy_reading(option_value))
+    return result
+
+@iterable_handler
+def iter_file_chunks(option_value=None):
+    """Return an iterator over the contents of the file.
+
+    The contents are read on demand in chunks of up to ``READ_BUFFER_SIZE``
+    characters. The file is closed once the iterator is exhausted. A
+    filepath of '-' refers to stdin.
+    """
+    result = None
+    if option_value is not None:
+        result = _iter_chunks(_open_for_lazy_reading(option_value))
+    return result
+
+def _open_for_lazy_reading(option_value):
+    return open_path(option_value, 'U', READ_BUFFER_SIZE)
+
+def _iter_stripped_lines(f):
+    with f:
+        for line in f:
+            yield line.strip()
+
+def _iter_chunks(f):
+    with f:
+        while True:
+            chunk = f.read(READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            yield chunk
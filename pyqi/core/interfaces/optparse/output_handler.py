@@ -24,48 +24,65 @@ __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout", "Evan Bolyen", "Adam Robbins-Pianka"]
 
 from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.util import STDIO_PATH, is_py2, open_path
+from itertools import islice
 import os
+import sys
+
+if is_py2():
+    _string_types = (str, unicode)
+else:
+    _string_types = (str,)
+
+# The list handlers join this many lines into a single write call.
+WRITE_CHUNK_LINES = 8192
+
+# Buffer size (in bytes) used when writing files.
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 def write_string(result_key, data, option_value=None):
     """Write a string to a file.
     
-    A newline will be added to the end of the file.
+    A newline will be added to the end of the file. A filepath of '-' refers
+    to stdout. ``bytes`` data is written in binary mode, unchanged.
     """
     if option_value is None:
         raise IncompetentDeveloperError("Cannot write output without a "
                                         "filepath.")
 
-    if os.path.exists(option_value):
-        raise IOError("Output path '%s' already exists." % option_value)
+    _check_new_output_path(option_value)
 
-    with open(option_value, 'w') as f:
+    if isinstance(data, bytes) and not is_py2():
+        mode, newline = 'wb', b'\n'
+    else:
+        mode, newline = 'w', '\n'
+
+    with open_path(option_value, mode) as f:
         f.write(data)
-        f.write('\n')
+        f.write(newline)
 
 def write_list_of_strings(result_key, data, option_value=None):
-    """Write a list of strings to a file, one per line.
+    """Write a list (or any iterable) of strings to a file, one per line.
     
-    A newline will be added to the end of the file.
+    A newline will be added to the end of the file. A filepath of '-' refers
+    to stdout.
     """
     if option_value is None:
         raise IncompetentDeveloperError("Cannot write output without a "
                                         "filepath.")
 
-    if os.path.exists(option_value):
-        raise IOError("Output path '%s' already exists." % option_value)
+    _check_new_output_path(option_value)
 
-    with open(option_value, 'w') as f:
-        for line in data:
-            f.write(line)
-            f.write('\n')
+    with open_path(option_value, 'w', WRITE_BUFFER_SIZE) as f:
+        _write_lines(f, data)
 
 def print_list_of_strings(result_key, data, option_value=None):
-    """Print a list of strings to stdout, one per line.
+    """Print a list (or any iterable) of strings to stdout, one per line.
 
-    ``result_key`` and ``option_value`` are ignored.
+    Items that aren't strings are printed as ``str(item)``, as ``print``
+    would. ``result_key`` and ``option_value`` are ignored.
     """
-    for line in data:
-        print(line)
+    _write_lines(sys.stdout, data, convert=True)
 
 def print_string(result_key, data, option_value=None):
     """Print the string
@@ -85,6 +102,34 @@ def write_or_print_string(result_key, data, option_value=None):
     else:
         write_string(result_key, data, option_value)
 
+def _check_new_output_path(option_value):
+    """Refuse to overwrite an existing file (stdout is always fine)"""
+    if option_value != STDIO_PATH and os.path.exists(option_value):
+        raise IOError("Output path '%s' already exists." % option_value)
+
+def _write_lines(f, lines, convert=False):
+    """Write each string in the iterable ``lines`` to ``f``, one per line.
+
+    Lines are joined in chunks of ``WRITE_CHUNK_LINES``, so there are a
+    handful of write calls per chunk instead of two per line, and only one
+    chunk is held in memory when ``lines`` is an iterator. If ``convert`` is
+    ``True``, lines that aren't strings are written as ``str(line)``.
+    """
+    lines = iter(lines)
+
+    while True:
+        chunk = list(islice(lines, WRITE_CHUNK_LINES))
+        if not chunk:
+            break
+
+        if convert:
+            chunk = [line if isinstance(line, _string_types) else str(line)
+                     for line in chunk]
+
+        # Joining with a trailing empty string terminates the last line too.
+        chunk.append('')
+        f.write('\n'.join(chunk))
+
 def write_or_print_list_of_strings(result_key, data, option_value=None):
     """Write a list of strings to a file, one per line.
 
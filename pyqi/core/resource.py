@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Load expensive resources once, and share them between calls
+
+A ``Command`` that needs something slow to load, such as a reference
+database or a model, declares it as a ``Resource`` instead of loading it in
+``run``::
+
+    REFERENCE_DB = Resource(Name='reference_db', Load=load_reference_db,
+                            Release=lambda db: db.close())
+
+    class Align(Command):
+        Resources = [REFERENCE_DB]
+
+        def run(self, **kwargs):
+            db = self.resource('reference_db')
+            ...
+
+The value is loaded on first use (or by ``Command.warmup``), and shared by
+every instance of the ``Command`` and every thread, for as long as the
+process runs. Long-lived processes, such as the HTMLInterface server,
+release what they loaded with ``release_all`` when they shut down.
+"""
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+from threading import Lock
+
+from pyqi.core.exception import IncompetentDeveloperError
+
+# The Resources loaded in this process, in the order they were loaded.
+_loaded = []
+_loaded_lock = Lock()
+
+class Resource(object):
+    """A value loaded once, by calling ``Load()``, and shared
+
+    ``Release``, if given, is called with the value when it is released.
+    Safe to share between threads: ``Load`` is only called by one of them.
+    """
+    def __init__(self, Name, Load, Release=None, Description=None):
+        if not callable(Load):
+            raise IncompetentDeveloperError("Resource '%s' needs a callable "
+                                            "Load." % Name)
+
+        self.Name = Name
+        self.Load = Load
+        self.Release = Release
+        self.Description = Description
+        self._value = None
+        self._loaded = False
+        self._pid = None
+        self._lock = Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        """Return the value, loading it if it isn't loaded yet"""
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            if not self._loaded:
+                self._value = self.Load()
+                self._loaded = True
+                self._pid = os.getpid()
+                with _loaded_lock:
+                    _loaded.append(self)
+            return self._value
+
+    def release(self):
+        """Release the value, so the next ``get`` loads it again
+
+        A value loaded by a parent process (e.g., before a fork) is only
+        forgotten, not passed to ``Release``, as the parent still owns it.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            value = self._value
+            owned = self._pid == os.getpid()
+            self._value = None
+            self._loaded = False
+            with _loaded_lock:
+                if self in _loaded:
+                    _loaded.remove(self)
+
+        if owned and self.Release is not None:
+            self.Release(value)
+
+def loaded_resources():
+    """Return the ``Resource``s loaded in this process"""
+    with _loaded_lock:
+        return list(_loaded)
+
+def release_all():
+    """Release every loaded ``Resource``, the latest loaded first
+
+    If a ``Release`` raises, the other resources are still released, and
+    the first error is raised afterwards.
+    """
+    error = None
+    for resource in reversed(loaded_resources()):
+        try:
+            resource.release()
+        except Exception as e:
+            if error is None:
+                error = e
+
+    if error is not None:
+        raise error
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Share one execution between identical concurrent calls
+
+When many clients ask for the same thing at once (e.g., a dashboard
+reloading), a ``SingleFlight`` runs the first call and has the identical
+calls that arrive while it runs wait for, and return, its outcome::
+
+    flights = SingleFlight()
+    result = flights.call(cmd, **kwargs)
+
+Only ``Command``s that set ``Deduplicate`` are shared, as every caller gets
+the same result object: the ``Command`` must have no side effects, and its
+results must not be consumed by reading them (e.g., iterators or open
+files).
+"""
+
+__credits__ = ["Evan Bolyen", "Jai Ram Rideout", "Daniel McDonald",
+    "Greg Caporaso"]
+
+from threading import Event, Lock
+
+from pyqi.util import is_py2
+
+if is_py2():
+    _scalar_types = (type(None), bool, int, long, float, complex, str,
+                     unicode)
+else:
+    _scalar_types = (type(None), bool, int, float, complex, str, bytes)
+
+class Flight(object):
+    """One execution, and the calls waiting for its outcome"""
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self._waiters = []
+        self._lock = Lock()
+
+    def add_waiter(self, waiter):
+        """Call ``waiter.set()`` once the execution has finished
+
+        As for a ``Limiter``, ``waiter`` can be a ``threading.Event``, or
+        something that wakes an event loop.
+        """
+        with self._lock:
+            if not self.done:
+                self._waiters.append(waiter)
+                return
+        waiter.set()
+
+    def outcome(self):
+        """Return the result of the execution, or raise its error"""
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _finish(self, result, error):
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.done = True
+            waiters, self._waiters = self._waiters, []
+
+        for waiter in waiters:
+            waiter.set()
+
+class SingleFlight(object):
+    """Collapse calls with the same key that are in flight together
+
+    Safe to share between threads. A key is only shared while its call
+    runs: a call arriving after it finished runs again.
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock = Lock()
+
+    def join(self, key):
+        """Return the ``Flight`` for ``key``, and whether the caller leads it
+
+        The leader must run the call and pass its outcome to ``finish``;
+        the others wait for it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """End ``flight``, handing ``result`` (or ``error``) to its followers"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._finish(result, error)
+
+    def do(self, key, func, *args, **kwargs):
+        """Return ``func(*args, **kwargs)`` and whether it was shared
+
+        If a call with ``key`` is already running, wait for it and return
+        (or raise) its outcome instead of calling ``func``.
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            waiter = Event()
+            flight.add_waiter(waiter)
+            waiter.wait()
+            return flight.outcome(), True
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+
+        self.finish(key, flight, result)
+        return result, False
+
+    def call(self, cmd, **kwargs):
+        """Return ``cmd(**kwargs)``, shared with identical calls in flight
+
+        Calls that can't be shared (see ``call_key``) run on their own.
+        """
+        key = call_key(cmd, kwargs)
+        if key is None:
+            return cmd(**kwargs)
+        return self.do((type(cmd), key), cmd, **kwargs)[0]
+
+    def in_flight(self):
+        """Return the number of calls running"""
+        with self._lock:
+            return len(self._flights)
+
+def call_key(cmd, kwargs):
+    """Return a hashable key for calling ``cmd`` with ``kwargs``, or None
+
+    Calls with the same key have the same inputs, once defaults are filled
+    in. The key is None if ``cmd`` doesn't set ``Deduplicate``, or if an
+    input isn't made of plain values (strings, numbers, lists, dicts and
+    the like).
+    """
+    if not getattr(cmd, 'Deduplicate', False):
+        return None
+
+    inputs = dict((p.Name, p.Default) for p in cmd.CommandIns.values()
+                  if not p.Required)
+    inputs.update(kwargs)
+    try:
+        return _canonical(inputs)
+    except (TypeError, _NotCanonical):
+        # TypeError: the keys or the members of a set can't be sorted.
+        return None
+
+class _NotCanonical(Exception):
+    pass
+
+def _canonical(value):
+    """Return a hashable value equal for equal inputs of the same types"""
+    value_type = type(value)
+    if value_type in _scalar_types:
+        return value_type, value
+    elif value_type in (list, tuple):
+        return value_type, tuple(_canonical(v) for v in value)
+    elif value_type is dict:
+        return dict, tuple(sorted((k, _canonical(v))
+                                  for k, v in value.items()))
+    elif value_type in (set, frozenset):
+        return value_type, tuple(sorted(_canonical(v) for v in value))
+    raise _NotCanonical(value_type)
@@ -16,6 +16,7 @@ from pyqi.core.interfaces.optparse import (OptparseOption,
 from pyqi.core.interfaces.optparse.input_handler import string_list_handler
 from pyqi.core.interfaces.optparse.output_handler import print_string
 from pyqi.core.command import make_command_in_collection_lookup_f, make_command_out_collection_lookup_f
+from pyqi.core.interfaces.html import SERVER_MODES
 from pyqi.commands.serve_html_interface import CommandConstructor
 
 cmdin_lookup = make_command_in_collection_lookup_f(CommandConstructor)
@@ -36,7 +37,45 @@ inputs = [
 
     OptparseOption(Parameter=cmdin_lookup('interface_module'),
                    ShortName='m',
-                   Required=True)
+                   Required=True),
+
+    OptparseOption(Parameter=cmdin_lookup('server_mode'),
+                   Type='choice',
+                   Choices=SERVER_MODES),
+
+    OptparseOption(Parameter=cmdin_lookup('workers'),
+                   ShortName='w',
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('backlog'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('max_request_size'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('job_workers'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('max_queued_jobs'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('job_retention'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('max_concurrent_commands'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('max_waiting_commands'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('warmup'),
+                   Type=None, Action='store_true'),
+
+    OptparseOption(Parameter=cmdin_lookup('max_worker_requests'),
+                   Type=int),
+
+    OptparseOption(Parameter=cmdin_lookup('max_worker_memory'),
+                   Type=int)
 ]
 
 outputs = [
@@ -13,11 +13,23 @@
 __credits__ = ["Greg Caporaso", "Jai Ram Rideout"]
 
 import importlib
-from os import remove
-from os.path import split, splitext
+import os
+import stat
 import sys
+from fnmatch import fnmatch
+from glob import has_magic
+from multiprocessing.pool import ThreadPool
+from os import remove
+from os.path import join, split, splitext
 from subprocess import Popen, PIPE
 
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5: fall back on listdir, and stat every entry we need to know
+    # the type of.
+    scandir = None
+
 from pyqi.core.log import StdErrLogger
 from pyqi.core.exception import MissingVersionInfoError
 
@@ -28,6 +40,91 @@ def is_py2():
     else:
         return False
 
+# The path that refers to stdin when reading and to stdout when writing.
+STDIO_PATH = '-'
+
+def open_path(path, mode='r', buffering=-1):
+    """Open ``path``, mapping ``STDIO_PATH`` ('-') to stdin or stdout.
+
+    '-' refers to stdin if ``mode`` is a reading mode, and to stdout
+    otherwise. In binary modes the underlying byte streams are used, so data
+    passes through unchanged. Closing the object returned for '-' flushes,
+    but doesn't close, the standard stream.
+
+    A 'U' (universal newlines) in ``mode`` is dropped on Python 3, where it
+    is the default for text files.
+    """
+    if not is_py2() and 'U' in mode:
+        mode = mode.replace('U', '')
+        if 'r' not in mode:
+            mode = 'r' + mode
+
+    if path != STDIO_PATH:
+        return open(path, mode, buffering)
+
+    if 'r' in mode or 'U' in mode:
+        stream = sys.stdin
+    else:
+        stream = sys.stdout
+
+    if 'b' in mode:
+        # Python 3 text streams wrap a binary buffer; Python 2 streams are
+        # already binary.
+        stream = getattr(stream, 'buffer', stream)
+
+    return StdioFile(stream)
+
+def iter_response_file(path, chunk_size=1024 * 1024):
+    """Return an iterator over the entries in the response file ``path``.
+
+    A response file holds one argument per line or, if the file contains a
+    NUL character within its first ``chunk_size`` characters, one argument
+    per NUL-delimited record (e.g., the output of ``find -print0``). Empty
+    entries are skipped. The file is read in chunks of ``chunk_size``
+    characters, so entries are produced as the file is read. A ``path`` of
+    '-' refers to stdin.
+    """
+    with open_path(path, 'U') as f:
+        chunk = f.read(chunk_size)
+        delimiter = '\0' if '\0' in chunk else '\n'
+        remainder = ''
+
+        while chunk:
+            entries = (remainder + chunk).split(delimiter)
+            remainder = entries.pop()
+            for entry in entries:
+                if entry:
+                    yield entry
+            chunk = f.read(chunk_size)
+
+        if remainder:
+            yield remainder
+
+class StdioFile(object):
+    """A standard stream that can be used (and closed) like a regular file
+
+    Closing a ``StdioFile`` only flushes the stream, so a handler can treat
+    '-' exactly like any other path without closing stdin or stdout for the
+    rest of the process.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._stream.flush()
+
 def pyqi_system_call(cmd, shell=True, dry_run=False):
     """Call cmd and return (stdout, stderr, return_value).
 
@@ -135,3 +232,203 @@ def get_version_string(module_str):
                 "__version__ attribute." % top_level_name)
 
     return version_string
+
+class PathStatCache(object):
+    """Cache of filesystem path types for a single validation pass
+
+    Each path is stat'ed at most once. Paths found while listing a directory
+    are recorded with the type information from the directory entry, so they
+    don't need to be stat'ed at all. ``prefetch`` stats many paths at once on
+    a thread pool, which pays off on high-latency (e.g., network) filesystems.
+
+    ``NumThreads`` is the number of threads used by ``prefetch``.
+    ``PoolThreshold`` is the minimum number of uncached paths for which
+        ``prefetch`` will use a thread pool.
+    """
+    FILE = 'file'
+    DIR = 'dir'
+    OTHER = 'other'
+    MISSING = 'missing'
+
+    NumThreads = 16
+    PoolThreshold = 64
+
+    def __init__(self):
+        self._types = {}
+
+    def add(self, path, path_type):
+        """Record the type of ``path``"""
+        self._types[path] = path_type
+
+    def get_type(self, path):
+        """Return the type of ``path``, stat'ing it if it isn't cached"""
+        try:
+            return self._types[path]
+        except KeyError:
+            path_type = _stat_path_type(path)
+            self._types[path] = path_type
+            return path_type
+
+    def prefetch(self, paths):
+        """Stat all uncached ``paths``, concurrently if there are many"""
+        uncached = [p for p in set(paths) if p not in self._types]
+
+        if len(uncached) < self.PoolThreshold:
+            path_types = [_stat_path_type(p) for p in uncached]
+        else:
+            pool = ThreadPool(self.NumThreads)
+            try:
+                path_types = pool.map(_stat_path_type, uncached,
+                        chunksize=max(1, len(uncached) // (4 * self.NumThreads)))
+            finally:
+                pool.close()
+                pool.join()
+
+        self._types.update(zip(uncached, path_types))
+
+    def exists(self, path):
+        return self.get_type(path) != self.MISSING
+
+    def isfile(self, path):
+        return self.get_type(path) == self.FILE
+
+    def isdir(self, path):
+        return self.get_type(path) == self.DIR
+
+def _stat_path_type(path):
+    """Return the ``PathStatCache`` type of ``path``, following symlinks"""
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return PathStatCache.MISSING
+
+    if stat.S_ISREG(mode):
+        return PathStatCache.FILE
+    elif stat.S_ISDIR(mode):
+        return PathStatCache.DIR
+    else:
+        return PathStatCache.OTHER
+
+def glob_paths(patterns, stat_cache=None):
+    """Expand each glob pattern in ``patterns`` into the paths matching it.
+
+    Returns a list with one list of matching paths per pattern. Matches
+    follow the rules of Python's ``glob``, including recursive matching of
+    ``**`` path components, and are sorted so that results don't depend on
+    the order in which the filesystem lists directories. Patterns without
+    wildcards match themselves if they exist.
+
+    Directories are listed with ``scandir`` (when available), and all type
+    information is stored in ``stat_cache`` (a ``PathStatCache``) so callers
+    can check the matched paths without stat'ing them again.
+    """
+    if stat_cache is None:
+        stat_cache = PathStatCache()
+
+    # Check every literal path in one batch.
+    stat_cache.prefetch([p for p in patterns if not has_magic(p)])
+
+    results = []
+    for pattern in patterns:
+        if has_magic(pattern):
+            # A leading ** matches zero directories as '', which isn't a path.
+            results.append(sorted(p for p in _glob(pattern, stat_cache) if p))
+        elif stat_cache.exists(pattern):
+            results.append([pattern])
+        else:
+            results.append([])
+
+    return results
+
+def _glob(pathname, stat_cache):
+    """Return the (unsorted) existing paths matching ``pathname``"""
+    dirname, basename = split(pathname)
+
+    if not has_magic(pathname):
+        return [pathname] if stat_cache.exists(pathname) else []
+
+    if not dirname:
+        return _glob_in_dir(dirname, basename, stat_cache)
+
+    if dirname != pathname and has_magic(dirname):
+        dirs = _glob(dirname, stat_cache)
+        # '' (zero directories matched by **) is the current directory.
+        stat_cache.prefetch([d or os.curdir for d in dirs])
+        dirs = [d for d in dirs if stat_cache.isdir(d or os.curdir)]
+    else:
+        dirs = [dirname]
+
+    if has_magic(basename):
+        return [join(d, name) for d in dirs
+                for name in _glob_in_dir(d, basename, stat_cache)]
+    else:
+        candidates = [join(d, basename) for d in dirs]
+        stat_cache.prefetch(candidates)
+        return [c for c in candidates if stat_cache.exists(c)]
+
+def _glob_in_dir(dirname, pattern, stat_cache):
+    """Return the names in ``dirname`` that match ``pattern``"""
+    if pattern == '**':
+        # Matches zero or more directories.
+        return [''] + _rlistdir(dirname, stat_cache)
+
+    names = _listdir(dirname, stat_cache)
+    if not _is_hidden(pattern):
+        names = [n for n in names if not _is_hidden(n)]
+
+    return [n for n in names if fnmatch(n, pattern)]
+
+def _rlistdir(dirname, stat_cache):
+    """Return all non-hidden paths below ``dirname``, relative to it"""
+    names = []
+    for name in _listdir(dirname, stat_cache):
+        if _is_hidden(name):
+            continue
+
+        names.append(name)
+        if stat_cache.isdir(join(dirname, name)):
+            names.extend(join(name, sub_name) for sub_name in
+                         _rlistdir(join(dirname, name), stat_cache))
+    return names
+
+def _listdir(dirname, stat_cache):
+    """Return the names in ``dirname``, recording their types if possible"""
+    if scandir is None:
+        try:
+            names = os.listdir(dirname or os.curdir)
+        except OSError:
+            return []
+        stat_cache.prefetch([join(dirname, n) for n in names])
+        return names
+
+    try:
+        entries = scandir(dirname or os.curdir)
+    except OSError:
+        return []
+
+    names = []
+    try:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    path_type = PathStatCache.FILE
+                elif entry.is_dir():
+                    path_type = PathStatCache.DIR
+                elif entry.is_symlink():
+                    # Neither a file nor a directory, so the link is dangling.
+                    path_type = PathStatCache.MISSING
+                else:
+                    path_type = PathStatCache.OTHER
+            except OSError:
+                path_type = PathStatCache.MISSING
+
+            stat_cache.add(join(dirname, entry.name), path_type)
+            names.append(entry.name)
+    finally:
+        if hasattr(entries, 'close'):
+            entries.close()
+
+    return names
+
+def _is_hidden(name):
+    return name.startswith('.')
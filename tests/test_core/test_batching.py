@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase, main
+
+from pyqi.core.batching import MicroBatcher
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.exception import InvalidReturnTypeError
+
+class Square(Command):
+    CommandIns = ParameterCollection([
+        CommandIn('x', int, '', Required=True,
+                  ValidateValue=lambda x: x >= 0)])
+    CommandOuts = ParameterCollection([CommandOut('square', int, '')])
+
+    def run(self, **kwargs):
+        return self.run_batch([kwargs])[0]
+
+    def run_batch(self, calls):
+        results = []
+        for kwargs in calls:
+            if kwargs['x'] == 13:
+                results.append(ValueError("unlucky"))
+            elif kwargs['x'] == 7:
+                results.append({'nope': 1})
+            else:
+                results.append({'square': kwargs['x'] ** 2})
+        return results
+
+class CallBatchTests(TestCase):
+    def test_call_batch(self):
+        """Each call of a batch gets its result, or its own error"""
+        cmd = Square()
+        self.assertTrue(cmd.supports_batch())
+        self.assertFalse(Command().supports_batch())
+
+        outcomes = cmd.call_batch([{'x': 2}, {'x': -1}, {'x': 13}, {'x': 7},
+                                   {'x': 3}])
+        self.assertEqual(outcomes[0], {'square': 4})
+        self.assertTrue(isinstance(outcomes[1], ValueError))
+        self.assertEqual(str(outcomes[2]), 'unlucky')
+        self.assertTrue(isinstance(outcomes[3], Exception))
+        self.assertEqual(outcomes[4], {'square': 9})
+
+    def test_wrong_length(self):
+        cmd = Square()
+        cmd.run_batch = lambda calls: []
+        self.assertRaises(InvalidReturnTypeError, cmd.call_batch, [{'x': 1}])
+
+class MicroBatcherTests(TestCase):
+    def setUp(self):
+        self.batches = []
+        self.release = Event()
+        self.release.set()
+
+    def run_batch(self, calls):
+        self.batches.append([kwargs['x'] for kwargs in calls])
+        self.release.wait()
+        if calls[0]['x'] < 0:
+            raise ValueError("negative")
+        return [kwargs['x'] * 10 for kwargs in calls]
+
+    def call_all(self, batcher, values):
+        results = {}
+        def call(x):
+            try:
+                results[x] = batcher.call({'x': x})
+            except ValueError as e:
+                results[x] = e
+        callers = [Thread(target=call, args=(x,)) for x in values]
+        for caller in callers:
+            caller.start()
+        return callers, results
+
+    def test_idle(self):
+        """A call made while nothing runs isn't held up"""
+        batcher = MicroBatcher(self.run_batch)
+        self.assertEqual(batcher.call({'x': 1}), 10)
+        self.assertEqual(batcher.call({'x': 2}), 20)
+        self.assertEqual(self.batches, [[1], [2]])
+
+    def test_busy(self):
+        """Calls made while a batch runs make up the next batch"""
+        batcher = MicroBatcher(self.run_batch, MaxSize=3)
+        self.release.clear()
+        first, results = self.call_all(batcher, [0])
+        while not self.batches:
+            sleep(0.001)
+
+        callers, more = self.call_all(batcher, range(1, 6))
+        while batcher._pending is None or \
+              len(batcher._pending.calls) < 2:
+            sleep(0.001)
+        sleep(0.05)
+        self.release.set()
+        for caller in first + callers:
+            caller.join()
+        results.update(more)
+
+        self.assertEqual(results, dict((x, x * 10) for x in range(6)))
+        self.assertEqual(self.batches[0], [0])
+        self.assertEqual(sorted(sum(self.batches[1:], [])), [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.batches), 3)
+        self.assertTrue(max(len(b) for b in self.batches) <= 3)
+
+    def test_window(self):
+        """Calls within the window share a batch"""
+        batcher = MicroBatcher(self.run_batch, Window=0.5, MaxSize=4)
+        callers, results = self.call_all(batcher, range(4))
+        for caller in callers:
+            caller.join()
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(results, {0: 0, 1: 10, 2: 20, 3: 30})
+
+    def test_error(self):
+        """An error running a batch is raised for each of its calls"""
+        batcher = MicroBatcher(self.run_batch, Window=0.5, MaxSize=2)
+        callers, results = self.call_all(batcher, [-1, -2])
+        for caller in callers:
+            caller.join()
+        self.assertTrue(isinstance(results[-1], ValueError))
+        self.assertTrue(isinstance(results[-2], ValueError))
+        self.assertEqual(batcher.call({'x': 1}), 10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+"""Async Commands used by test_aio.py
+
+Kept apart from the tests, as only Python 3.5 or later can compile them.
+"""
+
+__credits__ = ["Evan Bolyen"]
+
+import asyncio
+import threading
+
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+        ParameterCollection)
+
+class Sleep(Command):
+    BriefDescription = "Sleep without holding a thread"
+    CommandIns = ParameterCollection([
+        CommandIn(Name='seconds', DataType=float, Description='how long',
+                  Required=False, Default=0.0)])
+    CommandOuts = ParameterCollection([
+        CommandOut(Name='thread', DataType=str, Description='where it ran')])
+
+    async def run(self, **kwargs):
+        await asyncio.sleep(kwargs['seconds'])
+        return {'thread': threading.current_thread().name}
+
+class SharedSleep(Sleep):
+    Deduplicate = True
+    calls = 0
+
+    async def run(self, **kwargs):
+        SharedSleep.calls += 1
+        return await super(SharedSleep, self).run(**kwargs)
+
+class SleepInterface(object):
+    CmdInstance = Sleep()
+    Limits = None
+
+class SharedSleepInterface(SleepInterface):
+    CmdInstance = SharedSleep()
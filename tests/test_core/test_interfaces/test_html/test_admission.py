@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+from threading import Thread
+from time import sleep
+from unittest import TestCase, main
+
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.interfaces.html.admission import (AdmissionControl,
+        CommandBusyError, ConcurrencyLimit, Limiter, ServerBusyError)
+
+class ConcurrencyLimitTests(TestCase):
+    def test_init(self):
+        limit = ConcurrencyLimit(MaxConcurrent=2)
+        self.assertEqual(limit.MaxWaiting, 0)
+        self.assertEqual(limit.WaitTimeout, None)
+
+        self.assertRaises(IncompetentDeveloperError, ConcurrencyLimit, 0)
+        self.assertRaises(IncompetentDeveloperError, ConcurrencyLimit, 1, -1)
+
+class LimiterTests(TestCase):
+    def test_refused(self):
+        """Calls are refused once the slots and the queue are full"""
+        limiter = Limiter(ConcurrencyLimit(2, RetryAfter=7), CommandBusyError,
+                          'things')
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(limiter.running, 2)
+
+        try:
+            limiter.acquire()
+        except CommandBusyError as e:
+            self.assertEqual(e.RetryAfter, 7)
+            self.assertEqual(e.Status, 429)
+        else:
+            self.fail("The call wasn't refused.")
+
+        limiter.release()
+        limiter.acquire()
+        self.assertEqual(limiter.running, 2)
+
+    def test_waiting(self):
+        """Waiting calls are handed slots in order"""
+        limiter = Limiter(ConcurrencyLimit(1, MaxWaiting=2), CommandBusyError,
+                          'things')
+        limiter.acquire()
+
+        order = []
+        def wait(i):
+            limiter.acquire()
+            order.append(i)
+        waiting = []
+        for i in range(2):
+            waiting.append(Thread(target=wait, args=(i,)))
+            waiting[-1].start()
+            while limiter.waiting <= i:
+                sleep(0.001)
+
+        self.assertRaises(CommandBusyError, limiter.acquire)
+        self.assertEqual(order, [])
+
+        limiter.release()
+        waiting[0].join()
+        limiter.release()
+        waiting[1].join()
+        self.assertEqual(order, [0, 1])
+        self.assertEqual(limiter.running, 1)
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_check(self):
+        """Checking takes no slot, and refuses once a call would be"""
+        limiter = Limiter(ConcurrencyLimit(1, MaxWaiting=1), CommandBusyError,
+                          'things')
+        limiter.check()
+        limiter.acquire()
+        limiter.check()
+        self.assertEqual(limiter.running, 1)
+
+        waiting = Thread(target=limiter.acquire)
+        waiting.start()
+        while limiter.waiting < 1:
+            sleep(0.001)
+        self.assertRaises(CommandBusyError, limiter.check)
+        limiter.release()
+        waiting.join()
+
+    def test_timeout(self):
+        """Calls waiting too long are refused"""
+        limiter = Limiter(ConcurrencyLimit(1, MaxWaiting=1, WaitTimeout=0.01),
+                          CommandBusyError, 'things')
+        limiter.acquire()
+        self.assertRaises(CommandBusyError, limiter.acquire)
+        self.assertEqual(limiter.waiting, 0)
+        self.assertEqual(limiter.running, 1)
+
+    def test_no_queue(self):
+        """Calls that aren't queued wait however many others are waiting"""
+        limiter = Limiter(ConcurrencyLimit(1, WaitTimeout=0.01),
+                          CommandBusyError, 'things')
+        limiter.acquire()
+        waiting = Thread(target=limiter.acquire, args=(False,))
+        waiting.start()
+        sleep(0.05)
+        self.assertEqual(limiter.waiting, 1)
+        limiter.release()
+        waiting.join()
+        self.assertEqual(limiter.running, 1)
+
+class AdmissionControlTests(TestCase):
+    def test_admit(self):
+        """Calls pass the command's limit, then the server's"""
+        admission = AdmissionControl(ConcurrencyLimit(2))
+        limit = ConcurrencyLimit(1)
+
+        with admission.admit('a', limit):
+            self.assertRaises(CommandBusyError, admission.admit, 'a', limit)
+            with admission.admit('b', None):
+                self.assertRaises(ServerBusyError, admission.admit, 'c',
+                                  None)
+                # The command's slot is given back when the server refuses.
+                self.assertRaises(ServerBusyError, admission.admit, 'd',
+                                  ConcurrencyLimit(1))
+                self.assertEqual(admission.limiters('d', limit)[0].running,
+                                 0)
+
+        self.assertEqual(admission.server_limiter.running, 0)
+        slot = admission.admit('a', limit)
+        slot.release()
+        slot.release()
+        self.assertEqual(admission.limiters('a', limit)[0].running, 0)
+
+    def test_no_limits(self):
+        admission = AdmissionControl()
+        self.assertEqual(admission.limiters('a', None), [])
+        with admission.admit('a', None):
+            pass
+        self.assertEqual(admission.waiting(), 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import json
+import os
+import socket
+import sys
+import threading
+from tempfile import mkstemp
+from threading import Thread
+from timeit import default_timer
+from unittest import TestCase, main, skipIf
+
+from pyqi.core.command import Command
+from pyqi.core.interfaces.html import get_http_handler
+
+# The asyncio server needs Python 3.7, and older Pythons can't even compile
+# the async Commands, so nothing here is imported on them.
+NO_ASYNCIO = sys.version_info < (3, 7)
+
+if not NO_ASYNCIO:
+    import asyncio
+    from http.client import HTTPConnection
+    from importlib.util import module_from_spec, spec_from_file_location
+
+    from pyqi.core.interfaces.html.aio import AsyncHTTPServer, call_command
+
+    def _load_aio_commands():
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'aio_commands.py')
+        spec = spec_from_file_location('aio_commands', path)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    aio_commands = _load_aio_commands()
+    Sleep = aio_commands.Sleep
+    SharedSleep = aio_commands.SharedSleep
+    SleepInterface = aio_commands.SleepInterface
+    SharedSleepInterface = aio_commands.SharedSleepInterface
+
+@skipIf(NO_ASYNCIO, "asyncio server needs Python 3.7 or later")
+class AsyncCommandTests(TestCase):
+    def test_call(self):
+        """Async Commands can be called like any other"""
+        cmd = Sleep()
+        self.assertTrue(cmd.is_async())
+        self.assertFalse(Command().is_async())
+        self.assertEqual(cmd(), {'thread': threading.current_thread().name})
+
+    def test_call_command(self):
+        """call_command awaits an async Command on the running loop"""
+        loop = asyncio.new_event_loop()
+        try:
+            obs = loop.run_until_complete(call_command(Sleep(), {}))
+        finally:
+            loop.close()
+        self.assertEqual(obs, {'thread': threading.current_thread().name})
+
+@skipIf(NO_ASYNCIO, "asyncio server needs Python 3.7 or later")
+class AsyncHTTPServerTests(TestCase):
+    def setUp(self):
+        fd, self.path = mkstemp()
+        os.write(fd, b'x' * 100000)
+        os.close(fd)
+
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        path = self.path
+
+        def stream(self):
+            self.send_body(('%d\n' % i for i in range(100000)), 'text/plain')
+        def send_file(self):
+            self.send_body(open(path, 'rb'), 'application/octet-stream')
+        handler.GetRoutes['/stream'] = (stream, ())
+        handler.GetRoutes['/file'] = (send_file, ())
+
+        handler.Commands = handler.Commands + ['sleep', 'shared-sleep']
+        handler.Interfaces._interfaces['sleep'] = SleepInterface()
+        handler.Interfaces._interfaces['shared-sleep'] = \
+                SharedSleepInterface()
+        handler.PostRoutes['/api/sleep'] = (handler.api_call, ('sleep',))
+        handler.PostRoutes['/api/shared-sleep'] = (handler.api_call,
+                                                   ('shared-sleep',))
+
+        self.server = AsyncHTTPServer(('127.0.0.1', 0), handler, workers=2)
+        self.port = self.server.server_address[1]
+        self.serving = Thread(target=self.server.serve_forever)
+        self.serving.daemon = True
+        self.serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.path)
+
+    def connect(self):
+        return HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    def test_keep_alive(self):
+        """Pages, streams and files are served on one connection"""
+        conn = self.connect()
+        try:
+            conn.request('GET', '/help')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertTrue(response.read().startswith(b'This is still'))
+
+            conn.request('GET', '/stream')
+            response = conn.getresponse()
+            self.assertEqual(response.getheader('Transfer-Encoding'),
+                             'chunked')
+            body = response.read()
+            self.assertEqual(body.count(b'\n'), 100000)
+            self.assertTrue(body.endswith(b'99999\n'))
+
+            conn.request('GET', '/file')
+            response = conn.getresponse()
+            self.assertEqual(response.getheader('Content-Length'), '100000')
+            self.assertEqual(response.read(), b'x' * 100000)
+
+            conn.request('GET', '/nope')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 404)
+            response.read()
+        finally:
+            conn.close()
+
+    def test_post(self):
+        """Forms and JSON bodies are read through the loop"""
+        body = ''.join('--xYzZY\r\nContent-Disposition: form-data; '
+                       'name="%s"\r\n\r\n%s\r\n' % field for field in
+                       [('pyqi_name', 'foo'),
+                        ('pyqi_command_class_name', 'Foo'),
+                        ('pyqi_author', 'me' * 100000),
+                        ('pyqi_email', 'a@b'),
+                        ('pyqi_download-file', 'out')]) + '--xYzZY--\r\n'
+        conn = self.connect()
+        try:
+            conn.request('POST', '/make-command', body.encode('ascii'),
+                         {'Content-Type':
+                          'multipart/form-data; boundary=xYzZY'})
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertTrue(b'__author__ = "meme' in response.read())
+
+            conn.request('POST', '/api/make-command', json.dumps(
+                    {'name': 'foo', 'author': 'me', 'email': 'a@b'}))
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertTrue('result' in json.loads(response.read()))
+        finally:
+            conn.close()
+
+    def test_async_command(self):
+        """Async Commands run on the loop, not on the worker threads"""
+        def call(results):
+            conn = self.connect()
+            try:
+                conn.request('POST', '/api/sleep', '{"seconds": 0.5}')
+                results.append(json.loads(conn.getresponse().read()))
+            finally:
+                conn.close()
+
+        results = []
+        clients = [Thread(target=call, args=(results,)) for i in range(10)]
+        start = default_timer()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        # Ten half second sleeps, with only two worker threads.
+        self.assertTrue(default_timer() - start < 2)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(set(r['result']['thread'] for r in results),
+                         set([self.serving.name]))
+
+        conn = self.connect()
+        try:
+            conn.request('POST', '/api/sleep', '{"seconds": "x"}')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 400)
+            response.read()
+        finally:
+            conn.close()
+
+    def test_request_size(self):
+        """Bodies read before an async call are capped by default"""
+        self.server.MaxAsyncRequestSize = 100
+        conn = self.connect()
+        try:
+            conn.request('POST', '/api/sleep',
+                         json.dumps({'seconds': 0, 'pad': 'x' * 100}))
+            response = conn.getresponse()
+            self.assertEqual(response.status, 413)
+            self.assertEqual(response.getheader('Connection'), 'close')
+            response.read()
+        finally:
+            conn.close()
+
+    def test_shared_command(self):
+        """Identical calls of a Deduplicate Command share one execution"""
+        def call(results):
+            conn = self.connect()
+            try:
+                conn.request('POST', '/api/shared-sleep', '{"seconds": 0.5}')
+                response = conn.getresponse()
+                results.append((response.status, json.loads(response.read())))
+            finally:
+                conn.close()
+
+        SharedSleep.calls = 0
+        results = []
+        clients = [Thread(target=call, args=(results,)) for i in range(5)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(SharedSleep.calls, 1)
+        self.assertEqual([status for status, _ in results], [200] * 5)
+        self.assertEqual(self.server.RequestHandlerClass.Flights.in_flight(),
+                         0)
+
+    def test_shutdown(self):
+        """Idle connections don't hold up a shutdown"""
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            sock.sendall(b'GET /help HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            self.assertTrue(sock.recv(65536).startswith(b'HTTP/1.1 200'))
+            start = default_timer()
+            self.server.shutdown()
+            self.assertTrue(default_timer() - start < 1)
+            self.assertEqual(sock.recv(65536), b'')
+        finally:
+            sock.close()
+
+if __name__ == '__main__':
+    main()
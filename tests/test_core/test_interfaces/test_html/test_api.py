@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+from io import BytesIO
+from unittest import TestCase, main
+
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.html.api import (APIError, RequestTooLargeError,
+        describe_command, get_command_inputs, read_json, to_jsonable)
+
+class Summarize(Command):
+    BriefDescription = "Summarize some numbers"
+    CommandIns = ParameterCollection([
+        CommandIn(Name='numbers', DataType=list, Description='the numbers',
+                  Required=True),
+        CommandIn(Name='label', DataType=str, Description='a label',
+                  Default='total'),
+        CommandIn(Name='scale', DataType=float, Description='a factor',
+                  Default=1.0, ValidateValue=lambda x: x > 0),
+        CommandIn(Name='count', DataType=int, Description='a count'),
+        CommandIn(Name='verbose', DataType=bool, Description='be chatty',
+                  Default=False)
+    ])
+    CommandOuts = ParameterCollection([
+        CommandOut(Name='summary', DataType=dict, Description='the summary')
+    ])
+
+    def run(self, **kwargs):
+        return {'summary': {kwargs['label']:
+                            kwargs['scale'] * sum(kwargs['numbers'])}}
+
+class APITests(TestCase):
+    def setUp(self):
+        self.cmd = Summarize()
+
+    def test_get_command_inputs(self):
+        """Inputs are checked and converted to each CommandIn's DataType"""
+        obs = get_command_inputs(self.cmd, {'numbers': [1, 2], 'scale': 2,
+                                            'count': 3, 'label': None,
+                                            'verbose': True})
+        self.assertEqual(obs, {'numbers': [1, 2], 'scale': 2.0, 'count': 3,
+                               'verbose': True})
+        self.assertTrue(isinstance(obs['scale'], float))
+
+        self.assertEqual(self.cmd(**obs), {'summary': {'total': 6.0}})
+
+    def test_get_command_inputs_errors(self):
+        """Unknown, missing, mistyped and invalid inputs are refused"""
+        for inputs in ({'numbers': [1], 'nope': 1},
+                       {'label': 'x'},
+                       {'numbers': 'abc'},
+                       {'numbers': [1], 'label': 1},
+                       {'numbers': [1], 'count': 1.5},
+                       {'numbers': [1], 'count': True},
+                       {'numbers': [1], 'verbose': 'yes'},
+                       {'numbers': [1], 'scale': -1},
+                       ['numbers']):
+            self.assertRaises(APIError, get_command_inputs, self.cmd, inputs)
+
+    def test_read_json(self):
+        """The body is decoded, within the size limit"""
+        self.assertEqual(read_json(BytesIO(b'{"a": [1]}'), '10'), {'a': [1]})
+        self.assertEqual(read_json(BytesIO(b'{"a": [1]}'), 10, 10),
+                         {'a': [1]})
+
+        self.assertRaises(RequestTooLargeError, read_json,
+                          BytesIO(b'{"a": [1]}'), '10', 9)
+        self.assertRaises(APIError, read_json, BytesIO(b'{"a"'), '4')
+        self.assertRaises(APIError, read_json, BytesIO(b'{}'), '4')
+        self.assertRaises(APIError, read_json, BytesIO(b'{}'), None)
+
+    def test_describe_command(self):
+        """Inputs and outputs are described in order"""
+        obs = describe_command(self.cmd)
+        self.assertEqual(obs['description'], "Summarize some numbers")
+        self.assertEqual([i['name'] for i in obs['inputs']],
+                         ['numbers', 'label', 'scale', 'count', 'verbose'])
+        self.assertEqual(obs['inputs'][0], {'name': 'numbers', 'type': 'list',
+                                            'description': 'the numbers',
+                                            'required': True,
+                                            'default': None})
+        self.assertEqual(obs['outputs'], [{'name': 'summary', 'type': 'dict',
+                                           'description': 'the summary'}])
+
+    def test_to_jsonable(self):
+        """Values JSON has no type for are converted"""
+        self.assertEqual(to_jsonable({'a': (1, 2), 'b': b'x', 'c': None}),
+                         {'a': [1, 2], 'b': 'x', 'c': None})
+        self.assertEqual(to_jsonable(set([3])), [3])
+        self.assertEqual(to_jsonable(iter(['a'])), ['a'])
+        self.assertEqual(to_jsonable(Summarize), str(Summarize))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,747 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import json
+import os
+import socket
+import zlib
+from time import sleep
+from tempfile import mkstemp
+from threading import Event, Thread
+from unittest import TestCase, main
+
+from pyqi.util import is_py2
+if is_py2():
+    from httplib import HTTPConnection
+else:
+    from http.client import HTTPConnection
+
+from pyqi.core.interfaces.html import (HTMLInputOption, HTMLInterface,
+        HTMLInterfaceCache, HTMLPage, get_cmd_obj, get_http_handler,
+        html_interface_factory, normalize_route_path)
+from pyqi.core.interfaces.html.admission import (AdmissionControl,
+        ConcurrencyLimit)
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.html.server import PooledHTTPServer, PyqiHTTPServer
+from pyqi.core.resource import Resource, release_all
+from pyqi.core.singleflight import call_key
+
+def request(port, path, version='HTTP/1.1', headers=()):
+    """Send a GET, and return the raw response"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        lines = ['GET %s %s' % (path, version), 'Host: localhost',
+                 'Connection: close'] + ['%s: %s' % h for h in headers]
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+        response = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response.append(data)
+    finally:
+        sock.close()
+    return b''.join(response)
+
+def post(port, path, fields=None, body=None):
+    """POST fields as multipart form data (or a raw body), and return the
+    raw response
+    """
+    content_type = 'application/json'
+    if fields is not None:
+        content_type = 'multipart/form-data; boundary=xYzZY'
+        body = []
+        for name, value in fields:
+            body.append('--xYzZY\r\nContent-Disposition: form-data; '
+                        'name="%s"\r\n\r\n%s\r\n' % (name, value))
+        body.append('--xYzZY--\r\n')
+        body = ''.join(body)
+    body = body.encode('ascii')
+
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        sock.sendall(('POST %s HTTP/1.1\r\nHost: localhost\r\n'
+                      'Connection: close\r\n'
+                      'Content-Type: %s\r\n'
+                      'Content-Length: %d\r\n\r\n' % (path, content_type,
+                                                         len(body))
+                     ).encode('ascii') + body)
+        response = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response.append(data)
+    finally:
+        sock.close()
+    return b''.join(response)
+
+def read_response(f):
+    """Read a response with a Content-Length from the file of a socket
+
+    Returns the (headers, body) pair.
+    """
+    headers = []
+    length = 0
+    while True:
+        line = f.readline()
+        if line == b'\r\n':
+            break
+        headers.append(line)
+        if line.lower().startswith(b'content-length'):
+            length = int(line.split(b':')[1])
+    return b''.join(headers), f.read(length)
+
+def json_body(response):
+    return json.loads(response.split(b'\r\n\r\n', 1)[1].decode('utf-8'))
+
+class HTMLInterfaceCacheTests(TestCase):
+    def test_get(self):
+        """Each command's interface is built once and then reused"""
+        cache = HTMLInterfaceCache('pyqi.interfaces.html.config')
+
+        obs = cache.get('make-command')
+        self.assertTrue(isinstance(obs, HTMLInterface))
+        self.assertEqual(obs.CommandName, 'make-command')
+        self.assertTrue(cache.get('make-command') is obs)
+        self.assertFalse(cache.get('make-optparse') is obs)
+
+    def test_get_cmd_obj(self):
+        """Interface classes are memoized per command"""
+        first = get_cmd_obj('pyqi.interfaces.html.config', 'make-command')
+        second = get_cmd_obj('pyqi.interfaces.html.config', 'make-command')
+        self.assertTrue(type(first) is type(second))
+        self.assertEqual(first.CommandName, 'make-command')
+        self.assertEqual(first.Limits, None)
+
+class RoutingTests(TestCase):
+    def test_normalize_route_path(self):
+        """Query strings, fragments and trailing slashes are ignored"""
+        self.assertEqual(normalize_route_path('/'), '/')
+        self.assertEqual(normalize_route_path(''), '/')
+        self.assertEqual(normalize_route_path('/?a=b'), '/')
+        self.assertEqual(normalize_route_path('/make-command'),
+                         '/make-command')
+        self.assertEqual(normalize_route_path('/make-command/'),
+                         '/make-command')
+        self.assertEqual(normalize_route_path('/make-command/?a=b&c=d'),
+                         '/make-command')
+        self.assertEqual(normalize_route_path('/make-command#top'),
+                         '/make-command')
+
+    def test_route_tables(self):
+        """Every command gets a GET and a POST route"""
+        handler = get_http_handler('pyqi.interfaces.html.config')
+
+        for command in ('make-bash-completion', 'make-command',
+                        'make-optparse'):
+            route, args = handler.GetRoutes['/' + command]
+            self.assertEqual(route, handler.command_page)
+            self.assertEqual(args, (command,))
+
+            route, args = handler.PostRoutes['/' + command]
+            self.assertEqual(route, handler.command_post)
+            self.assertEqual(args, (command,))
+
+        for path in ('/', '/index', '/home', '/help', '/_timings'):
+            self.assertTrue(path in handler.GetRoutes)
+            self.assertFalse(path in handler.PostRoutes)
+
+    def test_route_tables_per_module(self):
+        """Each handler class has its own route tables"""
+        first = get_http_handler('pyqi.interfaces.html.config')
+        second = get_http_handler('pyqi.interfaces.html.config')
+        self.assertFalse(first.GetRoutes is second.GetRoutes)
+        self.assertFalse(first.PostRoutes is second.PostRoutes)
+
+    def test_warmup(self):
+        """Warming up builds every interface and loads its Resources"""
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        loads = []
+        resource = Resource('thing', lambda: loads.append(1))
+        cmd = handler.Interfaces.get('make-command').CmdInstance
+        cmd.Resources = [resource]
+        try:
+            self.assertTrue(handler.warmup() >= 0)
+            self.assertEqual(loads, [1])
+            self.assertEqual(sorted(handler.Interfaces._interfaces),
+                             sorted(handler.Commands))
+        finally:
+            release_all()
+
+class ResponseBodyTests(TestCase):
+    def setUp(self):
+        fd, self.path = mkstemp()
+        os.write(fd, b'x' * 100000)
+        os.close(fd)
+
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        path = self.path
+
+        def stream(self):
+            self.send_body(iter(['a', 'b', 'c']), 'text/plain')
+        def send_file(self):
+            self.send_body(open(path, 'rb'), 'application/octet-stream')
+        handler.GetRoutes['/stream'] = (stream, ())
+        handler.GetRoutes['/file'] = (send_file, ())
+
+        self.server = PyqiHTTPServer(('127.0.0.1', 0), handler)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.path)
+
+    def test_text(self):
+        """Pages are sent with a Content-Length"""
+        headers, body = request(self.port, '/help').split(b'\r\n\r\n', 1)
+        self.assertTrue(b'Content-Length: %d' % len(body) in headers)
+        self.assertTrue(body.startswith(b'This is still'))
+
+    def test_stream(self):
+        """Iterables are sent chunked to HTTP/1.1 clients"""
+        headers, body = request(self.port, '/stream').split(b'\r\n\r\n', 1)
+        self.assertTrue(b'Transfer-Encoding: chunked' in headers)
+        self.assertEqual(body, b'3\r\nabc\r\n0\r\n\r\n')
+
+    def test_stream_http10(self):
+        """Iterables are sent unframed to HTTP/1.0 clients"""
+        headers, body = request(self.port, '/stream',
+                                'HTTP/1.0').split(b'\r\n\r\n', 1)
+        self.assertFalse(b'chunked' in headers)
+        self.assertTrue(b'Connection: close' in headers)
+        self.assertEqual(body, b'abc')
+
+    def test_file(self):
+        """Files are sent whole, with a Content-Length"""
+        headers, body = request(self.port, '/file').split(b'\r\n\r\n', 1)
+        self.assertTrue(b'Content-Length: 100000' in headers)
+        self.assertEqual(body, b'x' * 100000)
+
+    def test_gzip(self):
+        """Text is gzipped for clients that accept it"""
+        headers, body = request(self.port, '/make-command',
+                headers=[('Accept-Encoding', 'gzip')]).split(b'\r\n\r\n', 1)
+        self.assertTrue(b'Content-Encoding: gzip' in headers)
+        page = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.assertTrue(b'href="/static/pyqi.css"' in page)
+        self.assertFalse(b'<style>' in page)
+
+        headers, body = request(self.port, '/make-command').split(
+                b'\r\n\r\n', 1)
+        self.assertFalse(b'Content-Encoding' in headers)
+        self.assertEqual(body, page)
+
+    def test_static(self):
+        """The stylesheet is cacheable and revalidated by ETag"""
+        response = request(self.port, '/static/pyqi.css')
+        headers, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(b'Cache-Control: public' in headers)
+        self.assertTrue(b'.required' in body)
+
+        etag = [line.split(b': ', 1)[1] for line in headers.split(b'\r\n')
+                if line.startswith(b'ETag')][0]
+        response = request(self.port, '/static/pyqi.css',
+                           headers=[('If-None-Match', etag.decode('ascii'))])
+        self.assertTrue(response.startswith(b'HTTP/1.1 304'))
+
+    def test_connection_close(self):
+        """One connection at a time, so none is kept alive"""
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            f = sock.makefile('rb')
+            sock.sendall(b'GET /help HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            headers, body = read_response(f)
+            self.assertTrue(b'Connection: close' in headers)
+            self.assertEqual(f.read(), b'')
+            f.close()
+        finally:
+            sock.close()
+
+    def test_not_found(self):
+        """Paths without a route get a 404"""
+        response = request(self.port, '/nope')
+        self.assertTrue(response.startswith(b'HTTP/1.1 404'))
+
+class KeepAliveTests(TestCase):
+    def setUp(self):
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        self.server = PooledHTTPServer(('127.0.0.1', 0), handler, 1)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        """Several requests can be made on one connection"""
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            f = sock.makefile('rb')
+            for i in range(3):
+                sock.sendall(b'GET /help HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                headers, body = read_response(f)
+                self.assertTrue(headers.startswith(b'HTTP/1.1 200'))
+                self.assertFalse(b'Connection: close' in headers)
+                self.assertTrue(body.startswith(b'This is still'))
+            f.close()
+        finally:
+            sock.close()
+
+    def test_idle_closed(self):
+        """An idle connection gives its thread up to a new one"""
+        self.server.BusyKeepAliveTimeout = 0.1
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            f = sock.makefile('rb')
+            sock.sendall(b'GET /help HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            read_response(f)
+
+            # The only thread waits on the idle connection.
+            response = request(self.port, '/help')
+            self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+            self.assertEqual(f.read(), b'')
+            f.close()
+        finally:
+            sock.close()
+
+    def test_more_clients_than_threads(self):
+        """Every request sent on a kept-alive connection is answered"""
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        server = PooledHTTPServer(('127.0.0.1', 0), handler, 4)
+        serving = Thread(target=server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+        body = json.dumps({'name': 'foo', 'author': 'me', 'email': 'a@b'})
+        statuses = []
+        errors = []
+        def client():
+            conn = HTTPConnection('127.0.0.1', server.server_address[1])
+            try:
+                for i in range(20):
+                    if i % 2:
+                        conn.request('POST', '/api/make-command', body,
+                                     {'Content-Type': 'application/json'})
+                    else:
+                        conn.request('GET', '/help')
+                    response = conn.getresponse()
+                    response.read()
+                    statuses.append(response.status)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        clients = [Thread(target=client) for i in range(8)]
+        try:
+            for c in clients:
+                c.start()
+            for c in clients:
+                c.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses, [200] * 160)
+
+class APITests(TestCase):
+    def setUp(self):
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        self.server = PyqiHTTPServer(('127.0.0.1', 0), handler)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+        self.inputs = {'name': 'foo', 'author': 'me', 'email': 'a@b'}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_call(self):
+        """Commands run with JSON inputs and return JSON outputs"""
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps(self.inputs))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+        obs = json_body(response)
+        self.assertEqual(obs['command'], 'make-command')
+        self.assertTrue('__author__ = "me"' in obs['result']['result'])
+
+    def test_call_errors(self):
+        """Bad requests get an error and a 4xx status"""
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps({'name': 'foo', 'nope': 1}))
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+        self.assertEqual(json_body(response)['error']['message'],
+                         "Unknown input 'nope'.")
+
+        response = post(self.port, '/api/make-command', body='{')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+
+    def test_batch(self):
+        """Each invocation in a batch gets its own result"""
+        response = post(self.port, '/api', body=json.dumps([
+                {'command': 'make-command', 'inputs': self.inputs},
+                {'command': 'nope'},
+                {'command': 'make-command', 'inputs': {}}]))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+
+        obs = json_body(response)
+        self.assertEqual([r['status'] for r in obs], [200, 404, 400])
+        self.assertTrue('result' in obs[0])
+        self.assertEqual(obs[2]['error']['message'],
+                         "Missing required input 'name'.")
+
+        response = post(self.port, '/api', body='{}')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+
+    def test_describe(self):
+        """A GET describes the command"""
+        obs = json_body(request(self.port, '/api/make-command'))
+        self.assertEqual(obs['command'], 'make-command')
+        self.assertTrue('name' in [i['name'] for i in obs['inputs']])
+
+    def test_metrics(self):
+        """Requests and command calls are counted"""
+        post(self.port, '/api/make-command', body=json.dumps(self.inputs))
+        post(self.port, '/api/make-command', body='{}')
+
+        obs = json_body(request(self.port, '/metrics.json'))
+        route = obs['requests']['POST /api/make-command']
+        self.assertEqual(route['statuses'], {'200': 1, '400': 1})
+        self.assertEqual(route['errors'], 0)
+        self.assertEqual(obs['commands']['make-command']['count'], 1)
+        self.assertEqual(obs['requests_in_flight'], 1)
+        self.assertTrue(obs['bytes_out'] > 0)
+        self.assertEqual(obs['gauges'], {'pyqi_jobs_queued': 0,
+                                         'pyqi_commands_waiting': 0})
+
+        response = request(self.port, '/metrics')
+        self.assertTrue(b'text/plain; version=0.0.4' in response)
+        self.assertTrue(b'pyqi_command_duration_seconds_count'
+                        b'{command="make-command"} 1' in response)
+
+    def test_busy(self):
+        """Calls over a limit are refused with a Retry-After"""
+        handler = self.server.RequestHandlerClass
+        handler.Admission = AdmissionControl(ConcurrencyLimit(1,
+                                                              RetryAfter=5))
+        limit = ConcurrencyLimit(1, RetryAfter=2)
+        handler.Interfaces.get('make-command').Limits = limit
+
+        slot = handler.Admission.admit('make-command', limit)
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps(self.inputs))
+        self.assertTrue(response.startswith(b'HTTP/1.1 429'))
+        self.assertTrue(b'Retry-After: 2' in response)
+        self.assertTrue('Too many' in json_body(response)['error']['message'])
+        slot.release()
+
+        slot = handler.Admission.admit('other', None)
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps(self.inputs))
+        self.assertTrue(response.startswith(b'HTTP/1.1 503'))
+        self.assertTrue(b'Retry-After: 5' in response)
+        slot.release()
+
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps(self.inputs))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+
+    def test_shared_call(self):
+        """A call identical to one in flight gets that call's response"""
+        handler = self.server.RequestHandlerClass
+        cmd = handler.Interfaces.get('make-command').CmdInstance
+        key = ('make-command', call_key(cmd, dict(self.inputs)))
+        flight, leader = handler.Flights.join(key)
+        self.assertTrue(leader)
+
+        responses = []
+        client = Thread(target=lambda: responses.append(post(self.port,
+                '/api/make-command', body=json.dumps(self.inputs))))
+        client.start()
+        while not flight.followers:
+            sleep(0.001)
+        handler.Flights.finish(key, flight, (200, {'result': 'shared'}))
+        client.join()
+        self.assertEqual(json_body(responses[0]), {'result': 'shared'})
+
+        # Calls that differ run on their own.
+        inputs = dict(self.inputs, author='you')
+        response = post(self.port, '/api/make-command',
+                        body=json.dumps(inputs))
+        self.assertTrue('__author__ = "you"' in
+                        json_body(response)['result']['result'])
+
+FORM_FIELDS = [('pyqi_name', 'foo'), ('pyqi_command_class_name', 'Foo'),
+               ('pyqi_author', 'me'), ('pyqi_email', 'a@b'),
+               ('pyqi_download-file', 'out')]
+
+class FormAdmissionTests(TestCase):
+    def setUp(self):
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        self.limit = ConcurrencyLimit(1)
+        handler.Interfaces.get('make-command').Limits = self.limit
+
+        self.server = PooledHTTPServer(('127.0.0.1', 0), handler, 4)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.RequestHandlerClass.Jobs.shutdown()
+
+    def test_slow_upload(self):
+        """A form still being uploaded holds no slot"""
+        body = ''.join('--xYzZY\r\nContent-Disposition: form-data; '
+                       'name="%s"\r\n\r\n%s\r\n' % field
+                       for field in FORM_FIELDS) + '--xYzZY--\r\n'
+        body = body.encode('ascii')
+
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            sock.sendall(('POST /make-command HTTP/1.1\r\nHost: localhost\r\n'
+                          'Connection: close\r\n'
+                          'Content-Type: multipart/form-data; boundary=xYzZY'
+                          '\r\nContent-Length: %d\r\n\r\n' % len(body)
+                         ).encode('ascii') + body[:50])
+            sleep(0.1)
+
+            response = post(self.port, '/make-command', FORM_FIELDS)
+            self.assertTrue(response.startswith(b'HTTP/1.1 200'))
+
+            sock.sendall(body[50:])
+            f = sock.makefile('rb')
+            self.assertTrue(f.read().startswith(b'HTTP/1.1 200'))
+            f.close()
+        finally:
+            sock.close()
+
+    def test_busy(self):
+        """A busy command refuses a form before reading it"""
+        handler = self.server.RequestHandlerClass
+        slot = handler.Admission.admit('make-command', self.limit)
+        try:
+            response = post(self.port, '/make-command', FORM_FIELDS)
+        finally:
+            slot.release()
+        self.assertTrue(response.startswith(b'HTTP/1.1 429'))
+        self.assertTrue(b'Connection: close' in response)
+
+    def test_shared(self):
+        """Identical forms share one execution, and only it takes a slot"""
+        handler = self.server.RequestHandlerClass
+        cmd = handler.Interfaces.get('make-command').CmdInstance
+        calls = []
+        release = Event()
+        run = cmd.run
+        def slow_run(**kwargs):
+            calls.append(kwargs)
+            release.wait()
+            return run(**kwargs)
+        cmd.Deduplicate = True
+        cmd.run = slow_run
+
+        responses = []
+        def submit():
+            responses.append(post(self.port, '/make-command', FORM_FIELDS))
+        clients = [Thread(target=submit) for i in range(3)]
+        for client in clients:
+            client.start()
+        while not calls:
+            sleep(0.001)
+        flight = list(handler.Flights._flights.values())[0]
+        while flight.followers < 2:
+            sleep(0.001)
+        release.set()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r.startswith(b'HTTP/1.1 200') for r in responses))
+
+        # Jobs don't share executions.
+        key = (type(cmd), call_key(cmd, calls[0]))
+        flight, leader = handler.Flights.join(key)
+        try:
+            submitted = json_body(post(self.port, '/jobs/make-command',
+                                       FORM_FIELDS))
+            for i in range(500):
+                status = json_body(request(self.port,
+                                           submitted['status_url']))
+                if status['status'] == 'finished':
+                    break
+                sleep(0.01)
+            self.assertEqual(status['status'], 'finished')
+            self.assertEqual(len(calls), 2)
+        finally:
+            handler.Flights.finish(key, flight)
+
+class Double(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, '', Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('y', int, '')])
+    BatchWindow = 0.2
+    MaxBatchSize = 4
+
+    def run_batch(self, calls):
+        return [{'y': 2 * kwargs['x']} for kwargs in calls]
+
+DoubleInterface = html_interface_factory(Double, (),
+        [HTMLInputOption(Parameter=Double.CommandIns['x'], Type=int)],
+        [HTMLPage(Parameter=Double.CommandOuts['y'],
+                  Handler=lambda key, data: str(data))],
+        '0.1', 'double')
+
+class BatchingTests(TestCase):
+    def setUp(self):
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        handler.Commands = handler.Commands + ['double']
+        handler.Interfaces._interfaces['double'] = DoubleInterface()
+        handler.PostRoutes['/api/double'] = (handler.api_call, ('double',))
+        handler.PostRoutes['/double'] = (handler.command_post, ('double',))
+
+        self.server = PooledHTTPServer(('127.0.0.1', 0), handler, 4)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_batch(self):
+        """Concurrent calls of a command with a run_batch are batched"""
+        results = {}
+        def call(x):
+            results[x] = json_body(post(self.port, '/api/double',
+                                        body=json.dumps({'x': x})))
+        clients = [Thread(target=call, args=(x,)) for x in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        for x in range(4):
+            self.assertEqual(results[x]['result'], {'y': 2 * x})
+
+        obs = json_body(request(self.port, '/metrics.json'))
+        self.assertEqual(obs['commands']['double']['count'], 1)
+        self.assertEqual(obs['commands']['double']['batch_size']['max'], 4)
+
+        response = post(self.port, '/api/double', body='{"x": "a"}')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+
+    def test_form_batch(self):
+        """Concurrent form posts are batched like JSON API calls"""
+        results = {}
+        def call(x):
+            results[x] = post(self.port, '/double', [('pyqi_x', x)])
+        clients = [Thread(target=call, args=(x,)) for x in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        for x in range(4):
+            self.assertTrue(results[x].startswith(b'HTTP/1.1 200'))
+            self.assertEqual(results[x].split(b'\r\n\r\n', 1)[1],
+                             str(2 * x).encode('ascii'))
+
+        obs = json_body(request(self.port, '/metrics.json'))
+        self.assertEqual(obs['commands']['double']['count'], 1)
+        self.assertEqual(obs['commands']['double']['batch_size']['max'], 4)
+
+class JobTests(TestCase):
+    def setUp(self):
+        handler = get_http_handler('pyqi.interfaces.html.config')
+        handler.log_message = lambda *args: None
+        self.server = PyqiHTTPServer(('127.0.0.1', 0), handler)
+        self.port = self.server.server_address[1]
+        serving = Thread(target=self.server.serve_forever)
+        serving.daemon = True
+        serving.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.RequestHandlerClass.Jobs.shutdown()
+
+    def wait(self, status_url):
+        for i in range(500):
+            status = json_body(request(self.port, status_url))
+            if status['status'] in ('finished', 'failed'):
+                return status
+            sleep(0.01)
+        self.fail("The job didn't finish.")
+
+    def test_job(self):
+        """Jobs are submitted, polled and fetched"""
+        response = post(self.port, '/jobs/make-command',
+                        [('pyqi_name', 'foo'),
+                         ('pyqi_command_class_name', 'Foo'),
+                         ('pyqi_author', 'me'), ('pyqi_email', 'a@b'),
+                         ('pyqi_download-file', 'out')])
+        self.assertTrue(response.startswith(b'HTTP/1.1 202'))
+        submitted = json_body(response)
+        self.assertEqual(submitted['command'], 'make-command')
+        self.assertTrue(b'Location: /jobs/%s' % submitted['id'].encode('ascii')
+                        in response)
+
+        status = self.wait(submitted['status_url'])
+        self.assertEqual(status['status'], 'finished')
+
+        for i in range(2):
+            headers, body = request(self.port, status['result_url']).split(
+                    b'\r\n\r\n', 1)
+            self.assertTrue(b'filename=out.py' in headers)
+            self.assertTrue(b'__author__ = "me"' in body)
+
+    def test_input_errors(self):
+        """Missing inputs are reported when the result is fetched"""
+        submitted = json_body(post(self.port, '/jobs/make-command',
+                                   [('pyqi_name', 'foo')]))
+        status = self.wait(submitted['status_url'])
+        self.assertEqual(status['status'], 'finished')
+
+        response = request(self.port, status['result_url'])
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+        self.assertTrue(b'is required' in response)
+
+    def test_unknown_job(self):
+        """Unknown jobs get a 404"""
+        for path in ('/jobs/nope', '/jobs/nope/result', '/jobs'):
+            self.assertTrue(request(self.port, path).startswith(
+                    b'HTTP/1.1 404'))
+
+if __name__ == '__main__':
+    main()
@@ -19,8 +19,9 @@ else:
     from io import StringIO
 
 from pyqi.core.exception import IncompetentDeveloperError
+import pyqi.core.interfaces.html.input_handler as input_handler
 from pyqi.core.interfaces.html.input_handler import (load_file_lines,
-        load_file_contents)
+        load_file_contents, iter_file_lines, iter_file_chunks)
 
 class HTMLInputHandlerTests(TestCase):
     def setUp(self):
@@ -53,6 +54,32 @@ class HTMLInputHandlerTests(TestCase):
         result = load_file_contents(self.file_like_object)
         #Note the whitespace
         self.assertEqual(result, "This is line 1\n This is line 2\nThis is line 3 \n")
+    def test_iter_file_lines(self):
+        """Lazily returns file lines"""
+        self.assertRaises(IncompetentDeveloperError, iter_file_lines,
+                          'This is not a file')
+        result = iter_file_lines(self.file_like_object)
+        self.assertFalse(isinstance(result, list))
+        self.assertEqual(list(result),
+                         ["This is line 1",
+                          "This is line 2",
+                          "This is line 3"])
+
+    def test_iter_file_chunks(self):
+        """Lazily returns file contents in chunks"""
+        self.assertRaises(IncompetentDeveloperError, iter_file_chunks,
+                          'This is not a file')
+
+        saved_size = input_handler.READ_BUFFER_SIZE
+        try:
+            input_handler.READ_BUFFER_SIZE = 20
+            result = list(iter_file_chunks(self.file_like_object))
+        finally:
+            input_handler.READ_BUFFER_SIZE = saved_size
+
+        self.assertEqual(result, ["This is line 1\n This",
+                                  " is line 2\nThis is l",
+                                  "ine 3 \n"])
 
 if __name__ == '__main__':
     main()
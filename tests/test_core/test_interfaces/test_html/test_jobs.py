@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+from threading import Event
+from time import sleep
+from unittest import TestCase, main
+
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.interfaces.html.jobs import Job, JobQueue, JobQueueFullError
+
+def wait_for(predicate, timeout=5):
+    for i in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        sleep(0.01)
+    return False
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.shutdown()
+
+    def make_queue(self, *args, **kwargs):
+        queue = JobQueue(*args, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def test_submit(self):
+        """Jobs run in the background and keep their result"""
+        queue = self.make_queue()
+        cleaned = []
+        job = queue.submit('cmd', lambda: 42, lambda: cleaned.append(True))
+
+        self.assertTrue(queue.get(job.id) is job)
+        self.assertTrue(wait_for(lambda: job.done))
+        self.assertEqual(job.status, Job.FINISHED)
+        self.assertEqual(job.result, 42)
+        self.assertEqual(cleaned, [True])
+
+        status = job.to_dict()
+        self.assertEqual(status['id'], job.id)
+        self.assertEqual(status['command'], 'cmd')
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual(status['error'], None)
+        self.assertTrue(status['submitted'] <= status['started'] <=
+                        status['finished'])
+
+        self.assertEqual(queue.get('nope'), None)
+
+    def test_failure(self):
+        """A job that raises is marked as failed"""
+        queue = self.make_queue()
+        def fail():
+            raise ValueError("bad input")
+        job = queue.submit('cmd', fail)
+
+        self.assertTrue(wait_for(lambda: job.done))
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.to_dict()['error'], 'bad input')
+
+    def test_full(self):
+        """Submitting to a full queue fails immediately"""
+        queue = self.make_queue(workers=1, max_queued=1)
+        release = Event()
+
+        running = queue.submit('cmd', release.wait)
+        self.assertTrue(wait_for(lambda: running.status == Job.RUNNING))
+        queued = queue.submit('cmd', lambda: None)
+        self.assertRaises(JobQueueFullError, queue.submit, 'cmd',
+                          lambda: None)
+
+        release.set()
+        self.assertTrue(wait_for(lambda: queued.done))
+        queue.submit('cmd', lambda: None)
+
+    def test_retention(self):
+        """Finished jobs are discarded after the retention period"""
+        queue = self.make_queue(retention=0.05)
+        discarded = []
+        job = queue.submit('cmd', lambda: 'result', None, discarded.append)
+        self.assertTrue(wait_for(lambda: job.done))
+
+        self.assertTrue(wait_for(lambda: queue.get(job.id) is None))
+        self.assertEqual(discarded, ['result'])
+        self.assertEqual(len(queue), 0)
+
+    def test_max_finished(self):
+        """Only the most recently finished jobs are kept"""
+        queue = self.make_queue(workers=1, max_finished=2)
+        jobs = [queue.submit('cmd', lambda: None) for i in range(4)]
+        self.assertTrue(wait_for(lambda: all(job.done for job in jobs)))
+
+        self.assertEqual([queue.get(job.id) for job in jobs],
+                         [None, None, jobs[2], jobs[3]])
+
+    def test_no_workers(self):
+        self.assertRaises(IncompetentDeveloperError, JobQueue, 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+from unittest import TestCase, main
+
+from pyqi.core.interfaces.html.metrics import Histogram, Metrics, counted
+
+class HistogramTests(TestCase):
+    def test_observe(self):
+        """Observations are counted in the first bucket that holds them"""
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+        self.assertEqual(histogram.max, 10)
+
+    def test_quantile(self):
+        """Quantiles are interpolated within buckets"""
+        histogram = Histogram((1, 2, 4))
+        self.assertEqual(histogram.quantile(0.5), None)
+
+        for i in range(10):
+            histogram.observe(1.5)
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        for i in range(10):
+            histogram.observe(0.5)
+        self.assertEqual(histogram.quantile(0.25), 0.5)
+        self.assertEqual(histogram.quantile(0.75), 1.5)
+
+        histogram.observe(100)
+        self.assertEqual(histogram.quantile(1), 100)
+
+        summary = histogram.summary()
+        self.assertEqual(sorted(summary), ['count', 'max', 'mean', 'p50',
+                                           'p95', 'p99'])
+        self.assertEqual(summary['count'], 21)
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.metrics = Metrics((0.1, 1))
+        self.metrics.request_started(10)
+        self.metrics.request_finished('GET /', 200, 0.05)
+        self.metrics.request_started()
+        self.metrics.request_finished('GET /', 500, 0.5)
+        self.metrics.request_started()
+        self.metrics.add_bytes_out(100)
+
+        with self.metrics.time_command('a'):
+            pass
+        try:
+            with self.metrics.time_command('a'):
+                raise ValueError()
+        except ValueError:
+            pass
+        with self.metrics.time_command('b') as timer:
+            timer.failed = True
+
+        self.metrics.add_gauge('queued', 'Things queued.', lambda: 3)
+
+    def test_to_dict(self):
+        """Metrics are summarized by route and command"""
+        obs = self.metrics.to_dict()
+        route = obs['requests']['GET /']
+        self.assertEqual(route['count'], 2)
+        self.assertEqual(route['errors'], 1)
+        self.assertEqual(route['statuses'], {'200': 1, '500': 1})
+        self.assertEqual(route['latency']['max'], 0.5)
+
+        self.assertEqual(obs['commands']['a']['count'], 2)
+        self.assertEqual(obs['commands']['a']['errors'], 1)
+        self.assertEqual(obs['commands']['a']['in_flight'], 0)
+        self.assertEqual(obs['commands']['b']['errors'], 1)
+
+        self.assertEqual(obs['requests_in_flight'], 1)
+        self.assertEqual(obs['bytes_in'], 10)
+        self.assertEqual(obs['bytes_out'], 100)
+        self.assertEqual(obs['gauges'], {'queued': 3})
+
+    def test_prometheus(self):
+        """Metrics are written in the Prometheus text format"""
+        lines = self.metrics.prometheus().splitlines()
+        for line in [
+                '# TYPE pyqi_http_requests_total counter',
+                'pyqi_http_requests_total{route="GET /",status="200"} 1',
+                'pyqi_http_request_errors_total{route="GET /"} 1',
+                '# TYPE pyqi_http_request_duration_seconds histogram',
+                'pyqi_http_request_duration_seconds_bucket{route="GET /",'
+                'le="0.1"} 1',
+                'pyqi_http_request_duration_seconds_bucket{route="GET /",'
+                'le="1"} 2',
+                'pyqi_http_request_duration_seconds_bucket{route="GET /",'
+                'le="+Inf"} 2',
+                'pyqi_http_request_duration_seconds_count{route="GET /"} 2',
+                'pyqi_http_requests_in_flight 1',
+                'pyqi_http_sent_bytes_total 100',
+                'pyqi_command_calls_total{command="a",outcome="error"} 1',
+                'pyqi_command_calls_total{command="a",outcome="ok"} 1',
+                'pyqi_commands_in_flight{command="b"} 0',
+                '# TYPE queued gauge',
+                'queued 3']:
+            self.assertTrue(line in lines, line)
+
+    def test_label_escaping(self):
+        metrics = Metrics()
+        metrics.request_started()
+        metrics.request_finished('GET /"a"\\', None, 0)
+        self.assertTrue('pyqi_http_requests_total{route="GET /\\"a\\"\\\\",'
+                        'status="none"} 1' in metrics.prometheus())
+
+    def test_counted(self):
+        """The length of the pieces is reported once they're consumed"""
+        totals = []
+        self.assertEqual(list(counted([b'ab', b'c'], totals.append)),
+                         [b'ab', b'c'])
+        self.assertEqual(totals, [3])
+
+        pieces = counted(iter([b'ab', b'c']), totals.append)
+        next(pieces)
+        pieces.close()
+        self.assertEqual(totals, [3, 2])
+
+if __name__ == '__main__':
+    main()
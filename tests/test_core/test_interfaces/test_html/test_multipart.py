@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import os
+from io import BytesIO
+from unittest import TestCase, main
+
+import pyqi.core.interfaces.html.multipart as multipart
+from pyqi.core.interfaces.html.multipart import (FormParser, FormError,
+        LengthRequiredError, RequestTooLargeError, parse_header)
+
+BOUNDARY = 'xYzZY'
+CONTENT_TYPE = 'multipart/form-data; boundary=%s' % BOUNDARY
+
+def make_body(fields, preamble=b''):
+    """Build a multipart body from (name, value, filename) tuples"""
+    body = [preamble]
+    for name, value, filename in fields:
+        body.append(b'--' + BOUNDARY.encode('ascii') + b'\r\n')
+        if filename is None:
+            body.append(('Content-Disposition: form-data; name="%s"\r\n\r\n'
+                         % name).encode('ascii'))
+        else:
+            body.append(('Content-Disposition: form-data; name="%s"; '
+                         'filename="%s"\r\nContent-Type: text/plain\r\n\r\n'
+                         % (name, filename)).encode('ascii'))
+        body.append(value + b'\r\n')
+    body.append(b'--' + BOUNDARY.encode('ascii') + b'--\r\n')
+    return b''.join(body)
+
+class FormParserTests(TestCase):
+    def setUp(self):
+        self.forms = []
+        self.chunk_size = multipart.READ_CHUNK_SIZE
+
+    def tearDown(self):
+        multipart.READ_CHUNK_SIZE = self.chunk_size
+        for form in self.forms:
+            form.close()
+
+    def parse(self, body, parser=None, content_type=CONTENT_TYPE,
+              content_length=None):
+        if parser is None:
+            parser = FormParser()
+        if content_length is None:
+            content_length = str(len(body))
+        form = parser.parse(BytesIO(body), content_type, content_length)
+        self.forms.append(form)
+        return form
+
+    def test_fields(self):
+        """Ordinary fields are parsed as strings"""
+        body = make_body([('pyqi_a', b'1', None), ('pyqi_b', b'', None),
+                          ('pyqi_c', b'line 1\r\nline 2', None)],
+                         preamble=b'ignored\r\n')
+        form = self.parse(body)
+
+        self.assertEqual(form.keys(), ['pyqi_a', 'pyqi_b', 'pyqi_c'])
+        self.assertEqual(form['pyqi_a'].value, '1')
+        self.assertEqual(form['pyqi_b'].value, '')
+        self.assertEqual(form['pyqi_b'].size, 0)
+        self.assertEqual(form['pyqi_c'].value, 'line 1\r\nline 2')
+        self.assertFalse(form['pyqi_a'].is_file)
+        self.assertTrue('pyqi_a' in form)
+        self.assertFalse('pyqi_d' in form)
+
+    def test_repeated_fields(self):
+        """All fields with a name are kept, in order"""
+        form = self.parse(make_body([('a', b'1', None), ('a', b'2', None)]))
+        self.assertEqual(form['a'].value, '1')
+        self.assertEqual([f.value for f in form.getlist('a')], ['1', '2'])
+
+    def test_file(self):
+        """Uploads are available as bytes, a file object and a path"""
+        contents = b'--xYzZ\r\n' * 10
+        form = self.parse(make_body([('f', contents, 'in.txt')]))
+
+        field = form['f']
+        self.assertTrue(field.is_file)
+        self.assertEqual(field.filename, 'in.txt')
+        self.assertEqual(field.content_type, 'text/plain')
+        self.assertEqual(field.size, len(contents))
+        self.assertEqual(field.file.read(), contents)
+
+        path = field.filepath
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), contents)
+
+        form.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_spooling(self):
+        """Uploads larger than SpoolSize are written to disk as they arrive"""
+        multipart.READ_CHUNK_SIZE = 7
+        contents = os.urandom(1000)
+        form = self.parse(make_body([('f', contents, 'in.bin'),
+                                     ('a', b'x', None)]),
+                          parser=FormParser(SpoolSize=100))
+
+        field = form['f']
+        self.assertTrue(field._path is not None)
+        self.assertEqual(field.file.read(), contents)
+        self.assertEqual(form['a'].value, 'x')
+
+        path = field.filepath
+        form.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_small_chunks(self):
+        """Delimiters split across reads are found"""
+        multipart.READ_CHUNK_SIZE = 1
+        form = self.parse(make_body([('a', b'abc\r\n--xYz', None),
+                                     ('f', b'\r\n\r\n', 'f.txt')]))
+        self.assertEqual(form['a'].value, 'abc\r\n--xYz')
+        self.assertEqual(form['f'].value, b'\r\n\r\n')
+
+    def test_limits(self):
+        """Oversized requests, fields and files are refused"""
+        body = make_body([('a', b'12345', None), ('f', b'1234567', 'f')])
+
+        self.assertRaises(RequestTooLargeError, self.parse, body,
+                          FormParser(MaxRequestSize=len(body) - 1))
+        self.assertRaises(RequestTooLargeError, self.parse, body,
+                          FormParser(MaxFieldSize=4))
+        self.assertRaises(RequestTooLargeError, self.parse, body,
+                          FormParser(MaxFileSize=6))
+        self.assertRaises(RequestTooLargeError, self.parse, body,
+                          FormParser(MaxFields=1))
+
+        form = self.parse(body, FormParser(MaxRequestSize=len(body),
+                                           MaxFieldSize=5, MaxFileSize=7,
+                                           MaxFields=2))
+        self.assertEqual(form['f'].value, b'1234567')
+
+        self.assertRaises(TypeError, FormParser, MaxSize=1)
+
+    def test_malformed(self):
+        """Truncated and malformed bodies raise FormError"""
+        body = make_body([('a', b'1', None)])
+
+        self.assertRaises(FormError, self.parse, body[:-10])
+        self.assertRaises(FormError, self.parse, b'no boundary here')
+        self.assertRaises(FormError, self.parse, body,
+                          content_type='multipart/form-data')
+        self.assertRaises(FormError, self.parse, body,
+                          content_type='application/json')
+        self.assertRaises(FormError, self.parse, body, content_length='x')
+        self.assertRaises(LengthRequiredError, FormParser().parse,
+                          BytesIO(body), CONTENT_TYPE, None)
+
+        bad_part = body.replace(b'Content-Disposition', b'X-Header')
+        self.assertRaises(FormError, self.parse, bad_part)
+
+    def test_urlencoded(self):
+        """Urlencoded forms are parsed too"""
+        form = self.parse(b'a=1&b=&c=x+y%21',
+                          content_type='application/x-www-form-urlencoded')
+        self.assertEqual(form['a'].value, '1')
+        self.assertEqual(form['b'].size, 0)
+        self.assertEqual(form['c'].value, 'x y!')
+
+        self.assertRaises(RequestTooLargeError, self.parse, b'a=12345',
+                          FormParser(MaxFieldSize=6),
+                          'application/x-www-form-urlencoded')
+
+    def test_parse_header(self):
+        """Header values are split into a value and parameters"""
+        self.assertEqual(parse_header('form-data; name="a"; filename="b c"'),
+                         ('form-data', {'name': 'a', 'filename': 'b c'}))
+        self.assertEqual(parse_header('Multipart/Form-Data; boundary=xyz'),
+                         ('multipart/form-data', {'boundary': 'xyz'}))
+        self.assertEqual(parse_header('form-data; name="a\\"b;c"'),
+                         ('form-data', {'name': 'a"b;c'}))
+        self.assertEqual(parse_header(''), ('', {}))
+
+if __name__ == '__main__':
+    main()
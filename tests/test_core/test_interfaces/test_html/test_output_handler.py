@@ -10,9 +10,12 @@
 
 __credits__ = ["Evan Bolyen"]
 
+import os
+from tempfile import mkstemp
 from unittest import TestCase, main
 from pyqi.core.interfaces.html.output_handler import (newline_list_of_strings,
-        html_list_of_strings)
+        html_list_of_strings, iter_newline_list_of_strings,
+        iter_html_list_of_strings, open_binary_file)
 
 class HTMLOutputHandlerTests(TestCase):
 
@@ -26,5 +29,32 @@ class HTMLOutputHandlerTests(TestCase):
         result = html_list_of_strings('foo', ['bar','bay','baz'])
         self.assertEqual(result, 'bar<br/>bay<br/>baz')
 
+    def test_iter_newline_list_of_strings(self):
+        """Lazily joins a list of strings with '\n'."""
+        result = iter_newline_list_of_strings('foo', iter(['bar','bay','baz']))
+        self.assertFalse(isinstance(result, (list, str)))
+        self.assertEqual(''.join(result), 'bar\nbay\nbaz')
+        self.assertEqual(list(iter_newline_list_of_strings('foo', [])), [])
+
+    def test_iter_html_list_of_strings(self):
+        """Lazily joins a list of strings with '<br/>'."""
+        result = iter_html_list_of_strings('foo', ['bar','bay','baz'])
+        self.assertEqual(''.join(result), 'bar<br/>bay<br/>baz')
+
+    def test_open_binary_file(self):
+        """Opens the file at the result's path in binary mode."""
+        fd, path = mkstemp()
+        try:
+            os.write(fd, b'abc\n')
+            os.close(fd)
+
+            f = open_binary_file('foo', path)
+            try:
+                self.assertEqual(f.read(), b'abc\n')
+            finally:
+                f.close()
+        finally:
+            os.remove(path)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import os
+import zlib
+from io import BytesIO
+from tempfile import mkstemp
+from unittest import TestCase, main
+
+from pyqi.core.interfaces.html.response import (StaticBody, accepts_gzip,
+        chunk_encode, close_body, file_length, gzip_bytes, gzip_pieces,
+        is_compressible, iter_body, SpooledBody)
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+class ResponseTests(TestCase):
+    def setUp(self):
+        fd, self.path = mkstemp()
+        os.write(fd, b'0123456789')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_iter_body_text(self):
+        """Strings are sent whole, as bytes"""
+        self.assertEqual(list(iter_body('abc')), [b'abc'])
+        self.assertEqual(list(iter_body(b'abc')), [b'abc'])
+
+    def test_iter_body_iterable(self):
+        """Small strings are combined into pieces of at least buffer_size"""
+        pieces = list(iter_body(iter(['ab', '', 'c', b'de', 'f']), 3))
+        self.assertEqual(pieces, [b'abc', b'def'])
+
+        pieces = list(iter_body(['abcd', 'e'], 3))
+        self.assertEqual(pieces, [b'abcd', b'e'])
+        self.assertEqual(list(iter_body([], 3)), [])
+
+    def test_iter_body_file(self):
+        """Files are read in pieces of buffer_size"""
+        self.assertEqual(list(iter_body(BytesIO(b'abcdefg'), 3)),
+                         [b'abc', b'def', b'g'])
+
+    def test_chunk_encode(self):
+        """Pieces are framed as chunks, ending with an empty chunk"""
+        self.assertEqual(b''.join(chunk_encode([b'abc', b'', b'0123456789a'])),
+                         b'3\r\nabc\r\nb\r\n0123456789a\r\n0\r\n\r\n')
+        self.assertEqual(b''.join(chunk_encode([])), b'0\r\n\r\n')
+
+    def test_file_length(self):
+        """Only regular files opened in binary mode have a known length"""
+        with open(self.path, 'rb') as f:
+            self.assertEqual(file_length(f), 10)
+            f.read(4)
+            self.assertEqual(file_length(f), 6)
+
+        with open(self.path) as f:
+            self.assertEqual(file_length(f), None)
+
+        self.assertEqual(file_length(BytesIO(b'abc')), None)
+
+    def test_close_body(self):
+        """Files are closed, strings are left alone"""
+        f = open(self.path, 'rb')
+        close_body(f)
+        self.assertTrue(f.closed)
+        close_body('abc')
+
+    def test_accepts_gzip(self):
+        """gzip is accepted unless it is missing or has a q of 0"""
+        self.assertTrue(accepts_gzip('gzip'))
+        self.assertTrue(accepts_gzip('deflate, gzip;q=0.5'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('deflate'))
+        self.assertFalse(accepts_gzip(''))
+        self.assertFalse(accepts_gzip(None))
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible('text/html'))
+        self.assertTrue(is_compressible('text/css; charset=utf-8'))
+        self.assertTrue(is_compressible('application/json'))
+        self.assertFalse(is_compressible('application/octet-stream'))
+        self.assertFalse(is_compressible('image/png'))
+
+    def test_gzip(self):
+        """Whole and streamed bodies are gzipped"""
+        self.assertEqual(gunzip(gzip_bytes(b'abc' * 100)), b'abc' * 100)
+        self.assertEqual(gunzip(b''.join(gzip_pieces([b'abc', b'def']))),
+                         b'abcdef')
+
+    def test_static_body(self):
+        """Static bodies are compressed once and matched by ETag"""
+        static = StaticBody('x' * 1000, 'text/css')
+        self.assertEqual(static.body, b'x' * 1000)
+        self.assertEqual(gunzip(static.gzipped), static.body)
+        self.assertTrue(static.matches(static.etag))
+        self.assertTrue(static.matches('"a", %s' % static.etag))
+        self.assertTrue(static.matches('*'))
+        self.assertFalse(static.matches('"a"'))
+        self.assertFalse(static.matches(None))
+
+        self.assertEqual(StaticBody('small').gzipped, None)
+        self.assertEqual(StaticBody('x' * 1000, 'image/png').gzipped, None)
+
+    def test_spooled_body(self):
+        """Streams are saved so they can be sent more than once"""
+        spooled = SpooledBody(iter(['abc', b'def']))
+        for i in range(2):
+            f = spooled.open()
+            self.assertEqual(f.read(), b'abcdef')
+            f.close()
+
+        spooled.remove()
+        self.assertFalse(os.path.exists(spooled.path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import gc
+import os
+import socket
+import sys
+from threading import Event, Thread
+from unittest import TestCase, main
+
+from pyqi.util import is_py2
+if is_py2():
+    from BaseHTTPServer import BaseHTTPRequestHandler
+else:
+    from http.server import BaseHTTPRequestHandler
+
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.interfaces.html.server import (PooledHTTPServer,
+        PreforkServer, PyqiHTTPServer, RouteTimings, WorkerStartupError,
+        worker_memory)
+
+class BlockingHandler(BaseHTTPRequestHandler):
+    """Blocks every request until ``release`` is set"""
+    arrived = None
+    release = None
+
+    def do_GET(self):
+        self.arrived.put(self.path)
+        self.release.wait()
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(self.path.encode('ascii'))
+
+    def log_message(self, *args):
+        pass
+
+def get(port, path):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        sock.sendall(('GET %s HTTP/1.0\r\n\r\n' % path).encode('ascii'))
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+    finally:
+        sock.close()
+    return response
+
+class PooledHTTPServerTests(TestCase):
+    def setUp(self):
+        if is_py2():
+            from Queue import Queue
+        else:
+            from queue import Queue
+
+        BlockingHandler.arrived = Queue()
+        BlockingHandler.release = Event()
+        self.server = PooledHTTPServer(('127.0.0.1', 0), BlockingHandler,
+                                       workers=2)
+        self.port = self.server.server_address[1]
+        self.serving = Thread(target=self.server.serve_forever)
+        self.serving.daemon = True
+        self.serving.start()
+
+    def tearDown(self):
+        BlockingHandler.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_requests(self):
+        """Requests are handled concurrently, up to the number of workers"""
+        responses = {}
+        def fetch(path):
+            responses[path] = get(self.port, path)
+
+        clients = [Thread(target=fetch, args=(p,)) for p in ('/a', '/b')]
+        for client in clients:
+            client.start()
+
+        # Both requests are being handled at the same time.
+        arrived = set([BlockingHandler.arrived.get(timeout=5),
+                       BlockingHandler.arrived.get(timeout=5)])
+        self.assertEqual(arrived, set(['/a', '/b']))
+
+        BlockingHandler.release.set()
+        for client in clients:
+            client.join(5)
+
+        self.assertTrue(responses['/a'].startswith(b'HTTP/1.0 200'))
+        self.assertTrue(responses['/a'].endswith(b'/a'))
+        self.assertTrue(responses['/b'].endswith(b'/b'))
+
+    def test_no_workers(self):
+        """A pool needs at least one worker"""
+        self.assertRaises(IncompetentDeveloperError, PooledHTTPServer,
+                          ('127.0.0.1', 0), BlockingHandler, 0)
+
+class PidHandler(BaseHTTPRequestHandler):
+    """Responds with the pid of the worker, and keeps ``grow`` bytes"""
+    grow = 0
+    kept = []
+
+    def do_GET(self):
+        self.kept.append(b'x' * self.grow)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(str(os.getpid()).encode('ascii'))
+
+    def log_message(self, *args):
+        pass
+
+class PreforkServerTests(TestCase):
+    def setUp(self):
+        self.http_server = PyqiHTTPServer(('127.0.0.1', 0), PidHandler)
+        self.port = self.http_server.server_address[1]
+        self.server = None
+
+    def start(self, **kwargs):
+        self.server = PreforkServer(self.http_server, 1, **kwargs)
+        self.serve()
+
+    def serve(self):
+        self.serving = Thread(target=self.server.serve_forever)
+        self.serving.daemon = True
+        self.serving.start()
+
+    def tearDown(self):
+        PidHandler.grow = 0
+        if self.server is None:
+            self.http_server.server_close()
+        else:
+            self.server.shutdown()
+            self.serving.join(10)
+
+    def pids(self, count):
+        pids = []
+        for i in range(count):
+            response = get(self.port, '/')
+            pids.append(int(response.split(b'\r\n\r\n', 1)[1]))
+        return pids
+
+    def test_max_requests(self):
+        """Workers are replaced after max_requests requests"""
+        self.start(max_requests=2)
+        pids = self.pids(6)
+        self.assertTrue(os.getpid() not in pids)
+        self.assertEqual([pids.count(pid) for pid in pids], [2] * 6)
+        self.assertEqual(len(set(pids)), 3)
+
+    def test_max_memory(self):
+        """Workers are replaced once they grow by more than max_memory"""
+        PidHandler.grow = 8 * 1024 * 1024
+        self.server = PreforkServer(self.http_server, 1,
+                                    max_memory=4 * 1024 * 1024)
+        # Read by the worker once it is forked.
+        self.server.MemoryCheckInterval = 0
+        self.serve()
+        pids = self.pids(3)
+        self.assertEqual(len(set(pids)), 3)
+
+    def test_no_limits(self):
+        self.start()
+        self.assertEqual(len(set(self.pids(3))), 1)
+
+    def test_startup_failures(self):
+        """The server stops once workers keep failing to start"""
+        def fail(*args, **kwargs):
+            raise ValueError("can't start")
+        self.http_server.serve_forever = fail
+
+        server = PreforkServer(self.http_server, 2)
+        server.RespawnDelay = 0.01
+        server.MaxStartupFailures = 3
+        excepthook = sys.excepthook
+        sys.excepthook = lambda *args: None
+        try:
+            self.assertRaises(WorkerStartupError, server.serve_forever)
+        finally:
+            sys.excepthook = excepthook
+        self.assertEqual(server._children, {})
+        self.assertTrue(gc.isenabled())
+
+    def test_init(self):
+        self.assertRaises(IncompetentDeveloperError, PreforkServer,
+                          self.http_server, 1, 0)
+        self.assertRaises(IncompetentDeveloperError, PreforkServer,
+                          self.http_server, 1, None, 0)
+
+    def test_worker_memory(self):
+        self.assertTrue(worker_memory() > 0)
+
+class RouteTimingsTests(TestCase):
+    def test_record(self):
+        """Counts, totals and maxima are kept per route"""
+        timings = RouteTimings()
+        timings.record('GET /a', 0.5)
+        timings.record('GET /a', 1.5)
+        timings.record('POST /a', 0.25)
+
+        self.assertEqual(timings.snapshot(), {'GET /a': (2, 2.0, 1.5),
+                                              'POST /a': (1, 0.25, 0.25)})
+
+    def test_report(self):
+        """The report has a line per route, sorted by route"""
+        timings = RouteTimings()
+        timings.record('POST /a', 0.25)
+        timings.record('GET /a', 0.5)
+
+        lines = timings.report().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(), ['GET', '/a', '1', '500.000',
+                                            '500.000'])
+        self.assertEqual(lines[2].split(), ['POST', '/a', '1', '250.000',
+                                            '250.000'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Evan Bolyen"]
+
+import json
+import zlib
+from io import BytesIO
+from unittest import TestCase, main
+from wsgiref.util import setup_testing_defaults
+from wsgiref.validate import validator
+
+from pyqi.core.interfaces.html import make_wsgi_app
+from pyqi.core.interfaces.html.wsgi import (EnvironHeaders, error_page,
+        status_line)
+
+class WSGITests(TestCase):
+    def setUp(self):
+        self.app = validator(make_wsgi_app('pyqi.interfaces.html.config'))
+
+    def call(self, path, method='GET', body=b'', content_type=None,
+             headers=()):
+        """Call the application, returning the status, headers and body"""
+        path, _, query = path.partition('?')
+        environ = {'REQUEST_METHOD': method, 'SCRIPT_NAME': '',
+                   'PATH_INFO': path,
+                   'QUERY_STRING': query, 'wsgi.input': BytesIO(body)}
+        if body:
+            environ['CONTENT_LENGTH'] = str(len(body))
+        if content_type is not None:
+            environ['CONTENT_TYPE'] = content_type
+        for name, value in headers:
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        setup_testing_defaults(environ)
+
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            result.close()
+        return response['status'], response['headers'], body
+
+    def test_pages(self):
+        """Pages are served as by the HTTP server"""
+        status, headers, body = self.call('/')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-type'], 'text/html')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assertTrue(b'make-command' in body)
+
+        status, headers, body = self.call('/make-command')
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(b'<form' in body)
+
+    def test_static(self):
+        """Static pages are gzipped and revalidated"""
+        status, headers, body = self.call('/static/pyqi.css',
+                                          headers=[('Accept-Encoding',
+                                                    'gzip')])
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertTrue(zlib.decompress(body, 16 + zlib.MAX_WBITS))
+
+        status, _, body = self.call('/static/pyqi.css',
+                                    headers=[('If-None-Match',
+                                              headers['ETag'])])
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(body, b'')
+
+    def test_form_post(self):
+        """Posted forms run the command"""
+        body = ''.join('--xYzZY\r\nContent-Disposition: form-data; '
+                       'name="%s"\r\n\r\n%s\r\n' % field for field in
+                       [('pyqi_name', 'foo'),
+                        ('pyqi_command_class_name', 'Foo'),
+                        ('pyqi_author', 'me'), ('pyqi_email', 'a@b'),
+                        ('pyqi_download-file', 'out')]) + '--xYzZY--\r\n'
+        status, headers, body = self.call(
+            '/make-command', 'POST', body.encode('ascii'),
+            'multipart/form-data; boundary=xYzZY')
+        self.assertEqual(status, '200 OK')
+        self.assertTrue('attachment' in headers['Content-disposition'])
+        self.assertTrue(b'__author__ = "me"' in body)
+
+    def test_api(self):
+        """The JSON API is served too"""
+        inputs = {'name': 'foo', 'author': 'me', 'email': 'a@b'}
+        status, _, body = self.call('/api/make-command', 'POST',
+                                    json.dumps(inputs).encode('ascii'),
+                                    'application/json')
+        self.assertEqual(status, '200 OK')
+        obs = json.loads(body.decode('utf-8'))
+        self.assertTrue('__author__ = "me"' in obs['result']['result'])
+
+        status, _, _ = self.call('/api/make-command', 'POST', b'{',
+                                 'application/json')
+        self.assertEqual(status, '400 Bad Request')
+
+    def test_errors(self):
+        """Unknown routes and methods get error pages"""
+        status, headers, body = self.call('/nope')
+        self.assertEqual(status, '404 Not Found')
+        self.assertEqual(headers['Content-type'], 'text/html')
+
+        status, _, _ = self.call('/', method='DELETE')
+        self.assertEqual(status, '501 Not Implemented')
+
+class HelperTests(TestCase):
+    def test_environ_headers(self):
+        """Headers are looked up in the environ by name"""
+        headers = EnvironHeaders({'CONTENT_TYPE': 'text/plain',
+                                  'CONTENT_LENGTH': '',
+                                  'HTTP_ACCEPT_ENCODING': 'gzip'})
+        self.assertEqual(headers.get('Content-Type'), 'text/plain')
+        self.assertEqual(headers['accept-encoding'], 'gzip')
+        self.assertEqual(headers.get('Content-Length', 0), 0)
+        self.assertFalse('If-None-Match' in headers)
+
+    def test_status_line(self):
+        self.assertEqual(status_line(200), '200 OK')
+        self.assertEqual(status_line(413), '413 Request Entity Too Large')
+        self.assertEqual(status_line(599), '599 Unknown')
+
+    def test_error_page(self):
+        self.assertTrue('<h1>404 Not Found</h1>' in error_page(404))
+        self.assertTrue('a &lt;b&gt;' in error_page(400, 'a <b>'))
+
+if __name__ == '__main__':
+    main()
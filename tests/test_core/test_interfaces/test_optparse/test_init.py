@@ -26,12 +26,16 @@ from pyqi.core.interfaces.optparse import (OptparseResult, OptparseOption,
                                            check_existing_path, check_new_path,
                                            check_multiple_choice,
                                            check_blast_db)
+from pyqi.core.interfaces.optparse.input_handler import iter_file_lines
 from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.factory import FACTORY_CACHE_SIZE, _factory_cache
 from pyqi.core.command import (Command, CommandIn, CommandOut,
                                ParameterCollection, Parameter)
+from multiprocessing.pool import ThreadPool
+from threading import Event
 from tempfile import mkstemp, mkdtemp
-from os import remove, rmdir
-from os.path import commonprefix
+from os import chdir, close, getcwd, remove, rmdir
+from os.path import commonprefix, join
 
 class OptparseResultTests(TestCase):
     # Nothing to test yet
@@ -68,6 +72,18 @@ class OptparseOptionTests(TestCase):
         obs = str(self.opt2)
         self.assertEqual(obs, exp)
 
+    def test_choices(self):
+        """Values outside of Choices are rejected by the parser"""
+        p = CommandIn('mode', str, 'some mode', Required=False,
+                      Default='fast')
+        opt = OptparseOption(Parameter=p, Type='choice',
+                             Choices=('fast', 'slow'))
+        option = opt.getOptparseOption()
+        self.assertEqual(option.choices, ['fast', 'slow'])
+        self.assertEqual(option.check_value('--mode', 'slow'), 'slow')
+        self.assertRaises(OptionValueError, option.check_value, '--mode',
+                          'medium')
+
 class OptparseUsageExampleTests(TestCase):
     def test_init(self):
         obj = OptparseUsageExample(ShortDesc='a', LongDesc='b', Ex='c')
@@ -98,10 +114,133 @@ class OptparseInterfaceTests(TestCase):
         with self.assertRaises(IncompetentDeveloperError):
             _ = DuplicateOptionMappings()
 
+    def test_validate_iterable_inputs(self):
+        with self.assertRaises(IncompetentDeveloperError):
+            _ = IterableHandlerMapping()
+
+        # fine if the CommandIn accepts an iterable
+        _ = optparse_factory(lazy_ghetto, [OptparseUsageExample('a','b','c')],
+                [OptparseOption(Type='existing_filepath',
+                                Parameter=lazy_ghetto.CommandIns['c'],
+                                Handler=iter_file_lines)],
+                [], '2.0-dev')()
+
     def test_input_handler(self):
         obs = self.interface._input_handler(['--c','foo'])
         self.assertEqual(list(obs.items()), [('c', 'foo')])
 
+    def test_input_handler_reuses_parser(self):
+        """The parser is built once per class and shared by instances."""
+        obs1 = self.interface._input_handler(['--c', 'foo'])
+        obs2 = fabulous()._input_handler(['--c', 'bar'])
+        self.assertEqual(obs1, {'c': 'foo'})
+        self.assertEqual(obs2, {'c': 'bar'})
+
+        parser = fabulous.__dict__['_cached_parser']
+        self.assertTrue(fabulous()._get_cached_parser() is parser)
+
+        # Subclasses don't pick up the parser cached for their base class.
+        self.assertTrue(NoUsageExamples.__dict__.get('_cached_parser') is
+                        None)
+
+    def test_input_handler_concurrent(self):
+        """Concurrent calls to a shared instance parse independently."""
+        values = ['value%d' % i for i in range(50)]
+        obs = ThreadPool(8).map(
+                lambda v: self.interface._input_handler(['--c', v])['c'],
+                values)
+        self.assertEqual(obs, values)
+
+    def test_call_concurrent(self):
+        """Per-call state doesn't leak between concurrent calls."""
+        interface = EchoesInput()
+        values = ['value%d' % i for i in range(50)]
+        obs = ThreadPool(8).map(
+                lambda v: interface(['--c', v])['itsaresult'], values)
+        self.assertEqual(obs, values)
+
+    def test_input_handler_response_files(self):
+        """@file arguments are replaced by the arguments in the file."""
+        tmp_f, tmp_path = mkstemp()
+        close(tmp_f)
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write('--c\nfrom file\n')
+
+            obs = self.interface._input_handler(['@' + tmp_path])
+            self.assertEqual(obs, {'c': 'from file'})
+
+            # Option values are left to the option's type checker.
+            obs = self.interface._input_handler(['--c', '@' + tmp_path])
+            self.assertEqual(obs, {'c': '@' + tmp_path})
+            obs = self.interface._input_handler(['--c=@' + tmp_path])
+            self.assertEqual(obs, {'c': '@' + tmp_path})
+        finally:
+            remove(tmp_path)
+
+    def test_input_handler_response_file_prefix(self):
+        """List values use the interface's ResponseFilePrefix."""
+        tmp_dir = mkdtemp()
+        saved_cwd = getcwd()
+        try:
+            chdir(tmp_dir)
+            with open('@paths.txt', 'w') as f:
+                f.write('@paths.txt\n')
+
+            obs = ListInput()._input_handler(['--c', '@@paths.txt'])
+            self.assertEqual(obs, {'c': ['@paths.txt']})
+
+            # The prefix can be changed...
+            obs = PlusResponseFiles()._input_handler(['--c', '+@paths.txt'])
+            self.assertEqual(obs, {'c': ['@paths.txt']})
+
+            # ... or response files disabled, so paths can start with '@'.
+            obs = NoResponseFiles()._input_handler(['--c', '@paths.txt'])
+            self.assertEqual(obs, {'c': ['@paths.txt']})
+        finally:
+            chdir(saved_cwd)
+            remove(join(tmp_dir, '@paths.txt'))
+            rmdir(tmp_dir)
+
+    def test_output_handler_concurrent(self):
+        """Output handlers can overlap when OutputHandlerThreads > 1."""
+        both_started = Event()
+
+        def waits_oh(key, data, opt_value=None):
+            # Only returns True if the other handler runs at the same time.
+            return both_started.wait(5)
+
+        def signals_oh(key, data, opt_value=None):
+            both_started.set()
+            return data
+
+        interface = optparse_factory(two_outs, [OptparseUsageExample('a','b','c')],
+                [],
+                [OptparseResult(Parameter=two_outs.CommandOuts['waits'],
+                                Handler=waits_oh),
+                 OptparseResult(Parameter=two_outs.CommandOuts['signals'],
+                                Handler=signals_oh)],
+                '2.0-dev', output_handler_threads=2)()
+
+        obs = interface._output_handler({'waits': 1, 'signals': 2})
+        self.assertEqual(obs, {'waits': True, 'signals': 2})
+
+    def test_output_handler_concurrent_errors(self):
+        """Errors in concurrently run output handlers are propagated."""
+        def bad_oh(key, data, opt_value=None):
+            raise ValueError(key)
+
+        interface = optparse_factory(two_outs, [OptparseUsageExample('a','b','c')],
+                [],
+                [OptparseResult(Parameter=two_outs.CommandOuts['waits'],
+                                Handler=oh),
+                 OptparseResult(Parameter=two_outs.CommandOuts['signals'],
+                                Handler=bad_oh)],
+                '2.0-dev', output_handler_threads=2)()
+
+        with self.assertRaises(ValueError):
+            interface._output_handler({'waits': 1, 'signals': 2})
+
     def test_build_usage_lines(self):
         obs = self.interface._build_usage_lines([])
         self.assertEqual(obs, usage_lines)
@@ -127,6 +266,54 @@ class GeneralTests(TestCase):
         # exercise it
         _ = self.obj()
 
+    def test_optparse_factory_memoized(self):
+        """The factory returns the same class for the same config."""
+        usage_examples = [OptparseUsageExample('a','b','c')]
+        inputs = [OptparseOption(Type=str, Parameter=ghetto.CommandIns['c'])]
+        outputs = [OptparseResult(Type=str,
+                                  Parameter=ghetto.CommandOuts['itsaresult'],
+                                  Handler=oh)]
+
+        cls1 = optparse_factory(ghetto, usage_examples, inputs, outputs,
+                                '2.0-dev')
+        cls2 = optparse_factory(ghetto, usage_examples, inputs, outputs,
+                                '2.0-dev')
+        self.assertTrue(cls1 is cls2)
+
+        cls3 = optparse_factory(ghetto, usage_examples, inputs, outputs,
+                                '2.1-dev')
+        self.assertFalse(cls1 is cls3)
+
+        cls4 = optparse_factory(ghetto, usage_examples, list(inputs), outputs,
+                                '2.0-dev')
+        self.assertFalse(cls1 is cls4)
+
+        # Attributes set on the class are part of the key.
+        cls5 = optparse_factory(ghetto, usage_examples, inputs, outputs,
+                                '2.0-dev', output_handler_threads=2)
+        self.assertFalse(cls1 is cls5)
+        self.assertEqual(cls5.OutputHandlerThreads, 2)
+        self.assertEqual(cls1.OutputHandlerThreads, 1)
+
+    def test_optparse_factory_bounded(self):
+        """Only the most recently used classes are kept."""
+        outputs = [OptparseResult(Type=str,
+                                  Parameter=ghetto.CommandOuts['itsaresult'],
+                                  Handler=oh)]
+        for i in range(FACTORY_CACHE_SIZE + 10):
+            optparse_factory(ghetto, [], [], outputs, '2.0-dev')
+        self.assertEqual(len(_factory_cache), FACTORY_CACHE_SIZE)
+
+    def test_validation_cached(self):
+        """Config validation only runs on the first instantiation."""
+        _ = self.obj()
+        self.assertTrue(self.obj.__dict__['_config_validated'])
+
+        # Invalid configs are validated (and fail) every time.
+        for i in range(2):
+            with self.assertRaises(IncompetentDeveloperError):
+                _ = optparse_factory(ghetto, [], [], [], '2.0-dev')()
+
     def test_optparse_main(self):
         # exercise it
         _ = optparse_main(self.obj, ['testing', '--c', 'bar'])
@@ -138,6 +325,14 @@ class ghetto(Command):
     def run(self, **kwargs):
         return {'itsaresult':10}
 
+class two_outs(Command):
+    CommandOuts = ParameterCollection([CommandOut('waits', int, 'x'),
+                                       CommandOut('signals', int, 'y')])
+
+class lazy_ghetto(ghetto):
+    CommandIns = ParameterCollection([CommandIn('c', list, 'b',
+                                                AcceptsIterable=True)])
+
 class fabulous(OptparseInterface):
     CommandConstructor = ghetto
 
@@ -155,6 +350,33 @@ class fabulous(OptparseInterface):
     def _get_version(self):
         return '2.0-dev'
 
+def echo_oh(key, data, opt_value=None):
+    return opt_value
+
+# Has an output linked to an input...
+class EchoesInput(fabulous):
+    def _get_outputs(self):
+        return [OptparseResult(Parameter=ghetto.CommandOuts['itsaresult'],
+                               Handler=echo_oh, InputName='c')]
+
+# Takes a list of existing filepaths...
+class ListInput(fabulous):
+    def _get_inputs(self):
+        return [OptparseOption(Type='existing_filepaths',
+                Parameter=self.CommandConstructor.CommandIns['c'])]
+
+class PlusResponseFiles(ListInput):
+    ResponseFilePrefix = '+'
+
+class NoResponseFiles(ListInput):
+    ResponseFilePrefix = None
+
+# An iterable handler mapping to a CommandIn that doesn't accept one...
+class IterableHandlerMapping(fabulous):
+    def _get_inputs(self):
+        return [OptparseOption(Type=str, Handler=iter_file_lines,
+            Parameter=self.CommandConstructor.CommandIns['c'])]
+
 # Doesn't have any usage examples...
 class NoUsageExamples(fabulous):
     def _get_usage_examples(self):
@@ -189,6 +411,9 @@ class TypeCheckTests(TestCase):
         option = PyqiOption('-f', '--file_test', type='existing_filepath')
         obs = check_existing_filepath(option, '-f', tmp_path)
         self.assertEqual(obs, tmp_path)
+        # Check that '-' (stdin) is accepted
+        obs = check_existing_filepath(option, '-f', '-')
+        self.assertEqual(obs, '-')
         # Check that raises an error when the file doesn't exists
         self.assertRaises(OptionValueError, check_existing_filepath, option,
             '-f', '/hopefully/a/non/existing/file')
@@ -214,6 +439,18 @@ class TypeCheckTests(TestCase):
         value = commonprefix(exp) + '*'
         obs = check_existing_filepaths(option, '-f', value)
         self.assertEqual(set(obs), set(exp))
+        # Check that paths can be read from a response file
+        tmp_f3, tmp_path3 = mkstemp(prefix='pyqi_tmp_testf')
+        self._paths_to_clean_up.append(tmp_path3)
+        with open(tmp_path3, 'w') as f:
+            f.write('\n'.join(exp))
+        obs = check_existing_filepaths(option, '-f', '@' + tmp_path3)
+        self.assertEqual(obs, exp)
+        # ... also when the checker isn't called with a PyqiOption
+        obs = check_existing_filepaths(None, '-f', '@' + tmp_path3)
+        self.assertEqual(obs, exp)
+        self.assertRaises(OptionValueError, check_existing_filepaths, option,
+            '-f', '@/hopefully/a/non/existing/file')
         # Check that raises an error when the wildcard does not match any file
         self.assertRaises(OptionValueError, check_existing_filepaths, option,
             '-f', '/hopefully/a/non/existing/path*')
@@ -255,6 +492,8 @@ class TypeCheckTests(TestCase):
         value = ",".join(exp)
         obs = check_existing_dirpaths(option, '-d', value)
         self.assertEqual(obs, exp)
+        obs = check_existing_dirpaths(None, '-d', value)
+        self.assertEqual(obs, exp)
         # Check that returns a list with the paths when using wildcars
         # note that the order is not important now
         value = commonprefix(exp) + '*'
@@ -281,6 +520,9 @@ class TypeCheckTests(TestCase):
         exp = '/hopefully/a/non/existing/file'
         obs = check_new_filepath(option, '-n', exp)
         self.assertEqual(obs, exp)
+        # Check that '-' (stdout) is accepted
+        obs = check_new_filepath(option, '-n', '-')
+        self.assertEqual(obs, '-')
         # Check that it doesn't raise an error if the path exists and is a file
         tmp_f, tmp_path = mkstemp()
         self._paths_to_clean_up = [tmp_path]
@@ -11,19 +11,75 @@
 __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout"]
 
+import os
+import sys
+from io import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from types import GeneratorType
 from unittest import TestCase, main
-from pyqi.core.interfaces.optparse.input_handler import command_handler
+import pyqi.core.interfaces.optparse.input_handler as input_handler
+from pyqi.core.interfaces.optparse.input_handler import (command_handler,
+        iter_file_lines, iter_file_chunks, file_reading_handler,
+        load_file_lines, load_file_contents)
 from pyqi.commands.make_optparse import MakeOptparse
 
 class OptparseInputHandlerTests(TestCase):
     def setUp(self):
-        pass
+        self.output_dir = mkdtemp()
+        self.fp = os.path.join(self.output_dir, 'test_file.txt')
+        with open(self.fp, 'w') as f:
+            f.write("This is line 1\n This is line 2\nThis is line 3 \n")
+
+    def tearDown(self):
+        rmtree(self.output_dir)
 
     def test_command_handler(self):
         exp = MakeOptparse()
         obs = command_handler('pyqi.commands.make_optparse.MakeOptparse')
         self.assertEqual(type(obs), type(exp))
 
+    def test_iter_file_lines(self):
+        """Lazily returns stripped file lines"""
+        self.assertEqual(iter_file_lines(None), None)
+
+        obs = iter_file_lines(self.fp)
+        self.assertTrue(isinstance(obs, GeneratorType))
+        self.assertEqual(list(obs), ["This is line 1", "This is line 2",
+                                     "This is line 3"])
+        self.assertTrue(iter_file_lines.ReturnsIterable)
+
+    def test_iter_file_chunks(self):
+        """Lazily returns file contents in chunks"""
+        self.assertEqual(iter_file_chunks(None), None)
+
+        saved_size = input_handler.READ_BUFFER_SIZE
+        try:
+            input_handler.READ_BUFFER_SIZE = 10
+            obs = list(iter_file_chunks(self.fp))
+        finally:
+            input_handler.READ_BUFFER_SIZE = saved_size
+
+        self.assertEqual(obs, ["This is li", "ne 1\n This", " is line 2",
+                               "\nThis is l", "ine 3 \n"])
+    def test_stdin(self):
+        """A filepath of '-' reads from stdin"""
+        saved_stdin = sys.stdin
+        try:
+            sys.stdin = StringIO(u"a \nb\n")
+            self.assertEqual(load_file_lines('-'), ['a', 'b'])
+            self.assertFalse(sys.stdin.closed)
+
+            sys.stdin = StringIO(u"a \nb\n")
+            self.assertEqual(list(iter_file_lines('-')), ['a', 'b'])
+
+            sys.stdin = StringIO(u"a \nb\n")
+            self.assertEqual(load_file_contents('-'), "a \nb\n")
+
+            sys.stdin = StringIO(u"a \nb\n")
+            self.assertEqual(file_reading_handler('-').read(), "a \nb\n")
+        finally:
+            sys.stdin = saved_stdin
 
 if __name__ == '__main__':
     main()
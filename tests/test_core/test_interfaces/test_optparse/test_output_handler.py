@@ -21,9 +21,12 @@ if is_py2():
 else:
     from io import StringIO
 
+from io import BytesIO, TextIOWrapper
+
 from shutil import rmtree
 from tempfile import mkdtemp
 from unittest import TestCase, main
+import pyqi.core.interfaces.optparse.output_handler as output_handler
 from pyqi.core.interfaces.optparse.output_handler import (write_string,
         write_list_of_strings, print_list_of_strings)
 from pyqi.core.exception import IncompetentDeveloperError
@@ -47,6 +50,25 @@ class OutputHandlerTests(TestCase):
 
         self.assertEqual(obs, 'bar\n')
 
+    def test_write_string_stdout(self):
+        """Correctly writes a string to stdout when the filepath is '-'."""
+        saved_stdout = sys.stdout
+        try:
+            out = StringIO()
+            sys.stdout = out
+            write_string('foo', 'bar', '-')
+            self.assertEqual(out.getvalue(), 'bar\n')
+
+            # bytes go to the underlying binary buffer untouched
+            if not is_py2():
+                raw = BytesIO()
+                sys.stdout = TextIOWrapper(raw)
+                write_string('foo', b'\x00\xffbar\r\n', '-')
+                self.assertEqual(raw.getvalue(), b'\x00\xffbar\r\n\n')
+                self.assertFalse(sys.stdout.closed)
+        finally:
+            sys.stdout = saved_stdout
+
     def test_write_list_of_strings(self):
         """Correctly writes a list of strings to file."""
         # can't write without a path
@@ -59,6 +81,39 @@ class OutputHandlerTests(TestCase):
 
         self.assertEqual(obs, 'bar\nbaz\n')
 
+    def test_write_list_of_strings_iterable(self):
+        """Correctly writes an iterator of strings spanning many chunks."""
+        saved_chunk_lines = output_handler.WRITE_CHUNK_LINES
+        try:
+            output_handler.WRITE_CHUNK_LINES = 3
+            write_list_of_strings('foo', ('line%d' % i for i in range(10)),
+                                  self.fp)
+        finally:
+            output_handler.WRITE_CHUNK_LINES = saved_chunk_lines
+
+        with open(self.fp) as obs_f:
+            obs = obs_f.read()
+
+        self.assertEqual(obs, ''.join('line%d\n' % i for i in range(10)))
+
+        # nothing to write
+        os.remove(self.fp)
+        write_list_of_strings('foo', iter([]), self.fp)
+        with open(self.fp) as obs_f:
+            self.assertEqual(obs_f.read(), '')
+
+    def test_write_list_of_strings_stdout(self):
+        """Correctly writes a list of strings to stdout."""
+        saved_stdout = sys.stdout
+        try:
+            out = StringIO()
+            sys.stdout = out
+            write_list_of_strings('foo', ['bar', 'baz'], '-')
+            self.assertEqual(out.getvalue(), 'bar\nbaz\n')
+            self.assertFalse(out.closed)
+        finally:
+            sys.stdout = saved_stdout
+
     def test_print_list_of_strings(self):
         """Correctly prints a list of strings."""
         # Save stdout and replace it with something that will capture the print
@@ -77,6 +132,34 @@ class OutputHandlerTests(TestCase):
         finally:
             sys.stdout = saved_stdout
 
+    def test_print_list_of_strings_non_strings(self):
+        """Prints items that aren't strings as print would."""
+        saved_stdout = sys.stdout
+        try:
+            out = StringIO()
+            sys.stdout = out
+            print_list_of_strings('this is ignored', [1, 2.5, None, 'foo'])
+
+            self.assertEqual(out.getvalue(), '1\n2.5\nNone\nfoo\n')
+        finally:
+            sys.stdout = saved_stdout
+
+    def test_print_list_of_strings_iterable(self):
+        """Correctly prints an iterator of strings spanning many chunks."""
+        saved_stdout = sys.stdout
+        saved_chunk_lines = output_handler.WRITE_CHUNK_LINES
+        try:
+            out = StringIO()
+            sys.stdout = out
+            output_handler.WRITE_CHUNK_LINES = 2
+            print_list_of_strings('this is ignored',
+                                  (s for s in ['foo', 'bar', 'baz']))
+
+            self.assertEqual(out.getvalue(), 'foo\nbar\nbaz\n')
+        finally:
+            sys.stdout = saved_stdout
+            output_handler.WRITE_CHUNK_LINES = saved_chunk_lines
+
 
 if __name__ == '__main__':
     main()
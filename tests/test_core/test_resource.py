@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from threading import Thread
+from time import sleep
+from unittest import TestCase, main
+
+from pyqi.core.command import Command, CommandOut, ParameterCollection
+from pyqi.core.exception import IncompetentDeveloperError
+from pyqi.core.resource import Resource, loaded_resources, release_all
+
+class ResourceTests(TestCase):
+    def setUp(self):
+        self.loads = []
+        self.releases = []
+
+    def tearDown(self):
+        release_all()
+
+    def make(self, name='db'):
+        def load():
+            self.loads.append(name)
+            sleep(0.01)
+            return {'name': name}
+        return Resource(name, load, self.releases.append)
+
+    def test_get(self):
+        """The value is loaded once, however many threads ask for it"""
+        resource = self.make()
+        self.assertFalse(resource.loaded)
+
+        values = []
+        getters = [Thread(target=lambda: values.append(resource.get()))
+                   for i in range(5)]
+        for getter in getters:
+            getter.start()
+        for getter in getters:
+            getter.join()
+
+        self.assertEqual(self.loads, ['db'])
+        self.assertTrue(all(value is values[0] for value in values))
+        self.assertTrue(resource.loaded)
+        self.assertEqual(loaded_resources(), [resource])
+
+    def test_release(self):
+        """Released values are passed to Release, and loaded again later"""
+        resource = self.make()
+        value = resource.get()
+        resource.release()
+        self.assertEqual(self.releases, [value])
+        self.assertFalse(resource.loaded)
+        self.assertEqual(loaded_resources(), [])
+
+        resource.release()
+        self.assertEqual(len(self.releases), 1)
+        resource.get()
+        self.assertEqual(self.loads, ['db', 'db'])
+
+    def test_release_inherited(self):
+        """Values loaded by another process are forgotten, not released"""
+        resource = self.make()
+        resource.get()
+        resource._pid = -1
+        resource.release()
+        self.assertEqual(self.releases, [])
+        self.assertFalse(resource.loaded)
+
+    def test_release_all(self):
+        """Everything is released, the latest loaded first"""
+        def fail(value):
+            raise ValueError("can't release")
+        failing = Resource('failing', lambda: 1, fail)
+        first, second = self.make('first'), self.make('second')
+        first.get()
+        failing.get()
+        second.get()
+
+        self.assertRaises(ValueError, release_all)
+        self.assertEqual([v['name'] for v in self.releases],
+                         ['second', 'first'])
+        self.assertEqual(loaded_resources(), [])
+
+    def test_init(self):
+        self.assertRaises(IncompetentDeveloperError, Resource, 'x', None)
+
+class CommandResourceTests(TestCase):
+    def setUp(self):
+        self.loads = []
+        resource = Resource('model', lambda: self.loads.append(1) or 'm')
+
+        class Predict(Command):
+            Resources = [resource]
+            CommandOuts = ParameterCollection([CommandOut('model', str, '')])
+            def run(self, **kwargs):
+                return {'model': self.resource('model')}
+        self.Predict = Predict
+
+    def tearDown(self):
+        release_all()
+
+    def test_resource(self):
+        """Every instance shares the loaded value"""
+        self.assertEqual(self.Predict()(), {'model': 'm'})
+        self.assertEqual(self.Predict()(), {'model': 'm'})
+        self.assertEqual(self.loads, [1])
+        self.assertRaises(IncompetentDeveloperError,
+                          self.Predict().resource, 'nope')
+
+    def test_warmup(self):
+        cmd = self.Predict()
+        cmd.warmup()
+        self.assertEqual(self.loads, [1])
+        cmd()
+        self.assertEqual(self.loads, [1])
+
+        cmd.release_resources()
+        cmd()
+        self.assertEqual(self.loads, [1, 1])
+
+if __name__ == '__main__':
+    main()
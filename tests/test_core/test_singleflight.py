@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase, main
+
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.singleflight import SingleFlight, call_key
+
+class Slow(Command):
+    CommandIns = ParameterCollection([
+        CommandIn('a', int, '', Required=True),
+        CommandIn('b', list, '', Required=False, Default=None)])
+    CommandOuts = ParameterCollection([CommandOut('calls', int, '')])
+    Deduplicate = True
+
+    def __init__(self, **kwargs):
+        super(Slow, self).__init__(**kwargs)
+        self.calls = 0
+        self.release = Event()
+
+    def run(self, **kwargs):
+        self.calls += 1
+        self.release.wait()
+        if kwargs['a'] < 0:
+            raise ValueError("negative")
+        return {'calls': self.calls}
+
+class CallKeyTests(TestCase):
+    def test_call_key(self):
+        """Calls with the same inputs and defaults have the same key"""
+        cmd = Slow()
+        self.assertEqual(call_key(cmd, {'a': 1}),
+                         call_key(cmd, {'a': 1, 'b': None}))
+        self.assertEqual(call_key(cmd, {'a': 1, 'b': [{'x': 1, 'y': 2}]}),
+                         call_key(cmd, {'b': [{'y': 2, 'x': 1}], 'a': 1}))
+        self.assertNotEqual(call_key(cmd, {'a': 1}), call_key(cmd, {'a': 2}))
+        self.assertNotEqual(call_key(cmd, {'a': 1}),
+                            call_key(cmd, {'a': True}))
+        self.assertNotEqual(call_key(cmd, {'a': 1, 'b': [1]}),
+                            call_key(cmd, {'a': 1, 'b': (1,)}))
+
+    def test_no_key(self):
+        """Calls that can't be shared have no key"""
+        self.assertEqual(call_key(Slow(), {'a': 1, 'b': [object()]}), None)
+        self.assertEqual(call_key(Slow(), {'a': 1, 'b': [set([1, 'x'])]}),
+                         None)
+        self.assertEqual(call_key(Command(), {}), None)
+
+class SingleFlightTests(TestCase):
+    def test_call(self):
+        """Identical calls in flight share one execution"""
+        flights = SingleFlight()
+        cmd = Slow()
+        results = []
+        def call(**kwargs):
+            results.append(flights.call(cmd, **kwargs))
+
+        callers = [Thread(target=call, kwargs={'a': 1}) for i in range(5)]
+        for caller in callers:
+            caller.start()
+        while flights.in_flight() < 1 or cmd.calls < 1:
+            sleep(0.001)
+        # Give the others time to join the flight.
+        sleep(0.05)
+        cmd.release.set()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(cmd.calls, 1)
+        self.assertEqual(results, [{'calls': 1}] * 5)
+        self.assertEqual(flights.in_flight(), 0)
+
+        # Once it finished, a call runs again.
+        self.assertEqual(flights.call(cmd, a=1), {'calls': 2})
+
+    def test_error(self):
+        """Calls sharing an execution share its error"""
+        flights = SingleFlight()
+        cmd = Slow()
+        errors = []
+        def call():
+            try:
+                flights.call(cmd, a=-1)
+            except ValueError as e:
+                errors.append(e)
+
+        callers = [Thread(target=call) for i in range(3)]
+        for caller in callers:
+            caller.start()
+        while cmd.calls < 1:
+            sleep(0.001)
+        sleep(0.05)
+        cmd.release.set()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(cmd.calls, 1)
+        self.assertEqual(len(errors), 3)
+
+    def test_not_shared(self):
+        """Commands that don't set Deduplicate run every time"""
+        class Counter(Command):
+            CommandOuts = ParameterCollection([CommandOut('calls', int, '')])
+            calls = 0
+            def run(self, **kwargs):
+                self.calls += 1
+                return {'calls': self.calls}
+
+        flights = SingleFlight()
+        cmd = Counter()
+        flights.call(cmd)
+        self.assertEqual(flights.call(cmd), {'calls': 2})
+
+if __name__ == '__main__':
+    main()
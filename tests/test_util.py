@@ -12,9 +12,15 @@ from __future__ import division
 __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
                "Jai Ram Rideout"]
 
+import os
 import pyqi
-from unittest import TestCase, main
-from pyqi.util import get_version_string
+from glob import glob
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main, skipIf
+from pyqi.util import (get_version_string, is_py2, glob_paths, PathStatCache,
+                       iter_response_file)
 from pyqi.core.exception import MissingVersionInfoError
 
 
@@ -32,5 +38,105 @@ class UtilTests(TestCase):
         with self.assertRaises(ImportError):
             _ = get_version_string('hopefully.bogus.python.module')
 
+class ResponseFileTests(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.fp = join(self.dir, 'args.txt')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def _write(self, contents):
+        with open(self.fp, 'w') as f:
+            f.write(contents)
+
+    def test_iter_response_file_lines(self):
+        """Newline-delimited entries, across chunk boundaries"""
+        self._write('--foo\nbar baz\n\nsome/path.txt\nlast')
+        exp = ['--foo', 'bar baz', 'some/path.txt', 'last']
+        self.assertEqual(list(iter_response_file(self.fp)), exp)
+        self.assertEqual(list(iter_response_file(self.fp, chunk_size=3)), exp)
+
+    def test_iter_response_file_nul(self):
+        """NUL-delimited entries may contain newlines"""
+        self._write('a\nb\0c\0\0d\0')
+        exp = ['a\nb', 'c', 'd']
+        self.assertEqual(list(iter_response_file(self.fp)), exp)
+        self.assertEqual(list(iter_response_file(self.fp, chunk_size=4)), exp)
+
+    def test_iter_response_file_empty(self):
+        self._write('')
+        self.assertEqual(list(iter_response_file(self.fp)), [])
+
+class GlobPathsTests(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        for d in ['a', join('a', 'b'), join('a', '.hidden'), 'c']:
+            os.mkdir(join(self.dir, d))
+        for f in ['x.txt', 'y.txt', '.z.txt', join('a', 'x.txt'),
+                  join('a', 'b', 'x.txt'), join('a', '.hidden', 'x.txt'),
+                  join('c', 'w.log')]:
+            open(join(self.dir, f), 'w').close()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_glob_paths(self):
+        """Matches are the same as glob's, sorted, one list per pattern."""
+        patterns = [join(self.dir, p) for p in ['*.txt', '.*', '*',
+                                                join('*', '*.txt'),
+                                                join('a', '*', 'x.txt'),
+                                                join('**', 'x.txt'),
+                                                join('a', '**'),
+                                                'x.txt', 'nope', 'nope*']]
+        obs = glob_paths(patterns)
+        self.assertEqual(len(obs), len(patterns))
+        for pattern, paths in zip(patterns[:5], obs[:5]):
+            self.assertEqual(paths, sorted(glob(pattern)))
+
+        # ** matches zero or more (non-hidden) directories.
+        exp = [join(self.dir, p) for p in [join('a', 'b', 'x.txt'),
+                                           join('a', 'x.txt'), 'x.txt']]
+        self.assertEqual(obs[5], exp)
+        exp = [join(self.dir, 'a', p) for p in ['', 'b', join('b', 'x.txt'),
+                                                'x.txt']]
+        self.assertEqual(obs[6], exp)
+
+        self.assertEqual(obs[-3], [join(self.dir, 'x.txt')])
+        self.assertEqual(obs[-2], [])
+        self.assertEqual(obs[-1], [])
+
+    @skipIf(is_py2(), "glob can't match ** recursively on Python 2")
+    def test_glob_paths_relative(self):
+        """Relative patterns match the same paths as a recursive glob."""
+        patterns = ['*.txt', join('**', '*.txt'), '**', join('a', '**'),
+                    join('**', 'b'), join('*', '**', 'x.txt'),
+                    join('**', '*.log')]
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            obs = glob_paths(patterns)
+            for pattern, paths in zip(patterns, obs):
+                self.assertEqual(paths, sorted(glob(pattern, recursive=True)))
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(obs[1], [join('a', 'b', 'x.txt'), join('a', 'x.txt'),
+                                  'x.txt', 'y.txt'])
+        self.assertFalse('' in obs[2])
+
+    def test_glob_paths_stat_cache(self):
+        """Types of listed and prefetched paths are cached."""
+        stat_cache = PathStatCache()
+        stat_cache.PoolThreshold = 0
+        glob_paths([join(self.dir, '*'), join(self.dir, 'nope')], stat_cache)
+
+        # Swap out the filesystem: cached answers must not change.
+        rmtree(join(self.dir, 'c'))
+        os.mkdir(join(self.dir, 'nope'))
+        self.assertTrue(stat_cache.isdir(join(self.dir, 'c')))
+        self.assertTrue(stat_cache.isfile(join(self.dir, 'x.txt')))
+        self.assertFalse(stat_cache.exists(join(self.dir, 'nope')))
+
 if __name__ == '__main__':
     main()